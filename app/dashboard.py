@@ -9,15 +9,28 @@ import utils as u
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "modules")))
 
-import plots
 import variables as v
 
 st.set_page_config(layout="wide")
 st.title('MEPS Cancer Analysis Dashboard')
 st.markdown('')
+u.start_instrumentation()  # Per-stage timings when MEPS_INSTRUMENT=1 (see modules/instrument.py)
 
 # 0. Load data and initial values
-df = u.load_data()
+counts = u.load_cube()  # Person counts (available years)
+
+# 0.1. Year choice (only when several MEPS years are available):
+selected_years = ()
+years = counts.dim_labels(v.year_col)
+if len(years) > 1:
+    year_options = st.multiselect("Year(s)", years, default=[years[-1]])
+    if len(year_options) != 0:
+        selected_years = u.normalize_selection(year_options, years)
+
+# 0.2. Population estimates (only when the data has MEPS survey weights):
+weighted = False
+if u.has_design():
+    weighted = st.toggle("Population estimates (survey weights)")
 
 # -------
 # Block 1
@@ -39,19 +52,15 @@ dem_choice = st.radio(
 
 dem_feat = dict(zip(dem_choices, dem_feats))[dem_choice]  # {"Age": v.age_col, "Sex": v.sex_col, "Race": v.race_col}
 
-# 1.2.1. Age:
-if dem_choice == v.dash_age_feat:
-    u.plot_hist_age(df, height=v.dash_plot_height)
-
-# 1.2.2-3. Sex and Race
-else:
-    u.plot_pie(df=df, x=dem_feat, title=dem_choice, height=v.dash_plot_height)
+# 1.2. Age histogram, Sex and Race pies (pre-rendered, see modules/figstore.py):
+u.plotly_chart(u.block1_figure(dem_feat, selected_years, weighted), name='block1')
 
 # -------
 # Block 2
 # -------
 # 2. Cancer dependency
 @st.fragment
+@u.instrumented('block2')
 def block2():
     """Display cancer dependency analysis with demographic features."""
     st.subheader("Cancer dependency")
@@ -80,27 +89,9 @@ def block2():
 
     cancer_feat = {"Cancer diagnosis": v.cancer_feat, "Cancer types": v.cancer_feat_type}[cancer_choice]
 
-    # 2.1.1 Exclude No Cancer cases:
-    if exclude_no:
-        df_sub = df[df[v.cancer_feat_type] != v.no_ans]
-    else:
-        df_sub = df
-
-    # 2.2. Plot area:
-    if dem_choice == v.dash_age_feat:
-        if cancer_choice == cancer_options[0]:
-            category_orders = np.sort(list(v.cancer_colors.keys()))
-            color_discrete_map = v.cancer_colors
-        else:
-            category_orders = v.cancer_type_order
-            color_discrete_map = v.cancer_type_colors
-
-        fig = u.boxplot(df_sub, cancer_feat, dem_feat, category_orders, color_discrete_map)
-
-    else:
-        fig = u.crosstab_plot(df_sub, cancer_feat, dem_feat)
-
-    st.plotly_chart(fig, use_container_width=True)
+    # 2.2. Plot area (pre-rendered, No Cancer cases are excluded if chosen):
+    fig = u.block2_figure(cancer_feat, dem_feat, exclude_no, selected_years, weighted)
+    u.plotly_chart(fig, name='block2')
 
     # 2.3. Conclusion:
     if cancer_feat == v.cancer_feat:
@@ -114,6 +105,7 @@ def block2():
 # -------
 # 3. Filters
 @st.fragment
+@u.instrumented('block3')
 def block3(dem_feat):
     """Display filtered demographic distributions based on user selections."""
     st.subheader("Other demographic features dependency")
@@ -121,18 +113,16 @@ def block3(dem_feat):
     # Get non-chosen features:
     other_mask = np.array(dem_feats) != dem_feat
     other_dem_feats = np.array(dem_feats)[other_mask]
-    other_dem_feats_types = np.array(v.dash_dem_feats_types)[other_mask]
 
     # 3.0. If choice is Age, let's create categories (18-39, 40-64, 65-85):
     if dem_feat == v.age_col:
         dem_feat = v.age_col_cat
 
-    # 3.1. Create filters:
+    # 3.1. Create filters (options are computed once per year selection):
     col1, col2 = st.columns(2)
-    cancer_types = df[v.cancer_feat_type].unique()
-    cancer_types = np.sort(cancer_types)
-    dem_types = df[dem_feat].unique()
-    dem_types = np.sort(dem_types)
+    options = u.filter_options(selected_years)
+    cancer_types = options[v.cancer_feat_type]
+    dem_types = options[dem_feat]
 
     # 3.2. Selection area:
     with col1:
@@ -147,56 +137,37 @@ def block3(dem_feat):
             dem_types,
         )
 
-    # 3.3. Get subset with chosen filters:
-    df_sub = df.copy()
-    if len(cancer_options) != 0:
-        df_sub = df_sub[df_sub[v.cancer_feat_type].isin(cancer_options)]
-    if len(dem_options) != 0:
-        df_sub = df_sub[df_sub[dem_feat].isin(dem_options)]
+    # 3.3. Get counts and figures of the chosen filters (cached across sessions):
+    view = u.block3_view(
+        selected_years,
+        dem_feat,
+        u.normalize_selection(cancer_options, cancer_types),
+        u.normalize_selection(dem_options, dem_types),
+        tuple(map(str, other_dem_feats)),
+        weighted,
+    )
+    n_sub = view['n_sub']
 
     # 3.4. Plots area:
     st.metric(
         "Number of persons:",
-        len(df_sub),
-        delta=f"{len(df_sub) / len(df) * 100:.1f}% of all data",
+        n_sub,
+        delta=f"{n_sub / view['n_all'] * 100:.1f}% of all data",
     )
 
-    if len(df_sub) == 0:
+    if n_sub == 0:
         st.warning('No data for selected filters.')
         st.info("Try changing the filter settings.")
         return
 
-    # Create structure with plots:
-    # Create cancer plot if cancer option was not chosen:
-    if len(cancer_options) == 0:
-        cols = st.columns(3)
-        col_i_start = 1
-        # Distribution of cancer:
-
-        with cols[0]:
-            yes_no_counts = df_sub[v.cancer_feat].value_counts()
-            yes_no_prop =  df_sub[v.cancer_feat].value_counts(normalize=True)
-            yes_no_prop = (yes_no_prop * 100).round(1)
-            title = 'Cancer types<br>'
-            title += f'No: {yes_no_counts.loc[v.no_ans]} ({yes_no_prop.loc[v.no_ans]} %) /<br>'
-            title += f'Yes: {yes_no_counts.loc[v.yes_ans]} ({yes_no_prop.loc[v.yes_ans]} %)'
-            fig_cancer = plots.pie(df_sub[df_sub[v.cancer_feat_type] != v.no_ans], v.cancer_feat_type, title, v.cancer_type_colors,
-                      v.cancer_type_order, show_fig=False, return_fig=True)
-            fig_cancer.update_layout(height=v.dash_plot_height, showlegend=False)
-            st.plotly_chart(fig_cancer, use_container_width=True)
-    else:
-        cols = st.columns(2)
-        col_i_start = 0
-
-    # Plot other non_chosen two demographic features distributions:
-    for i in range(2):
-        with cols[i+col_i_start]:
-            if other_dem_feats_types[i] == 'cont':
-                u.plot_hist_age(df=df_sub, x=v.age_col, title=v.dash_age_feat, height=v.dash_plot_height)
-            elif other_dem_feats_types[i] == 'cat':
-                u.plot_pie(df=df_sub, x=other_dem_feats[i], title=None)
-
+    # Create structure with plots (cancer types pie first if cancer option was not chosen):
+    cols = st.columns(len(view['figs']))
+    for i, (col, fig) in enumerate(zip(cols, view['figs'])):
+        with col:
+            u.plotly_chart(fig, name=f'block3_{i}')
 
 block2()
 
 block3(dem_feat)   # Explicit parameter to avoid shadowing
+
+u.flush_instrumentation(sidebar=True)
@@ -1,99 +1,55 @@
+import functools
 import os
 import sys
+import uuid
+from statistics import NormalDist
 import streamlit as st
-import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 import pandas as pd
 import numpy as np
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "modules")))
 
+import bitmap
+import bootstrap
+import cube
+import figstore
+import instrument
+import panel
 import plots
+import survey
 import variables as v
+import views
 
+BLOCK3_CACHE_SIZE = 256  # Filter combinations of block 3 kept in memory (shared by all sessions)
 
-@st.cache_data
+
+@instrument.timed(rows=len)
+@st.cache_resource
 def load_data():
-    """Load and preprocess MEPS cancer analysis data."""
-    # Load data:
-    data_path = os.path.join(os.path.dirname(__file__), os.pardir, "data", "h216.dta")
+    """
+    Load and preprocess MEPS cancer analysis data of all available years.
 
+    Each year is preprocessed in a separate process and served from the on-disk
+    cache in data/cache (see modules/panel.py and modules/cache.py). The frame is
+    loaded once per process and shared by all sessions and reruns without copies;
+    its column buffers are read-only (see `panel.read_only`), so it must not be
+    modified - derive new frames instead.
+    """
     try:
-        if not os.path.exists(data_path):
-            st.error(f"Data file not found: {data_path}")
-            st.info("Make sure h216.dta is located in the data/ directory.")
+        years = panel.available_years()
+        if len(years) == 0:
+            st.error(f"No data files found in: {os.path.normpath(panel.DEFAULT_DATA_DIR)}")
+            st.info(f"Make sure {v.meps_files[v.default_year]} is located in the data/ directory.")
             st.stop()
 
-        cols = [v.cancer_feat, v.age_col, v.sex_col, v.race_col]
-        cols = np.concatenate((cols, v.cancer_types))
-        df = pd.read_stata(data_path, columns=cols)
+        df = panel.load_panel(years)
 
         if df.empty:
             st.error("Loaded data is empty.")
             st.stop()
 
-        # Change categorical columns to object type:
-        df_cat = df.select_dtypes('category')
-        df[df_cat.columns] = df_cat.astype('object')
-
-        # Drop inapplicable answers:
-        df = df.loc[~df[v.cancer_feat].isin(v.vals_to_drop), :]
-
-        # Replace answers:
-        df[v.cancer_feat] = df[v.cancer_feat].replace({v.yes_raw_ans: v.yes_ans, v.no_raw_ans: v.no_ans})
-
-        # Number of cancer types per patient:
-        df[v.cancer_bool_types] = df.loc[:, v.cancer_types] == v.yes_raw_ans
-        df[v.cancer_mult] = df.loc[:, v.cancer_bool_types].sum(axis=1)
-        df[v.mult_col] = df[v.cancer_mult] > 1
-        df[v.mult_col] = df[v.mult_col].replace({False: v.no_ans, True: v.yes_ans})
-        df[v.cancer_feat_type] = df.loc[:, v.cancer_feat]
-
-        cancer_type_names = np.append(v.cancer_type_names, v.mult_col)
-        for bool_type, type_name in zip(v.cancer_bool_types, cancer_type_names):
-            df.loc[df[bool_type], v.cancer_feat_type] = f'1. {type_name}'
-
-        df.loc[df.loc[:, v.cancer_mult] > 1, v.cancer_feat_type] = v.mult_ans
-
-        df[v.cancer_feat_type] = df[v.cancer_feat_type].replace({v.no_raw_ans: v.no_ans})
-
-        # Add DK or Refused category:
-        df[v.cancer_feat_type] = df[v.cancer_feat_type].replace({v.yes_ans: v.dk_refused_ans})
-
-        # Replace invalid or missing values in cancer_type columns with None for proper data handling:
-        df[v.cancer_types] = df[v.cancer_types].replace({'-8 DK': None, '-7 REFUSED': None})
-
-        # Inapplicable when CANCERDX is No
-        df[v.cancer_types] = df[v.cancer_types].replace({
-            v.no_raw_ans: v.no_ans,
-            '-1 INAPPLICABLE': v.no_ans,
-            v.yes_raw_ans: v.yes_ans
-        })
-
-        # Rename the columns to readable names:
-        df[cancer_type_names[:-1]] = df[v.cancer_types]  # -1 - to exclude Multiple
-        df = df.drop(columns=v.cancer_types)
-
-        # Race values correction:
-        df[v.race_col] = df[v.race_col].str.replace(r' - NO OTHER RACE REPORTED$', '', regex=True)
-        df[v.race_col] = df[v.race_col].str.replace(r'-NO OTH$', '', regex=True)
-        df[v.race_col] = df[v.race_col].str.replace(r'-NO OTHER RACE$', '', regex=True)
-        df[v.race_col] = df[v.race_col].replace(
-            {
-                "3 AMER INDIAN/ALASKA NATIVE": "3 INDIAN/\nALASKA",
-                "4 ASIAN/NATV HAWAIIAN/PACFC ISL": "4 ASIAN/\nHAWAIIAN",
-                "6 MULTIPLE RACES REPORTED": "6 MULTIPLE",
-            }
-        )
-        # For Age choice, let's create categories (18-39, 40-64, 65-85):
-        df[v.age_col_cat] = pd.cut(
-            df[v.age_col],
-            bins=v.age_bins,
-            labels=v.age_groups,
-            include_lowest=True
-        )
-
-        return df
+        return panel.read_only(df)
 
 
     except FileNotFoundError as e:
@@ -111,150 +67,317 @@ def load_data():
 
 
 
-def plot_hist_age(df, x=v.age_col, title='Age', height=v.dash_plot_height):
+@st.cache_resource
+def load_index():
+    """Build the bitmap index of the loaded data (see modules/bitmap.py)."""
+    return bitmap.BitmapIndex.build(load_data())
+
+
+@st.cache_data
+def has_design():
+    """Return True if the loaded data has survey weights, i.e. population estimates are available."""
+    return survey.has_design(load_data())
+
+
+@instrument.timed()
+@st.cache_resource
+def load_cube(weighted=False):
     """
-    Plot age distribution histogram with 2-year bins.
+    Build the count cube of the loaded data (see modules/cube.py).
+
+    Like `load_data`, the cube is built once per process and shared read-only by all
+    sessions and reruns.
 
     Args:
-        df (pd.DataFrame): Input dataframe.
-        x (str): Column name for age data. Defaults to v.age_col.
-        title (str): Plot title. Defaults to 'Age'.
-        height (int): Plot height in pixels. Defaults to 400.
+        weighted (bool): If True, cells hold population estimates (sums of person weights)
+            instead of respondent counts. Requires `has_design()`.
     """
-    fig_dist = px.histogram(df, x=x, title=title)
-    fig_dist.update_traces(textfont_size=20, textposition="inside",
-                           texttemplate="%{y:.0f}")
-    fig_dist.update_traces(
-        xbins=dict(
-            start=df[v.age_col].min(),
-            end=df[v.age_col].max() + 1,
-            size=2,
-        )
-    )
-    fig_dist.update_layout(height=height)
-    st.plotly_chart(fig_dist, use_container_width=True)
-
-
-def plot_pie(df, x, title=None, height=v.dash_plot_height, **kwargs):
+    return cube.CountCube.build(load_data(), weights=v.weight_col if weighted else None).read_only()
+
+
+@st.cache_data
+def figure_key():
+    """Return the figure store key of the loaded data (see modules/figstore.py)."""
+    return figstore.data_key(load_cube())
+
+
+def _year_filter(years):
+    """Return the filter of a year selection (empty - all years)."""
+    return {v.year_col: list(years)} if len(years) != 0 else {}
+
+
+@instrument.timed()
+@st.cache_data
+def block1_figure(dem_feat, years=(), weighted=False):
     """
-    Create and display a pie chart for categorical variable distribution.
+    Return the demographic distribution of block 1.
+
+    Figures of respondent counts are read from the pre-rendered figure store when it has
+    been warmed (`python modules/figstore.py`), and computed otherwise.
 
     Args:
-       df (pd.DataFrame): Input dataframe.
-       x (str): Column name for categorical variable.
-       title (str, optional): Plot title. Uses column name if None.
-       height (int): Plot height in pixels. Defaults to 400.
-       **kwargs: Additional arguments passed to plots.pie().
+        dem_feat (str): v.age_col, v.sex_col or v.race_col.
+        years (tuple): Selected years. Empty - all years.
+        weighted (bool): If True, use population estimates (see `load_cube`).
+
+    Returns:
+        plotly.graph_objects.Figure: Age histogram or pie chart.
     """
-    if title is None:
-        title = x
-    fig_dist = plots.pie(df, x, show_fig=False, return_fig=True, title=title, **kwargs)
-    fig_dist.update_layout(height=height, showlegend=False)
-    st.plotly_chart(fig_dist, use_container_width=True)
+    if not weighted:
+        fig = figstore.load(figure_key(), figstore.block1_state(dem_feat, years))
+        if fig is not None:
+            return fig
+    return views.block1_figure(load_cube(weighted), dem_feat, _year_filter(years))
 
 
-def expander_conclusion(conclusion, title="Conclusion"):
+@instrument.timed()
+@st.cache_data
+def block2_figure(cancer_feat, dem_feat, exclude_no=False, years=(), weighted=False):
     """
-    Display conclusion text in an expandable section.
+    Return the cancer dependency figure of block 2 (pre-rendered like `block1_figure`).
 
     Args:
-        conclusion (str): Text content to display.
-        title (str): Expander title. Defaults to "Conclusion".
+        cancer_feat (str): v.cancer_feat or v.cancer_feat_type.
+        dem_feat (str): v.age_col (box plot), v.sex_col or v.race_col (crosstab heatmaps).
+        exclude_no (bool): If True, persons without cancer are excluded.
+        years (tuple): Selected years. Empty - all years.
+        weighted (bool): If True, use population estimates (see `load_cube`).
+
+    Returns:
+        plotly.graph_objects.Figure: Box plot or figure with two heatmap subplots.
     """
-    with st.expander(title):
-        st.write(conclusion)
+    if not weighted:
+        fig = figstore.load(figure_key(), figstore.block2_state(cancer_feat, dem_feat, exclude_no, years))
+        if fig is not None:
+            return fig
+    filters = views.block2_filters(_year_filter(years), exclude_no)
+    if dem_feat == v.age_col:
+        return views.block2_figure(load_cube(weighted), cancer_feat, dem_feat, filters)
+    return crosstab_view(cancer_feat, dem_feat, filters, weighted)
+
+
+def normalize_selection(values, options):
+    """
+    Return a multiselect selection as a tuple in option order.
+
+    Selections made in a different click order map to the same tuple, so they share cache entries.
+
+    Args:
+        values (list): Selected values.
+        options (list): All options in display order.
+
+    Returns:
+        tuple: Selected options in the order of `options`.
+    """
+    selected = set(values)
+    return tuple(option for option in options if option in selected)
+
+
+@instrument.timed()
+@st.cache_data
+def filter_options(years=()):
+    """
+    Return the observed labels of the filter features for the selected years.
 
-def boxplot(df, cat_feat, cont_feat, category_orders, color_discrete_map):
+    Args:
+        years (tuple): Selected years. Empty - all years.
+
+    Returns:
+        dict: Mapping feature -> list of labels with at least one person, in category order.
+    """
+    counts = load_cube()
+    year_filter = {v.year_col: list(years)}
+    feats = [v.cancer_feat_type, v.sex_col, v.race_col, v.age_col_cat]
+    return {feat: list(counts.marginal(feat, year_filter, observed=True).index) for feat in feats}
+
+
+@instrument.timed(rows=lambda view: view['n_sub'])
+@st.cache_data(max_entries=BLOCK3_CACHE_SIZE)
+def block3_view(years, dem_feat, cancer_types, dem_values, other_dem_feats, weighted=False):
     """
-    Create a box plot to visualize the distribution of a continuous variable
-    across categorical groups.
+    Compute the person counts and figures of the filtered demographic view (block 3).
+
+    The cache is shared by all sessions and bounded to BLOCK3_CACHE_SIZE entries (least recently
+    used first out). Selections must be normalized with `normalize_selection`, so equal
+    selections hit the same entry.
 
     Args:
-        df (pd.DataFrame): Input dataframe with data.
-        cat_feat (str): Name of the categorical column (Y-axis).
-        cont_feat (str): Name of the continuous column (X-axis).
-        category_orders (list): Desired order of categories on the axis.
-        color_discrete_map (dict): Mapping from category values to colors.
+        years (tuple): Selected years. Empty - all years.
+        dem_feat (str): Filtered demographic feature (v.age_col_cat instead of v.age_col).
+        cancer_types (tuple): Selected cancer types. Empty - no filter.
+        dem_values (tuple): Selected values of `dem_feat`. Empty - no filter.
+        other_dem_feats (tuple): Demographic features to plot (v.age_col is plotted as a histogram).
+        weighted (bool): If True, use population estimates (see `load_cube`).
 
     Returns:
-        plotly.graph_objects.Figure: Configured box plot figure.
+        dict: 'n_sub' - number of persons matching the filters, 'n_all' - number of persons
+            of the selected years, 'figs' - list of figures (the cancer type pie first if no
+            cancer type is selected, then one figure per feature of `other_dem_feats`).
     """
-    fig = px.box(
-        df,
-        x=cont_feat,
-        y=cat_feat,
-        orientation="h",
-        color=cat_feat,
-        category_orders={cat_feat: category_orders},
-        color_discrete_map=color_discrete_map,
-        points=False,
-    )
+    counts = load_cube(weighted)
+    year_filter = {v.year_col: list(years)}
+    filters = {**year_filter, v.cancer_feat_type: list(cancer_types), dem_feat: list(dem_values)}
+
+    view = {'n_sub': counts.total(filters), 'n_all': counts.total(year_filter), 'figs': []}
+    if view['n_sub'] == 0:
+        return view
+
+    # Distribution of cancer if cancer types are not filtered:
+    ci = None
+    if len(cancer_types) == 0:
+        ci = share_intervals(v.cancer_feat, None, filters, 'all', weighted)[1:]
+    view['figs'] = views.block3_figures(counts, filters, other_dem_feats, ci)
+    return view
 
-    fig.update_layout(showlegend=False)
 
-    return fig
+@instrument.timed()
+def share_intervals(feat1, feat2, filters, normalize, weighted=False, level=v.ci_level):
+    """
+    Confidence intervals of the shares shown in the dashboard for the current filters.
+
+    Respondent counts get multinomial bootstrap intervals from the count cube
+    (`bootstrap.table_intervals`). Population estimates get normal intervals with
+    Taylor-linearized standard errors (`survey.proportions`).
 
+    Args:
+        feat1 (str): Row feature.
+        feat2 (str, optional): Column feature. If None, shares of `feat1` labels are returned.
+        filters (dict): Mapping feature -> list of selected labels.
+        normalize (str): 'index', 'columns' or 'all' (the latter for `feat2` None only).
+        weighted (bool): If True, intervals of population estimates. Defaults to False.
+        level (float): Confidence level. Defaults to v.ci_level.
 
-def crosstab_plot(df, feat1, feat2):
+    Returns:
+        tuple: (share, lower, upper) - DataFrames indexed like `CountCube.crosstab(feat1, feat2)`,
+            or Series indexed by `feat1` labels if `feat2` is None.
+    """
+    if not weighted:
+        counts = load_cube()
+        table = counts.marginal(feat1, filters) if feat2 is None else counts.crosstab(feat1, feat2, filters)
+        return bootstrap.table_intervals(table, normalize, level)
+
+    # Shares of `feat` within groups of `by`:
+    if feat2 is None:
+        feat, by = feat1, None
+    else:
+        feat, by = (feat2, feat1) if normalize == 'index' else (feat1, feat2)
+    estimates = survey.proportions(load_data(), feat, by=by, filters=filters, index=load_index())
+    z = NormalDist().inv_cdf(1 - (1 - level) / 2)
+    share = estimates['proportion']
+    lower = (share - z * estimates['se']).clip(0, 1)
+    upper = (share + z * estimates['se']).clip(0, 1)
+    if feat2 is None:
+        return share, lower, upper
+    result = [values.unstack() for values in (share, lower, upper)]
+    return tuple(table.T if normalize == 'columns' else table for table in result)
+
+
+@instrument.timed()
+@st.cache_data(max_entries=BLOCK3_CACHE_SIZE)
+def crosstab_view(feat1, feat2, filters, weighted=False):
     """
-    Create side-by-side heatmaps showing row-normalized and column-normalized
-    crosstab distributions between two categorical features.
+    Create the crosstab heatmaps of block 2 with confidence intervals (cached per filter state).
 
     Args:
-        df (pd.DataFrame): Input dataframe.
-        feat1 (str): First categorical feature (rows in crosstab).
-        feat2 (str): Second categorical feature (columns in crosstab).
+        feat1 (str): Row feature.
+        feat2 (str): Column feature.
+        filters (dict): Mapping feature -> list of selected labels.
+        weighted (bool): If True, use population estimates (see `load_cube`).
 
     Returns:
         plotly.graph_objects.Figure: Figure with two heatmap subplots.
     """
-    ct_abs = pd.crosstab(df[feat1], df[feat2])
-    ct_abs = ct_abs.sort_index().sort_index(axis=1)
-    counts = ct_abs.to_numpy()[..., None]
-    ct_h = pd.crosstab(df[feat1], df[feat2], normalize="index")
-    ct_h = ct_h.sort_index().sort_index(axis=1)
-    ct_v = pd.crosstab(df[feat1], df[feat2], normalize="columns")
-    ct_v = ct_v.sort_index().sort_index(axis=1)
-
-    fig = make_subplots(
-        rows=1, cols=2,
-        subplot_titles=("Row-normalized (horizontal)", "Column-normalized (vertical)"),
-        horizontal_spacing=0.08
-    )
-
-    z_text_h = (ct_h.values * 100)
-    z_text_v = (ct_v.values * 100)
-
-    fig.add_trace(
-        go.Heatmap(
-            z=ct_h.values,
-            x=ct_h.columns.astype(str),
-            y=ct_h.index.astype(str),
-            text=np.round(z_text_h, 1).astype(str) + "%",
-            texttemplate="%{text}",
-            customdata=counts,
-            hovertemplate="%{y} / %{x}<br>%{customdata[0]} patients (%{z:.2%})<extra></extra>",
-            zmin=0, zmax=1,
-            colorbar=dict(title="Share (row)")
-        ),
-        row=1, col=1
-    )
-
-    fig.add_trace(
-        go.Heatmap(
-            z=ct_v.values,
-            x=ct_v.columns.astype(str),
-            y=ct_v.index.astype(str),
-            text=np.round(z_text_v, 1).astype(str) + "%",
-            texttemplate="%{text}",
-            customdata=counts,
-            hovertemplate="%{y} / %{x}<br>%{customdata[0]} patients (%{z:.2%})<extra></extra>",
-            zmin=0, zmax=1,
-            colorbar=dict(title="Share (col)")
-        ),
-        row=1, col=2
-    )
-    fig.update_yaxes(autorange="reversed", row=1, col=1)
-    fig.update_yaxes(visible=False, row=1, col=2, autorange="reversed")
-
-    return fig
+    ci = {
+        normalize: share_intervals(feat1, feat2, filters, normalize, weighted)[1:]
+        for normalize in ('index', 'columns')
+    }
+    return views.block2_figure(load_cube(weighted), feat1, feat2, filters, ci=ci)
+
+
+def plotly_chart(fig, name='chart'):
+    """
+    Display a Plotly figure.
+
+    With instrumentation on (see modules/instrument.py), the serialization and sending of the
+    figure is recorded as stage 'chart_<name>' with the figure payload size.
+
+    Args:
+        fig (plotly.graph_objects.Figure): Figure to display.
+        name (str): Chart name used in the instrumentation records.
+    """
+    with instrument.stage(f'chart_{name}') as record:
+        st.plotly_chart(fig, use_container_width=True)
+    if instrument.enabled():
+        record['figure_bytes'] = instrument.figure_bytes(fig)
+
+
+def instrumented(scope):
+    """
+    Decorator recording a dashboard block (e.g. a fragment) as a stage and flushing its records.
+
+    Args:
+        scope (str): Name of the block.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not instrument.enabled():
+                return func(*args, **kwargs)
+            start = len(instrument.records())  # Records of the main script before the block
+            try:
+                with instrument.stage(scope):
+                    return func(*args, **kwargs)
+            finally:
+                flush_instrumentation(scope, start=start)
+        return wrapper
+    return decorator
+
+
+def start_instrumentation():
+    """Start the instrumentation records of a full rerun (call at the top of the script)."""
+    if not instrument.enabled():
+        return
+    state = st.session_state
+    if 'instrument_session' not in state:
+        state['instrument_session'] = uuid.uuid4().hex[:8]
+        state['instrument_rerun'] = 0
+    state['instrument_rerun'] += 1
+    state['instrument_records'] = []
+
+
+def flush_instrumentation(scope='script', sidebar=False, start=0):
+    """
+    Write the instrumentation records of the current run (see `instrument.flush`).
+
+    Args:
+        scope (str): 'script' for the main script, or the name of the fragment.
+        sidebar (bool): If True, show the records of the rerun in a debug sidebar panel.
+        start (int): Position of the first record of the block. Defaults to 0.
+    """
+    if not instrument.enabled():
+        return
+    state = st.session_state
+    batch = instrument.flush(start, session=state.get('instrument_session'), rerun=state.get('instrument_rerun'),
+                             scope=scope)
+    state.setdefault('instrument_records', []).extend(batch)
+
+    if sidebar:
+        with st.sidebar.expander("Instrumentation", expanded=False):
+            table = pd.DataFrame(state['instrument_records'])
+            if not table.empty:
+                table = table[['scope', 'stage', 'seconds', 'rows', 'memory_delta', 'figure_bytes']]
+                st.dataframe(table, hide_index=True)
+                st.caption(f"Total: {table['seconds'].sum():.3f} s, "
+                           f"{table['figure_bytes'].fillna(0).sum() / 1024:.0f} KB of figures")
+
+
+def expander_conclusion(conclusion, title="Conclusion"):
+    """
+    Display conclusion text in an expandable section.
+
+    Args:
+        conclusion (str): Text content to display.
+        title (str): Expander title. Defaults to "Conclusion".
+    """
+    with st.expander(title):
+        st.write(conclusion)
@@ -0,0 +1,233 @@
+# Benchmarks of the data and plotting hot paths
+#
+# Each case (preprocessing, dashboard figures, statistical tests) runs on the bundled data and on
+# synthetic frames scaled 10x, 100x, 1000x. The synthetic frames resample the rows of the bundled file
+# with replacement, so they keep its schema and category distributions. For each case and scale the
+# best wall time of several runs, the peak memory traced by tracemalloc during one extra run and the
+# size of the figure JSON (Plotly figures) are recorded, and compared with a stored baseline.
+#
+# To run it from the project root: `python benchmarks/hot_paths.py`
+# Record a baseline with `--save`, compare later runs with it (default: benchmarks/baseline.json);
+# the exit code is 1 on regressions and 2 if the baseline file is missing.
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import plotly.io as pio
+import streamlit  # noqa: F401 - registers the 'streamlit' Plotly template
+
+os.environ.setdefault('MPLBACKEND', 'Agg')  # plt.show() of the notebook helpers must not block
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.join(ROOT, 'modules'))
+
+import plots
+import preprocessing
+import stats
+import variables as v
+
+pio.templates.default = 'streamlit'  # Figure sizes are measured with the template of the dashboard
+
+DEFAULT_DATA = os.path.join(ROOT, 'data', v.meps_files[v.default_year])
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_SCALES = [1, 10, 100]  # 1000 is supported too (about 1 GB of preprocessed frame)
+
+# Allowed ratio to the baseline before a metric counts as a regression:
+TOLERANCES = {'seconds': 1.5, 'peak_mb': 1.25, 'figure_kb': 1.05}
+# Differences below these are measurement noise, not regressions (e.g. for sub-millisecond cases):
+NOISE = {'seconds': 0.005, 'peak_mb': 1.0, 'figure_kb': 0.0}
+
+
+def _close_figures():
+    """Close matplotlib figures created by a case (if matplotlib was loaded)."""
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+
+
+def _preprocess(frames):
+    return preprocessing.preprocess(frames['raw'].copy())
+
+
+def _crosstab_plot(frames):
+    return plots.crosstab_counts_plot(stats.contingency(frames['df'], v.cancer_feat, v.race_col))
+
+
+def _boxplot(frames):
+    table = stats.contingency(frames['df'], v.cancer_feat_type, v.age_col)
+    return plots.boxplot_counts(table, v.cancer_type_order, v.cancer_type_colors)
+
+
+def _hist_age(frames):
+    return plots.hist_age_fig(stats.age_counts(frames['df']), title=v.dash_age_feat)
+
+
+def _pie(frames):
+    return plots.pie(frames['df'], v.race_col, show_fig=False, return_fig=True)
+
+
+def _pairwise_mw(frames):
+    return plots.pairwise_mw(frames['df'], v.cancer_type_names, v.yes_ans, v.age_col)
+
+
+def _posthoc_heatmap(frames):
+    df = frames['df']
+    types = df[v.cancer_feat_type].cat.remove_unused_categories()
+    return plots.plot_posthoc_heatmap(df.assign(**{v.cancer_feat_type: types}), dv=v.age_col,
+                                      between=v.cancer_feat_type, padjust='holm', show_fig=False)
+
+
+# {case: (function of the frames, largest scale it runs on)}
+CASES = {
+    'preprocess': (_preprocess, 1000),
+    'crosstab_plot': (_crosstab_plot, 1000),
+    'boxplot': (_boxplot, 1000),
+    'hist_age': (_hist_age, 1000),
+    'pie': (_pie, 1000),
+    'pairwise_mw': (_pairwise_mw, 1000),
+    'posthoc_heatmap': (_posthoc_heatmap, 10),  # Pingouin tests every pair on the rows
+}
+
+
+def synthetic_frames(raw, df, scale, seed=0):
+    """
+    Scale the bundled frames by resampling their rows with replacement.
+
+    Args:
+        raw (pd.DataFrame): Raw frame (`preprocessing.read_raw`).
+        df (pd.DataFrame): Preprocessed frame.
+        scale (int): Size multiplier; 1 returns the frames unchanged.
+        seed (int): Seed of the resampling.
+
+    Returns:
+        dict: 'raw' and 'df' frames with `scale` times as many rows.
+    """
+    if scale == 1:
+        return {'raw': raw, 'df': df}
+    rng = np.random.default_rng(seed)
+    return {
+        'raw': raw.take(rng.integers(0, len(raw), len(raw) * scale)).reset_index(drop=True),
+        'df': df.take(rng.integers(0, len(df), len(df) * scale)).reset_index(drop=True),
+    }
+
+
+def measure(func, frames, repeat=3):
+    """
+    Benchmark one case.
+
+    Args:
+        func (callable): Case function of the frames.
+        frames (dict): Frames of `synthetic_frames`.
+        repeat (int): Number of timed runs; the best time is kept.
+
+    Returns:
+        dict: 'seconds' - best wall time, 'peak_mb' - peak traced memory of one run,
+            'figure_kb' - size of the Plotly figure JSON (None for other results).
+    """
+    times = []
+    for _ in range(repeat):
+        stats._contingency_cache.clear()  # Every run computes its tables
+        start = time.perf_counter()
+        result = func(frames)
+        times.append(time.perf_counter() - start)
+        _close_figures()
+
+    stats._contingency_cache.clear()
+    tracemalloc.start()
+    func(frames)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    _close_figures()
+
+    figure_kb = len(result.to_json()) / 1024 if hasattr(result, 'to_json') and hasattr(result, 'data') else None
+    return {'seconds': min(times), 'peak_mb': peak / 2 ** 20, 'figure_kb': figure_kb}
+
+
+def run(cases, scales, data_path=DEFAULT_DATA, repeat=3):
+    """
+    Run the benchmark cases on all scales.
+
+    Returns:
+        dict: Mapping 'case@scale' -> metrics (see `measure`).
+    """
+    raw = preprocessing.read_raw(data_path)
+    df = preprocessing.preprocess(raw.copy())
+
+    results = {}
+    for scale in scales:
+        frames = synthetic_frames(raw, df, scale)
+        for case in cases:
+            func, max_scale = CASES[case]
+            if scale > max_scale:
+                continue
+            key = f'{case}@{scale}'
+            results[key] = measure(func, frames, repeat)
+            print(_format(key, results[key]), file=sys.stderr)
+    return results
+
+
+def _format(key, metrics, baseline=None):
+    """Return one line of the result table."""
+    figure_kb = f"{metrics['figure_kb']:9.1f} KB" if metrics['figure_kb'] is not None else ' ' * 12
+    line = f"{key:24s} {metrics['seconds']:9.4f} s {metrics['peak_mb']:9.1f} MB {figure_kb}"
+    if baseline is not None:
+        line += f"  (x{metrics['seconds'] / baseline['seconds']:.2f} time, x{metrics['peak_mb'] / max(baseline['peak_mb'], 1e-9):.2f} memory)"
+    return line
+
+
+def compare(results, baseline):
+    """
+    Compare results with a baseline.
+
+    Returns:
+        list of str: Regressions (metrics above the baseline times `TOLERANCES` by more than `NOISE`).
+    """
+    regressions = []
+    for key, metrics in results.items():
+        if key not in baseline:
+            continue
+        for metric, tolerance in TOLERANCES.items():
+            value, reference = metrics[metric], baseline[key][metric]
+            if value is not None and reference is not None and value > max(reference * tolerance, reference + NOISE[metric]):
+                regressions.append(f'{key}: {metric} {value:.4g} > {tolerance} x baseline {reference:.4g}')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data and plotting hot paths.')
+    parser.add_argument('cases', nargs='*', default=list(CASES), help='Cases to run')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help='Data size multipliers')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case (best is used)')
+    parser.add_argument('--data', default=DEFAULT_DATA, help='Path to the MEPS .dta file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+    parser.add_argument('--save', action='store_true', help='Store the results as the baseline')
+    args = parser.parse_args()
+
+    results = run(args.cases, args.scales, args.data, args.repeat)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Baseline written: {os.path.normpath(args.baseline)}', file=sys.stderr)
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        for key, metrics in results.items():
+            print(_format(key, metrics))
+        print(f'ERROR: no baseline found: {os.path.normpath(args.baseline)} (record one with --save)', file=sys.stderr)
+        sys.exit(2)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    for key, metrics in results.items():
+        print(_format(key, metrics, baseline.get(key)))
+    regressions = compare(results, baseline)
+    for key in results:
+        if key not in baseline:
+            print(f'WARNING: {key} is not in the baseline and was not compared', file=sys.stderr)
+    for regression in regressions:
+        print(regression, file=sys.stderr)
+    sys.exit(1 if regressions else 0)
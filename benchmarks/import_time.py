@@ -0,0 +1,111 @@
+# Import-time budget checks for the dashboard and the compute modules
+#
+# Each module is imported in a fresh interpreter with `python -X importtime`; the cumulative import
+# time of the module (best of several runs) is compared with its budget, and the set of loaded
+# modules is checked against modules that must not be imported eagerly.
+#
+# To run it from the project root: `python benchmarks/import_time.py`
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+PATHS = [os.path.join(ROOT, 'modules'), os.path.join(ROOT, 'app')]
+
+# Scientific plotting/testing stack that must only be loaded on first use:
+HEAVY = ['matplotlib', 'seaborn', 'pingouin', 'pltstat', 'scipy']
+
+# {module: (budget in ms, modules that must not be loaded by the import)}
+BUDGETS = {
+    'utils': (2000, HEAVY),
+    'plots': (1500, HEAVY),
+    'views': (1500, HEAVY),
+    'report': (1500, HEAVY + ['streamlit']),
+    'figstore': (1500, HEAVY + ['streamlit']),
+    'stats': (1000, HEAVY + ['plotly', 'streamlit']),
+    'battery': (1000, HEAVY + ['plotly', 'streamlit']),
+    'association': (1000, HEAVY + ['plotly', 'streamlit']),
+    'bootstrap': (1000, HEAVY + ['plotly', 'streamlit']),
+    'survey': (1000, HEAVY + ['plotly', 'streamlit']),
+    'permutation': (1000, HEAVY + ['plotly', 'streamlit']),
+    'bitmap': (1000, HEAVY + ['plotly', 'streamlit']),
+    'instrument': (1000, HEAVY + ['plotly', 'streamlit']),
+    'cube': (1000, HEAVY + ['plotly', 'streamlit']),
+    'panel': (1000, HEAVY + ['plotly', 'streamlit']),
+    'cache': (1000, HEAVY + ['plotly', 'streamlit']),
+    'preprocessing': (1000, HEAVY + ['plotly', 'streamlit']),
+}
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def measure(module):
+    """
+    Import a module in a fresh interpreter.
+
+    Args:
+        module (str): Module name (found in modules/ or app/).
+
+    Returns:
+        tuple: (cumulative import time in ms, set of loaded top-level packages).
+    """
+    code = f"import sys; import {module}; print(','.join(sorted({{m.split('.')[0] for m in sys.modules}})))"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(PATHS + [os.environ.get('PYTHONPATH', '')]))
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, env=env, cwd=ROOT, check=True,
+    )
+
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match and match.group(2) == '' and match.group(3) == module:
+            cumulative = int(match.group(1)) / 1000
+    loaded = set(proc.stdout.strip().splitlines()[-1].split(','))
+    return cumulative, loaded
+
+
+def check(modules, repeat=3, scale=1.0):
+    """
+    Check import budgets.
+
+    Args:
+        modules (list): Modules to check (keys of BUDGETS).
+        repeat (int): Number of runs per module; the best time is used.
+        scale (float): Multiplier applied to all budgets (e.g. for slow CI machines).
+
+    Returns:
+        list of str: Failure messages (empty if all budgets hold).
+    """
+    failures = []
+    for module in modules:
+        budget, forbidden = BUDGETS[module]
+        runs = [measure(module) for _ in range(repeat)]
+        best = min(run[0] for run in runs)
+        loaded = runs[0][1]
+
+        eager = sorted(set(forbidden) & loaded)
+        status = 'ok'
+        if best > budget * scale:
+            failures.append(f'{module}: {best:.0f} ms > budget {budget * scale:.0f} ms')
+            status = 'SLOW'
+        if eager:
+            failures.append(f'{module}: imports {", ".join(eager)} eagerly')
+            status = 'EAGER'
+        print(f'{module:15s} {best:8.0f} ms  (budget {budget * scale:.0f} ms)  {status}')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check import-time budgets.')
+    parser.add_argument('modules', nargs='*', default=list(BUDGETS), help='Modules to check')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per module (best is used)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Budget multiplier')
+    args = parser.parse_args()
+
+    failures = check(args.modules, repeat=args.repeat, scale=args.scale)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
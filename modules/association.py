@@ -0,0 +1,232 @@
+# Batched chi-square association tests of cancer features x demographic features
+#
+# All contingency tables (each feature column x each grouping column) are counted in one pass over
+# the rows: per chunk of rows, one bincount over combined (feature, label, group) codes for every
+# grouping column. The tables of a grouping column form a stack (n_features, n_labels, n_groups),
+# and chi-square statistics, Cramer's V and MCC (phi) are computed for the whole stack with array
+# operations. One-vs-rest post-hoc contrasts (each group against all other groups) are 2x2 tables
+# obtained by slicing the same stack. P-values are corrected across the family of tests
+# (Sidak, Holm, Benjamini-Hochberg or Bonferroni).
+import numpy as np
+import pandas as pd
+
+import stats
+import variables as v
+
+DEFAULT_BY = [v.sex_col, v.race_col, v.age_col_cat]
+CORRECTIONS = ['sidak', 'holm', 'bh', 'bonferroni', 'none']
+
+
+def table_stacks(df, features=None, by=None, filters=None, index=None, chunksize=100_000):
+    """
+    Count the contingency tables of every feature x grouping column in one pass.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        features (list, optional): Feature columns sharing the same labels (rows of the tables).
+            Defaults to the cancer type Yes/No columns (v.cancer_type_names).
+        by (list, optional): Grouping columns (columns of the tables). Defaults to sex, race
+            and age group.
+        filters (dict, optional): Mapping column -> list of selected values (the subgroup).
+        index (bitmap.BitmapIndex, optional): Bitmap index of `df` used to evaluate the filters.
+        chunksize (int): Rows counted at once (bounds the memory of the combined codes).
+
+    Returns:
+        dict: Mapping grouping column -> (counts, row labels, column labels), where counts is an
+            (n_features, n_labels, n_groups) array. Rows with a missing value are not counted.
+    """
+    features = list(features if features is not None else v.cancer_type_names)
+    by = list(by if by is not None else DEFAULT_BY)
+
+    feature_codes = [stats.codes(df[feat]) for feat in features]
+    row_labels = feature_codes[0][0]
+    n_rows = max(len(labels) for labels, _ in feature_codes)
+    group_codes = {col: stats.codes(df[col]) for col in by}
+    mask = stats.filter_mask(df, filters, index)
+
+    counts = {col: np.zeros(len(features) * n_rows * len(labels), dtype=np.int64)
+              for col, (labels, _) in group_codes.items()}
+    feature_offsets = np.arange(len(features), dtype=np.int64)[:, None]
+    for start in range(0, len(df), chunksize):
+        chunk = slice(start, start + chunksize)
+        codes = np.stack([col_codes[chunk].astype(np.int64) for _, col_codes in feature_codes])
+        valid = codes >= 0
+        if mask is not None:
+            valid &= mask[chunk]
+        for col, (labels, col_codes) in group_codes.items():
+            groups = col_codes[chunk]
+            flat = (feature_offsets * n_rows + codes) * len(labels) + groups
+            counts[col] += np.bincount(flat[valid & (groups >= 0)], minlength=counts[col].size)
+
+    return {
+        col: (counts[col].reshape(len(features), n_rows, len(labels)), row_labels, labels)
+        for col, (labels, _) in group_codes.items()
+    }
+
+
+def chi2_tests(tables, correction=True):
+    """
+    Pearson chi-square tests of independence of a stack of tables.
+
+    Empty rows and columns are ignored (like dropping unobserved labels). With `correction`,
+    Yates' continuity correction is applied to tables with one degree of freedom, as
+    `scipy.stats.chi2_contingency` does.
+
+    Args:
+        tables (np.ndarray): (n_tables, n_rows, n_columns) counts.
+        correction (bool): Whether to apply Yates' correction. Defaults to True.
+
+    Returns:
+        dict: Arrays of length n_tables: 'n', 'chi2', 'dof', 'p' (NaN for tables with no
+            degree of freedom), 'cramers_v' (from the uncorrected statistic) and 'mcc'
+            (signed phi coefficient of 2x2 tables, NaN otherwise).
+    """
+    from scipy.stats import chi2
+
+    tables = tables.astype(float)
+    n = tables.sum(axis=(1, 2))
+    rows, cols = tables.sum(axis=2), tables.sum(axis=1)
+    dof = ((rows > 0).sum(axis=1) - 1) * ((cols > 0).sum(axis=1) - 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = rows[:, :, None] * cols[:, None, :] / n[:, None, None]
+        diff = np.abs(tables - expected)
+        statistic = np.where(expected > 0, diff ** 2 / expected, 0).sum(axis=(1, 2))
+        if correction:
+            yates = np.maximum(diff - 0.5, 0)
+            corrected = np.where(expected > 0, yates ** 2 / expected, 0).sum(axis=(1, 2))
+        else:
+            corrected = statistic
+
+        chi2_stat = np.where(dof == 1, corrected, statistic)
+        p = np.where(dof > 0, chi2.sf(chi2_stat, np.maximum(dof, 1)), np.nan)
+
+        k = np.minimum((rows > 0).sum(axis=1), (cols > 0).sum(axis=1))
+        cramers_v = np.where(dof > 0, np.sqrt(statistic / (n * (k - 1))), np.nan)
+
+        mcc = np.full(len(tables), np.nan)
+        if tables.shape[1:] == (2, 2):
+            a, b, c, d = tables[:, 0, 0], tables[:, 0, 1], tables[:, 1, 0], tables[:, 1, 1]
+            mcc = np.where(dof > 0, (a * d - b * c) / np.sqrt(rows[:, 0] * rows[:, 1] * cols[:, 0] * cols[:, 1]), np.nan)
+
+    return {'n': n.astype(np.int64), 'chi2': chi2_stat, 'dof': dof, 'p': p, 'cramers_v': cramers_v, 'mcc': mcc}
+
+
+def one_vs_rest(tables):
+    """
+    Build the one-vs-rest 2-column tables of every column of a stack of tables.
+
+    Args:
+        tables (np.ndarray): (n_tables, n_rows, n_columns) counts.
+
+    Returns:
+        np.ndarray: (n_tables, n_columns, n_rows, 2) counts; [..., j, :, 0] is column j and
+            [..., j, :, 1] the sum of all other columns.
+    """
+    level = np.moveaxis(tables, 2, 1)
+    rest = tables.sum(axis=2)[:, None, :] - level
+    return np.stack([level, rest], axis=-1)
+
+
+def adjust_pvalues(p, method='sidak'):
+    """
+    Correct p-values for multiple comparisons across the family of tests.
+
+    NaN p-values (tests that could not be run) are kept and not counted in the family.
+
+    Args:
+        p (array-like): P-values.
+        method (str): 'sidak', 'holm', 'bh' (Benjamini-Hochberg), 'bonferroni' or 'none'.
+
+    Returns:
+        np.ndarray: Adjusted p-values.
+    """
+    p = np.asarray(p, dtype=float)
+    adjusted = np.full(p.shape, np.nan)
+    valid = ~np.isnan(p)
+    values = p[valid]
+    m = len(values)
+    if m == 0 or method == 'none':
+        return p.copy()
+
+    if method == 'bonferroni':
+        result = values * m
+    elif method == 'sidak':
+        result = 1 - (1 - values) ** m
+    elif method in ('holm', 'bh'):
+        order = np.argsort(values, kind='mergesort')
+        ranked = values[order]
+        if method == 'holm':
+            ranked = np.maximum.accumulate(ranked * (m - np.arange(m)))
+        else:
+            ranked = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+        result = np.empty(m)
+        result[order] = ranked
+    else:
+        raise ValueError(f"Unknown correction: {method}. Choose one of {CORRECTIONS}")
+
+    adjusted[valid] = np.clip(result, 0, 1)
+    return adjusted
+
+
+def association_tests(df, features=None, by=None, filters=None, correction='sidak', alpha=0.05,
+                      yates=True, index=None):
+    """
+    Chi-square tests of every feature x grouping column and their one-vs-rest post-hoc contrasts.
+
+    Global tests form one family and post-hoc contrasts another; p-values are corrected
+    within each family. Run it per year or subgroup with `filters`, or with
+    `battery.run_battery` over one task per year (`{'filters': {v.year_col: [year]}}`).
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        features (list, optional): Feature columns sharing the same labels. Defaults to the
+            cancer type Yes/No columns.
+        by (list, optional): Grouping columns. Defaults to sex, race and age group.
+        filters (dict, optional): Mapping column -> list of selected values (the subgroup).
+        correction (str): Multiple comparison correction (see `adjust_pvalues`). Defaults to 'sidak'.
+        alpha (float): Family-wise significance level. Defaults to 0.05.
+        yates (bool): Yates' correction of 2x2 tables (see `chi2_tests`). Defaults to True.
+        index (bitmap.BitmapIndex, optional): Bitmap index of `df` used to evaluate the filters.
+
+    Returns:
+        tuple of pd.DataFrame:
+            - tests: one row per (feature, by) with 'n', 'chi2', 'dof', 'p', 'p_adj', 'reject',
+              'cramers_v' and 'mcc' (2x2 tables);
+            - posthoc: one row per (feature, by, level) with the level size 'n_level', the shares
+              of the first feature label in the level and in the rest ('share_level',
+              'share_rest'), 'chi2', 'p', 'p_adj', 'reject' and 'mcc' (positive - the first
+              feature label is more frequent in the level).
+    """
+    features = list(features if features is not None else v.cancer_type_names)
+    stacks = table_stacks(df, features, by, filters, index)
+
+    tests, posthoc = [], []
+    for col, (tables, _, labels) in stacks.items():
+        result = chi2_tests(tables, yates)
+        tests.append(pd.DataFrame({'feature': features, 'by': col, **result}))
+
+        contrasts = one_vs_rest(tables)  # (feature, level, row label, level/rest)
+        flat = contrasts.reshape(-1, contrasts.shape[2], 2)
+        result = chi2_tests(flat, yates)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shares = flat[:, 0, :] / flat.sum(axis=1)
+        posthoc.append(pd.DataFrame({
+            'feature': np.repeat(features, len(labels)),
+            'by': col,
+            'level': np.tile(np.asarray(labels, dtype=object), len(features)),
+            'n_level': flat[:, :, 0].sum(axis=1),
+            'share_level': shares[:, 0],
+            'share_rest': shares[:, 1],
+            'chi2': result['chi2'],
+            'p': result['p'],
+            'mcc': result['mcc'],
+        }))
+
+    tests = pd.concat(tests, ignore_index=True)
+    posthoc = pd.concat(posthoc, ignore_index=True)
+    posthoc = posthoc[posthoc['n_level'] > 0].reset_index(drop=True)
+    for table in (tests, posthoc):
+        table['p_adj'] = adjust_pvalues(table['p'].to_numpy(), correction)
+        table['reject'] = table['p_adj'] < alpha
+    return tests, posthoc
@@ -0,0 +1,100 @@
+# Parallel execution of statistical test batteries
+#
+# A battery is a list of independent tasks (strata, outcomes, bootstrap resamples) run by the same
+# compute function, e.g. `stats.pairwise_mannwhitney` or `stats.posthoc_tests`. The source (usually
+# the MEPS frame, but also a count cube or a dict of arrays) is handed to each worker once: worker
+# processes receive it through the pool initializer, which with
+# the default 'fork' start method on Linux is inherited without pickling, and with 'spawn' is pickled
+# once per worker instead of once per task. Results are returned in task order and do not depend
+# on the backend.
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import stats
+
+backends = ['serial', 'threads', 'processes']
+
+_source = None  # Source of the current worker process
+_index = None  # Bitmap index of the source frame
+
+
+def _init_worker(source, index=None):
+    """Store the source and its index in the worker process."""
+    global _source, _index
+    _source = source
+    _index = index
+
+
+def run_task(func, source, task, index=None):
+    """
+    Run one task of a battery.
+
+    Args:
+        func (callable): Compute function called as `func(source_task, **kwargs)`.
+        source: Data the tasks run on, passed to `func` as is. Any object works; the
+            'filters' and 'seed' task keys need a pd.DataFrame.
+        task (dict): Keyword arguments of `func`. Optional special keys:
+            'filters' - mapping column -> selected values, the stratum to run on (see `stats.filter_mask`);
+            'seed' - if set, the stratum is replaced by a bootstrap resample drawn with this seed.
+        index (bitmap.BitmapIndex, optional): Bitmap index of `source` used to select strata.
+
+    Returns:
+        Result of `func`.
+    """
+    kwargs = dict(task)
+    filters = kwargs.pop('filters', None)
+    seed = kwargs.pop('seed', None)
+
+    mask = stats.filter_mask(source, filters, index)
+    if mask is not None:
+        source = source[mask]
+    if seed is not None:
+        rng = np.random.default_rng(seed)
+        source = source.iloc[rng.integers(0, len(source), len(source))]
+
+    return func(source, **kwargs)
+
+
+def _run_task_in_worker(func, task):
+    """Run a task on the source stored by `_init_worker`."""
+    return run_task(func, _source, task, _index)
+
+
+def run_battery(func, source, tasks, backend='serial', max_workers=None, index=None):
+    """
+    Run a battery of independent tasks with the chosen execution backend.
+
+    Args:
+        func (callable): Compute function called as `func(source_task, **kwargs)`. For the
+            'processes' backend it must be defined at module level (picklable).
+        source: Data the tasks run on, e.g. the MEPS frame, a `cube.CountCube` or a dict
+            of arrays. It is shared by threads and sent once to each worker process (it must
+            be picklable with the 'spawn' start method). Tasks with 'filters' or 'seed' keys
+            need a pd.DataFrame.
+        tasks (list of dict): Task keyword arguments (see `run_task`).
+        backend (str): 'serial', 'threads' or 'processes'. Defaults to 'serial'.
+        max_workers (int, optional): Pool size. Defaults to the number of CPUs.
+        index (bitmap.BitmapIndex, optional): Bitmap index of `source`; strata are then selected
+            from packed bitmaps instead of column scans.
+
+    Returns:
+        list: Results in the order of `tasks`.
+    """
+    if backend not in backends:
+        raise ValueError(f"Unknown backend: {backend}. Choose one of {backends}")
+
+    tasks = list(tasks)
+    if backend == 'serial' or len(tasks) <= 1:
+        return [run_task(func, source, task, index) for task in tasks]
+
+    if max_workers is None:
+        max_workers = min(len(tasks), os.cpu_count() or 1)
+
+    if backend == 'threads':
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda task: run_task(func, source, task, index), tasks))
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(source, index)) as executor:
+        return list(executor.map(_run_task_in_worker, [func] * len(tasks), tasks))
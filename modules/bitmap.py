@@ -0,0 +1,104 @@
+# Packed bitmap indexes over the categorical columns of the MEPS frame
+#
+# The index holds one bit array per (column, label): bit r is set when row r has that label.
+# Rows are packed 8 per byte with np.packbits. Row filters are evaluated on the packed bytes, with
+# OR within a column and AND across columns, and counted with a popcount lookup table, so
+# repeated filters never scan the frame's columns.
+import numpy as np
+
+import stats
+import variables as v
+
+index_cols = [v.year_col, v.cancer_feat, v.cancer_feat_type, v.sex_col, v.race_col, v.age_col_cat] + v.cancer_type_names
+
+popcount_lut = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class BitmapIndex:
+    """
+    Packed bitmaps of the rows of each label of the indexed columns.
+
+    Args:
+        bitmaps (dict): Mapping column -> np.ndarray of shape (n_labels, ceil(n_rows / 8)), dtype uint8.
+        labels (dict): Mapping column -> pd.Index of labels (rows of the bitmap array).
+        n_rows (int): Number of rows of the indexed frame.
+    """
+
+    def __init__(self, bitmaps, labels, n_rows):
+        self.bitmaps = bitmaps
+        self.labels = labels
+        self.n_rows = n_rows
+
+    @classmethod
+    def build(cls, df, cols=None):
+        """
+        Build the index of a frame.
+
+        Args:
+            df (pd.DataFrame): Preprocessed dataframe.
+            cols (list, optional): Columns to index. Defaults to `index_cols` present in `df`.
+
+        Returns:
+            BitmapIndex: Index with one bitmap per label of each column (missing values have no bit set).
+        """
+        if cols is None:
+            cols = [col for col in index_cols if col in df.columns]
+
+        bitmaps, labels = {}, {}
+        for col in cols:
+            col_labels, codes = stats.codes(df[col])
+            bitmaps[col] = np.zeros((len(col_labels), (len(df) + 7) // 8), dtype=np.uint8)
+            for i in range(len(col_labels)):
+                bitmaps[col][i] = np.packbits(codes == i)
+            labels[col] = col_labels
+        return cls(bitmaps, labels, len(df))
+
+    def covers(self, filters):
+        """Return True if every active filter is on an indexed column."""
+        return all(col in self.bitmaps for col, values in (filters or {}).items()
+                   if values is not None and len(values) != 0)
+
+    def packed(self, filters):
+        """
+        Return the packed bitmap of rows matching the filters.
+
+        Args:
+            filters (dict): Mapping column -> list of selected labels. Empty lists mean no filter.
+
+        Returns:
+            np.ndarray or None: Packed uint8 bitmap, or None if no filter is set.
+
+        Raises:
+            KeyError: If a filtered column is not indexed.
+        """
+        result = None
+        for col, values in (filters or {}).items():
+            if values is None or len(values) == 0:
+                continue
+            if col not in self.bitmaps:
+                raise KeyError(f"Column {col} is not indexed")
+            positions = self.labels[col].get_indexer(list(values))
+            col_bitmap = np.zeros(self.bitmaps[col].shape[1], dtype=np.uint8)
+            for position in positions[positions >= 0]:
+                col_bitmap |= self.bitmaps[col][position]
+            result = col_bitmap if result is None else result & col_bitmap
+        return result
+
+    def mask(self, filters):
+        """
+        Return a bool mask of rows matching the filters (like `stats.filter_mask`).
+
+        Returns:
+            np.ndarray or None: Bool mask, or None if no filter is set.
+        """
+        packed = self.packed(filters)
+        if packed is None:
+            return None
+        return np.unpackbits(packed, count=self.n_rows).astype(bool)
+
+    def count(self, filters=None):
+        """Return the number of rows matching the filters."""
+        packed = self.packed(filters)
+        if packed is None:
+            return self.n_rows
+        return int(popcount_lut[packed].sum(dtype=np.int64))
@@ -0,0 +1,207 @@
+# Bootstrap and replicate-weight confidence intervals for counts and shares
+#
+# All replicates are computed at once. A bootstrap draws an (n_resamples x n) integer index matrix,
+# and the cell counts of every replicate come from one bincount over combined
+# (replicate, cell) codes. The cell counts of a row resample are multinomial with the observed cell
+# shares, so they can also be drawn directly, at a cost that does not depend on the number of rows
+# (method='multinomial'). Replicate weights (e.g. MEPS BRR weights) give the weighted totals of
+# every (replicate, cell) with one sparse matrix product. Replicate tables are then normalized and
+# reduced to intervals with vectorized NumPy operations.
+import warnings
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+import stats
+import variables as v
+
+DEFAULT_RESAMPLES = 200
+MAX_BLOCK_SIZE = 20_000_000  # Elements of the index matrix drawn at once (bounds memory on large frames)
+
+
+def bootstrap_counts(codes, n_cells, n_resamples=DEFAULT_RESAMPLES, seed=None, method='indices'):
+    """
+    Count cells in bootstrap resamples of the rows.
+
+    Args:
+        codes (np.ndarray): Cell code per row (-1 - row not counted).
+        n_cells (int): Number of cells.
+        n_resamples (int): Number of bootstrap resamples. Defaults to 200.
+        seed (int, optional): Seed of the resampling; the same seed gives the same replicates.
+        method (str): 'indices' - resample rows with an index matrix, 'multinomial' - draw the
+            cell counts of the resamples directly (same distribution, cost independent of the
+            number of rows). Defaults to 'indices'.
+
+    Returns:
+        np.ndarray: (n_resamples, n_cells) counts, one row per resample.
+    """
+    rng = np.random.default_rng(seed)
+    codes = codes[codes >= 0].astype(np.int64)
+    counts = np.zeros((n_resamples, n_cells), dtype=np.int64)
+    if len(codes) == 0:
+        return counts
+
+    if method == 'multinomial':
+        observed = np.bincount(codes, minlength=n_cells)
+        return rng.multinomial(len(codes), observed / len(codes), size=n_resamples)
+    if method != 'indices':
+        raise ValueError(f"Unknown bootstrap method: {method}")
+
+    block = max(1, MAX_BLOCK_SIZE // len(codes))
+    for start in range(0, n_resamples, block):
+        stop = min(start + block, n_resamples)
+        indices = rng.integers(0, len(codes), size=(stop - start, len(codes)))
+        flat = np.arange(stop - start)[:, None] * n_cells + codes[indices]
+        counts[start:stop] = np.bincount(flat.ravel(), minlength=(stop - start) * n_cells).reshape(-1, n_cells)
+    return counts
+
+
+def replicate_totals(codes, n_cells, rep_weights):
+    """
+    Sum replicate weights per cell for all replicates at once.
+
+    Args:
+        codes (np.ndarray): Cell code per row (-1 - row not counted).
+        n_cells (int): Number of cells.
+        rep_weights (np.ndarray): (n_rows, n_replicates) replicate weights.
+
+    Returns:
+        np.ndarray: (n_replicates, n_cells) weighted totals.
+    """
+    from scipy import sparse
+
+    rows = np.flatnonzero(codes >= 0)
+    onehot = sparse.csr_matrix((np.ones(len(rows)), (codes[rows], rows)), shape=(n_cells, len(codes)))
+    return np.asarray(onehot @ rep_weights).T
+
+
+def _cell_codes(df, feat1, feat2, filters, index):
+    """Return (labels1, labels2, combined codes); rows outside the filters or with missing values get -1."""
+    labels1, codes = stats.codes(df[feat1])
+    codes = codes.astype(np.int64)
+    labels2 = None
+    if feat2 is not None:
+        labels2, codes2 = stats.codes(df[feat2])
+        codes = np.where((codes < 0) | (codes2 < 0), -1, codes * len(labels2) + codes2)
+
+    mask = stats.filter_mask(df, filters, index)
+    if mask is not None:
+        codes = np.where(mask, codes, -1)
+    return labels1, labels2, codes
+
+
+def _normalize(tables, normalize):
+    """Normalize a stack of tables (..., rows, columns) like `stats.normalize`."""
+    axis = {'index': -1, 'columns': -2}.get(normalize)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if axis is None:
+            return tables / tables.sum(axis=(-2, -1), keepdims=True)
+        return tables / tables.sum(axis=axis, keepdims=True)
+
+
+def _intervals(point, replicates, normalize, level, replicate_se):
+    """
+    Return (share, lower, upper) arrays from a point table and a stack of replicate tables.
+
+    Percentile intervals of the replicate shares, or normal intervals with the replicate
+    standard error if `replicate_se` is True.
+    """
+    share = _normalize(point, normalize)
+    rep_shares = _normalize(replicates, normalize)
+
+    alpha = 1 - level
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # Empty rows/columns give all-NaN slices
+        if not replicate_se:
+            lower, upper = np.nanpercentile(rep_shares, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+        else:
+            se = np.sqrt(np.nanmean((rep_shares - share) ** 2, axis=0))
+            z = NormalDist().inv_cdf(1 - alpha / 2)
+            lower, upper = np.clip(share - z * se, 0, 1), np.clip(share + z * se, 0, 1)
+    return share, lower, upper
+
+
+def table_intervals(table, normalize='index', level=0.95, n_resamples=DEFAULT_RESAMPLES, seed=0):
+    """
+    Bootstrap confidence intervals of the shares of a table of counts.
+
+    The cell counts of resampled respondents are drawn directly from the multinomial
+    distribution of the observed counts (method='multinomial' of `bootstrap_counts`), so
+    precomputed counts (e.g. `CountCube.crosstab` or `CountCube.marginal`) are enough.
+
+    Args:
+        table (pd.DataFrame or pd.Series): Respondent counts. A Series is treated as one column.
+        normalize (str): 'index', 'columns' or 'all' (see `stats.normalize`). Use 'all' for a Series.
+        level (float): Confidence level. Defaults to 0.95.
+        n_resamples (int): Number of bootstrap resamples. Defaults to 200.
+        seed (int): Seed of the bootstrap. Defaults to 0.
+
+    Returns:
+        tuple: (share, lower, upper), of the same type and labels as `table`.
+    """
+    point = table.to_numpy().astype(float)
+    shape = point.reshape(len(table), -1).shape
+    n = int(point.sum())
+    rng = np.random.default_rng(seed)
+    if n > 0:
+        replicates = rng.multinomial(n, point.ravel() / n, size=n_resamples).astype(float)
+    else:
+        replicates = np.zeros((n_resamples, point.size))
+
+    result = _intervals(point.reshape(shape), replicates.reshape((-1,) + shape), normalize, level, False)
+    if isinstance(table, pd.Series):
+        return tuple(pd.Series(values[:, 0], index=table.index, name=table.name) for values in result)
+    return tuple(pd.DataFrame(values, index=table.index, columns=table.columns) for values in result)
+
+
+def crosstab_intervals(df, feat1, feat2=None, normalize='index', filters=None, level=0.95,
+                       n_resamples=DEFAULT_RESAMPLES, seed=0, method='indices', rep_weights=None, index=None):
+    """
+    Confidence intervals of the shares of a contingency table.
+
+    Without replicate weights, intervals are bootstrap percentile intervals over resampled
+    respondents (the rows matching the filters). With replicate weights, shares are weighted by
+    v.weight_col and intervals are normal intervals with the replicate standard error
+    sqrt(mean((share_r - share)^2)), as used with MEPS BRR weights.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        feat1 (str): Row feature.
+        feat2 (str, optional): Column feature. If None, shares of `feat1` labels are returned
+            as a one-column table.
+        normalize (str): 'index' - row shares, 'columns' - column shares, 'all' - shares of the total.
+        filters (dict, optional): Mapping column -> list of selected values.
+        level (float): Confidence level. Defaults to 0.95.
+        n_resamples (int): Number of bootstrap resamples. Defaults to 200.
+        seed (int): Seed of the bootstrap. Defaults to 0.
+        method (str): Bootstrap method, 'indices' or 'multinomial' (see `bootstrap_counts`).
+        rep_weights (np.ndarray, optional): (n_rows, n_replicates) replicate weights.
+        index (bitmap.BitmapIndex, optional): Bitmap index of `df` used to evaluate the filters.
+
+    Returns:
+        tuple of pd.DataFrame: (share, lower, upper) with observed `feat1` labels as index and
+            observed `feat2` labels as columns.
+    """
+    labels1, labels2, codes = _cell_codes(df, feat1, feat2, filters, index)
+    n2 = len(labels2) if labels2 is not None else 1
+    n_cells = len(labels1) * n2
+
+    if rep_weights is None:
+        point = np.bincount(codes[codes >= 0], minlength=n_cells).astype(float)
+        replicates = bootstrap_counts(codes, n_cells, n_resamples, seed, method).astype(float)
+    else:
+        weights = df[v.weight_col].to_numpy(dtype=np.float64)
+        point = replicate_totals(codes, n_cells, weights[:, None])[0]
+        replicates = replicate_totals(codes, n_cells, rep_weights)
+
+    shape = (len(labels1), n2)
+    point = point.reshape(shape)
+    result = _intervals(point, replicates.reshape((-1,) + shape), normalize, level, rep_weights is not None)
+
+    rows, cols = point.sum(axis=1) > 0, point.sum(axis=0) > 0
+    columns = labels2[cols] if labels2 is not None else pd.Index(['share'])
+    return tuple(
+        pd.DataFrame(values[rows][:, cols], index=labels1[rows], columns=columns)
+        for values in result
+    )
@@ -0,0 +1,261 @@
+# On-disk cache of the preprocessed MEPS frame.
+#
+# The cache is a directory with one .npy file per column and a meta.json describing
+# how to rebuild the frame. Columns are loaded with `np.load(..., mmap_mode='r')`, so
+# worker processes that open the same cache share the underlying pages.
+#
+# To build the cache from the project root: `python modules/cache.py`
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import cancer_mask
+import preprocessing
+import variables as v
+
+CACHE_VERSION = 1
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.npy'
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'cache')
+
+
+def _file_hash(path, block_size=1 << 20):
+    """Return sha256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _variables_hash():
+    """Return sha256 hex digest of the public constants defined in `variables`."""
+    constants = {
+        name: value for name, value in vars(v).items()
+        if not name.startswith('_') and not callable(value) and not isinstance(value, type(v))
+    }
+    return hashlib.sha256(repr(sorted(constants.items())).encode()).hexdigest()
+
+
+def cache_key(data_path, year=None):
+    """
+    Build the cache key for a data file.
+
+    The key depends on the source file content, its MEPS year, the constants in
+    `variables`, the preprocessing code (including the cancer mask layout and lookup
+    tables in `cancer_mask`) and `CACHE_VERSION`.
+
+    Args:
+        data_path (str): Path to the source .dta file.
+        year (int, optional): MEPS year of the file.
+
+    Returns:
+        str: Short hex key.
+    """
+    parts = [
+        str(CACHE_VERSION),
+        str(year),
+        _file_hash(data_path),
+        _variables_hash(),
+        _file_hash(preprocessing.__file__),
+        _file_hash(cancer_mask.__file__),
+    ]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:16]
+
+
+def cache_path(data_path, cache_dir=None, year=None):
+    """Return the cache directory for a data file."""
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    return os.path.join(cache_dir, f'{stem}-{cache_key(data_path, year)}')
+
+
+def exists(path):
+    """Return True if `path` is a complete cache directory."""
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def save(df, path):
+    """
+    Write a preprocessed frame to a cache directory.
+
+    Categorical and object columns are stored as integer codes plus categories,
+    numeric and bool columns are stored as is. The directory is written to a
+    temporary location first and renamed, so readers never see a partial cache.
+
+    Args:
+        df (pd.DataFrame): Preprocessed dataframe.
+        path (str): Target cache directory.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+
+    try:
+        columns = []
+        for i, (name, col) in enumerate(df.items()):
+            spec = {'name': name, 'file': f'{i:03d}.npy'}
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                spec['kind'] = 'categorical'
+                spec['categories'] = col.cat.categories.tolist()
+                spec['ordered'] = bool(col.cat.ordered)
+                values = col.cat.codes.to_numpy()
+            elif col.dtype == object:
+                cat = pd.Categorical(col)
+                spec['kind'] = 'object'
+                spec['categories'] = cat.categories.tolist()
+                values = cat.codes
+            else:
+                spec['kind'] = 'numeric'
+                values = col.to_numpy()
+            np.save(os.path.join(tmp_path, spec['file']), values, allow_pickle=False)
+            columns.append(spec)
+
+        np.save(os.path.join(tmp_path, INDEX_FILE), df.index.to_numpy(), allow_pickle=False)
+        with open(os.path.join(tmp_path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'columns': columns}, f)
+
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another process has already written the same cache entry:
+            if not exists(path):
+                raise
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load(path):
+    """
+    Load a preprocessed frame from a cache directory.
+
+    Args:
+        path (str): Cache directory written by `save`.
+
+    Returns:
+        pd.DataFrame: Preprocessed dataframe backed by memory-mapped arrays.
+    """
+    with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+        meta = json.load(f)
+
+    data = {}
+    for spec in meta['columns']:
+        values = np.load(os.path.join(path, spec['file']), mmap_mode='r')
+        if spec['kind'] == 'categorical':
+            dtype = pd.CategoricalDtype(spec['categories'], ordered=spec['ordered'])
+            data[spec['name']] = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        elif spec['kind'] == 'object':
+            obj = np.asarray(spec['categories'], dtype=object)[values]
+            obj[values < 0] = None
+            data[spec['name']] = obj
+        else:
+            data[spec['name']] = values
+
+    index = np.load(os.path.join(path, INDEX_FILE), mmap_mode='r')
+    return pd.DataFrame(data, index=index, copy=False)
+
+
+def prune(data_path, cache_dir=None, keep=None):
+    """
+    Remove the cache entries of a data file, except `keep`.
+
+    Entries of the same source file with an outdated key (changed data, code or
+    constants) are never loaded again, so they are removed when a new one is written.
+
+    Args:
+        data_path (str): Path to the source .dta file.
+        cache_dir (str, optional): Cache root directory. Defaults to data/cache.
+        keep (str, optional): Cache directory to keep.
+    """
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    keep = os.path.abspath(keep) if keep is not None else None
+    for name in os.listdir(cache_dir):
+        old_path = os.path.join(cache_dir, name)
+        if name.startswith(f'{stem}-') and os.path.abspath(old_path) != keep:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+
+def load_or_build(data_path, cache_dir=None, year=None, return_path=False):
+    """
+    Load the preprocessed frame from cache, building the cache if it is missing.
+
+    Outdated entries of the same file are removed (see `prune`).
+
+    Args:
+        data_path (str): Path to the source .dta file.
+        cache_dir (str, optional): Cache root directory. Defaults to data/cache.
+        year (int, optional): MEPS year of the file.
+        return_path (bool): If True, return the cache directory instead of loading it, e.g.
+            to open it in another process. Defaults to False.
+
+    Returns:
+        pd.DataFrame or str: Preprocessed dataframe, or its cache directory if `return_path`
+            is set. The frame is returned in both cases if the cache can not be written.
+    """
+    if not os.path.exists(data_path):
+        raise FileNotFoundError(data_path)
+
+    path = cache_path(data_path, cache_dir, year)
+    if exists(path):
+        prune(data_path, cache_dir, keep=path)
+        return path if return_path else load(path)
+
+    df = preprocessing.load(data_path, year=year)
+    try:
+        save(df, path)
+    except OSError:
+        # Read-only deployment: serve the frame without caching it
+        return df
+    prune(data_path, cache_dir, keep=path)
+    return path if return_path else df
+
+
+def build(data_path, cache_dir=None, year=None):
+    """
+    Build (or rebuild) the cache entry for a data file and remove stale entries.
+
+    Args:
+        data_path (str): Path to the source .dta file.
+        cache_dir (str, optional): Cache root directory. Defaults to data/cache.
+        year (int, optional): MEPS year of the file.
+
+    Returns:
+        str: Path of the written cache directory.
+    """
+    path = cache_path(data_path, cache_dir, year)
+    prune(data_path, cache_dir, keep=path)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    save(preprocessing.load(data_path, year=year), path)
+    return path
+
+
+if __name__ == '__main__':
+    default_data = os.path.join(os.path.dirname(__file__), os.pardir, 'data', v.meps_files[v.default_year])
+    parser = argparse.ArgumentParser(description='Build the preprocessed MEPS data cache.')
+    parser.add_argument('data_path', nargs='?', default=default_data, help='Path to the MEPS .dta file')
+    parser.add_argument('--year', type=int, default=None, help='MEPS year of the file (default: from file name)')
+    parser.add_argument('--cache-dir', default=None, help='Cache root directory (default: data/cache)')
+    args = parser.parse_args()
+
+    year = args.year
+    if year is None:
+        file_years = {file_name: file_year for file_year, file_name in v.meps_files.items()}
+        year = file_years.get(os.path.basename(args.data_path))
+
+    out = build(args.data_path, args.cache_dir, year)
+    print(f'Cache written: {os.path.normpath(out)}', file=sys.stderr)
@@ -0,0 +1,105 @@
+# Bit-packed cancer type mask per person
+#
+# Bit i of the mask is set when the person reports cancer type `v.cancer_types[i]`.
+# The number of types, CANCERDX_type and Multiple are derived from the mask with lookup tables.
+import numpy as np
+import pandas as pd
+
+import variables as v
+
+n_bits = len(v.cancer_types)
+
+# Lookup tables indexed by mask value:
+_masks = np.arange(1 << n_bits, dtype=np.uint16)
+popcount_lut = ((_masks[:, None] >> np.arange(n_bits, dtype=np.uint16)) & 1).sum(axis=1).astype(np.int8)
+
+_type_order = pd.Index(v.cancer_type_order)
+_no_code = _type_order.get_loc(v.no_ans)
+_dk_refused_code = _type_order.get_loc(v.dk_refused_ans)
+_mult_code = _type_order.get_loc(v.mult_ans)
+type_code_lut = np.full(1 << n_bits, _mult_code, dtype=np.int8)
+for _i, _name in enumerate(v.cancer_type_names):
+    type_code_lut[1 << _i] = _type_order.get_loc(f'1. {_name}')
+
+
+def _yes_matrix(df, cols, yes_value):
+    """Return (n_rows, n_cols) bool matrix of `col == yes_value`, comparing category codes."""
+    yes = np.empty((len(df), len(cols)), dtype=bool)
+    for i, col in enumerate(cols):
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            yes_code = values.cat.categories.get_indexer([yes_value])[0]
+            yes[:, i] = values.cat.codes.to_numpy() == yes_code if yes_code >= 0 else False
+        else:
+            yes[:, i] = values.to_numpy() == yes_value
+    return yes
+
+
+def cancer_mask(df, cols=None, yes_value=v.yes_raw_ans):
+    """
+    Build the bit-packed cancer type mask.
+
+    Args:
+        df (pd.DataFrame): Dataframe with raw cancer type columns.
+        cols (list, optional): Cancer type columns, one bit each. Defaults to v.cancer_types.
+        yes_value (str): Value marking a reported cancer type. Defaults to v.yes_raw_ans.
+
+    Returns:
+        np.ndarray: uint16 mask per row.
+    """
+    if cols is None:
+        cols = v.cancer_types
+    weights = (np.uint16(1) << np.arange(len(cols), dtype=np.uint16))
+    return _yes_matrix(df, cols, yes_value).astype(np.uint16) @ weights
+
+
+def n_types(mask):
+    """Return the number of reported cancer types per row (popcount of the mask)."""
+    return popcount_lut[mask]
+
+
+def type_codes(mask, diagnosed):
+    """
+    Return CANCERDX_type category codes (in v.cancer_type_order) for each row.
+
+    Args:
+        mask (np.ndarray): Cancer type mask.
+        diagnosed (np.ndarray): Bool array, True where CANCERDX is Yes.
+
+    Returns:
+        np.ndarray: int8 category codes.
+    """
+    codes = type_code_lut[mask]
+    no_type = mask == 0
+    codes[no_type] = np.where(diagnosed[no_type], _dk_refused_code, _no_code)
+    return codes
+
+
+def derive(df, diagnosed):
+    """
+    Derive all cancer type features from the raw cancer type columns in one vectorized stage.
+
+    Args:
+        df (pd.DataFrame): Dataframe with raw cancer type columns (v.cancer_types).
+        diagnosed (np.ndarray): Bool array, True where CANCERDX is Yes.
+
+    Returns:
+        pd.DataFrame: Columns v.cancer_bool_types, v.cancer_mult, v.mult_col,
+            v.cancer_feat_type and v.cancer_mask_col, indexed like `df`.
+    """
+    mask = cancer_mask(df)
+    mult = n_types(mask)
+
+    bool_types = ((mask[:, None] >> np.arange(n_bits, dtype=np.uint16)) & 1).astype(bool)
+    result = pd.DataFrame(bool_types, index=df.index, columns=v.cancer_bool_types)
+    result[v.cancer_mult] = mult
+    result[v.mult_col] = pd.Categorical.from_codes(
+        np.where(mult > 1, 0, 1).astype(np.int8),
+        categories=v.yes_no_order,
+    )
+    result[v.cancer_feat_type] = pd.Categorical.from_codes(
+        type_codes(mask, diagnosed),
+        categories=v.cancer_type_order,
+    )
+    result[v.cancer_mask_col] = mask
+    return result
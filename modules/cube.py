@@ -0,0 +1,231 @@
+# Pre-aggregated count cube over the small discrete dimensions of the MEPS frame
+#
+# The cube is a dense NumPy array of person counts indexed by (YEAR, CANCERDX_type, SEX, RACEV1X, AGELAST).
+# Filters, marginals and crosstabs are answered by slicing and summing the cube, so their cost
+# does not depend on the number of respondents. CANCERDX and AGELAST_CAT are derived dimensions:
+# they are mapped onto the cancer type and age axes with code lookup tables.
+import numpy as np
+import pandas as pd
+
+import stats
+import variables as v
+
+base_dims = [v.year_col, v.cancer_feat_type, v.sex_col, v.race_col, v.age_col]
+
+
+class CountCube:
+    """
+    Dense N-dimensional count array with labelled dimensions.
+
+    Each base dimension has one extra trailing slot for missing values: it is
+    included in totals and excluded from marginals and crosstabs, the same way
+    `value_counts` and `pd.crosstab` drop missing values.
+
+    Args:
+        counts (np.ndarray): Count array, one axis per dimension.
+        labels (dict): Mapping dimension name -> pd.Index of labels (without the missing slot).
+        derived (dict, optional): Mapping derived dimension name -> (base dimension,
+            pd.Index of labels, np.ndarray of derived codes per base label, -1 if unmapped).
+    """
+
+    def __init__(self, counts, labels, derived=None):
+        self.counts = counts
+        self.labels = labels
+        self.dims = list(labels)
+        self.derived = derived if derived is not None else {}
+
+    @classmethod
+    def build(cls, df, dims=None, weights=None):
+        """
+        Build the cube from a preprocessed frame in one pass.
+
+        Args:
+            df (pd.DataFrame): Preprocessed dataframe.
+            dims (list, optional): Base dimensions. Defaults to `base_dims` present in `df`.
+            weights (str, optional): Weight column (e.g. v.weight_col). If set, cells hold
+                weighted totals (population estimates) instead of person counts.
+
+        Returns:
+            CountCube: Count cube with CANCERDX and AGELAST_CAT as derived dimensions.
+        """
+        if dims is None:
+            dims = [dim for dim in base_dims if dim in df.columns]
+
+        labels, codes = {}, []
+        for dim in dims:
+            dim_labels, dim_codes = stats.codes(df[dim], dense=True)
+            labels[dim] = dim_labels
+            codes.append(np.where(dim_codes < 0, len(dim_labels), dim_codes))
+
+        shape = tuple(len(labels[dim]) + 1 for dim in dims)
+        flat = np.ravel_multi_index(codes, shape)
+        cell_weights = df[weights].to_numpy(dtype=np.float64) if weights is not None else None
+        counts = np.bincount(flat, weights=cell_weights, minlength=int(np.prod(shape))).reshape(shape)
+
+        cube = cls(counts, labels)
+        if v.cancer_feat_type in labels:
+            type_labels = labels[v.cancer_feat_type]
+            cube.add_derived(
+                v.cancer_feat, v.cancer_feat_type, v.yes_no_order,
+                np.where(type_labels == v.no_ans, v.no_ans, v.yes_ans),
+            )
+        if v.age_col in labels:
+            age_groups = pd.cut(labels[v.age_col], bins=v.age_bins, labels=v.age_groups, include_lowest=True)
+            cube.add_derived(
+                v.age_col_cat, v.age_col, v.age_groups,
+                np.asarray(age_groups, dtype=object), ordered=True,
+            )
+        return cube
+
+    def read_only(self):
+        """
+        Make the counts and the derived code tables read-only, e.g. for a cube shared by
+        all dashboard sessions; queries never modify them.
+
+        Returns:
+            CountCube: The cube itself.
+        """
+        self.counts.flags.writeable = False
+        for _, _, derived_codes in self.derived.values():
+            derived_codes.flags.writeable = False
+        return self
+
+    def add_derived(self, dim, base_dim, dim_labels, base_values, ordered=False):
+        """
+        Register a derived dimension defined by a label per base dimension label.
+
+        Args:
+            dim (str): Name of the derived dimension.
+            base_dim (str): Base dimension it is derived from.
+            dim_labels (list): Ordered labels of the derived dimension.
+            base_values (array-like): Derived label for each label of `base_dim` (None/NaN if none).
+            ordered (bool): Whether the derived labels are ordered.
+        """
+        dim_labels = pd.CategoricalIndex(dim_labels, categories=dim_labels, ordered=ordered, name=dim)
+        self.derived[dim] = (base_dim, dim_labels, dim_labels.get_indexer(base_values))
+
+    def dim_labels(self, dim):
+        """Return the labels of a base or derived dimension."""
+        if dim in self.derived:
+            return self.derived[dim][1]
+        return self.labels[dim]
+
+    def _selection(self, filters):
+        """Return one array of selected positions per base dimension (None - no filter)."""
+        selection = [None] * len(self.dims)
+        for dim, values in (filters or {}).items():
+            if values is None or len(values) == 0:
+                continue
+            if dim in self.derived:
+                base_dim, dim_labels, derived_codes = self.derived[dim]
+                axis = self.dims.index(base_dim)
+                positions = dim_labels.get_indexer(list(values))
+                selected = np.isin(derived_codes, positions[positions >= 0])  # Unknown labels (-1) match nothing
+            else:
+                axis = self.dims.index(dim)
+                selected = np.isin(np.arange(len(self.labels[dim])), self.labels[dim].get_indexer(list(values)))
+            if selection[axis] is not None:
+                selected &= np.isin(np.arange(len(selected)), selection[axis])
+            selection[axis] = np.flatnonzero(selected)
+        return selection
+
+    def _subcube(self, filters):
+        """Return the counts restricted to the filters and the selection per axis."""
+        selection = self._selection(filters)
+        sub = self.counts
+        for axis, selected in enumerate(selection):
+            if selected is not None:
+                sub = np.take(sub, selected, axis=axis)
+        return sub, selection
+
+    def _base_marginal(self, dim, filters):
+        """Return counts along a base dimension (all labels, without the missing slot)."""
+        sub, selection = self._subcube(filters)
+        axis = self.dims.index(dim)
+        counts = sub.sum(axis=tuple(i for i in range(sub.ndim) if i != axis))
+        result = np.zeros(len(self.labels[dim]), dtype=counts.dtype)
+        positions = selection[axis] if selection[axis] is not None else np.arange(len(result))
+        result[positions] = counts[:len(positions)]
+        return result
+
+    def _to_derived(self, dim):
+        """Return (base dimension, one-hot matrix base labels x derived labels, derived labels)."""
+        if dim not in self.derived:
+            n = len(self.labels[dim])
+            return dim, np.eye(n, dtype=np.int64), self.labels[dim]
+        base_dim, dim_labels, derived_codes = self.derived[dim]
+        onehot = np.zeros((len(derived_codes), len(dim_labels)), dtype=np.int64)
+        mapped = derived_codes >= 0
+        onehot[np.flatnonzero(mapped), derived_codes[mapped]] = 1
+        return base_dim, onehot, dim_labels
+
+    def total(self, filters=None):
+        """
+        Return the number of persons matching the filters.
+
+        Args:
+            filters (dict, optional): Mapping dimension -> list of selected labels.
+                Empty lists mean no filter on that dimension.
+
+        Returns:
+            int: Number of persons (rounded for weighted cubes).
+        """
+        sub, _ = self._subcube(filters)
+        return int(np.rint(sub.sum()))
+
+    def marginal(self, dim, filters=None, observed=False):
+        """
+        Return person counts per label of a dimension (like `value_counts(sort=False)`).
+
+        Args:
+            dim (str): Base or derived dimension.
+            filters (dict, optional): Mapping dimension -> list of selected labels.
+            observed (bool): If True, drop labels with zero count.
+
+        Returns:
+            pd.Series: Counts indexed by the dimension labels.
+        """
+        base_dim, onehot, dim_labels = self._to_derived(dim)
+        counts = self._base_marginal(base_dim, filters) @ onehot
+        result = pd.Series(counts, index=pd.Index(dim_labels, name=dim), name='count')
+        if observed:
+            result = result[result > 0]
+        return result
+
+    def crosstab(self, dim1, dim2, filters=None, observed=True):
+        """
+        Return the contingency table of two dimensions (like `pd.crosstab`).
+
+        Args:
+            dim1 (str): Row dimension.
+            dim2 (str): Column dimension.
+            filters (dict, optional): Mapping dimension -> list of selected labels.
+            observed (bool): If True, drop all-zero rows and columns.
+
+        Returns:
+            pd.DataFrame: Counts with `dim1` labels as index and `dim2` labels as columns.
+        """
+        base1, onehot1, labels1 = self._to_derived(dim1)
+        base2, onehot2, labels2 = self._to_derived(dim2)
+        if base1 == base2:
+            raise ValueError(f"Dimensions {dim1} and {dim2} share the base dimension {base1}")
+
+        sub, selection = self._subcube(filters)
+        axis1, axis2 = self.dims.index(base1), self.dims.index(base2)
+        table = sub.sum(axis=tuple(i for i in range(sub.ndim) if i not in (axis1, axis2)))
+        if axis1 > axis2:
+            table = table.T
+
+        full = np.zeros((len(self.labels[base1]), len(self.labels[base2])), dtype=table.dtype)
+        rows = selection[axis1] if selection[axis1] is not None else np.arange(full.shape[0])
+        cols = selection[axis2] if selection[axis2] is not None else np.arange(full.shape[1])
+        full[np.ix_(rows, cols)] = table[:len(rows), :len(cols)]
+
+        result = pd.DataFrame(
+            onehot1.T @ full @ onehot2,
+            index=pd.Index(labels1, name=dim1),
+            columns=pd.Index(labels2, name=dim2),
+        )
+        if observed:
+            result = result.loc[result.sum(axis=1) > 0, result.sum(axis=0) > 0]
+        return result
@@ -0,0 +1,182 @@
+# Content-addressed store of pre-rendered dashboard figures
+#
+# Block 1 and block 2 of the dashboard have a finite state space (demographic feature x cancer
+# feature x "exclude No answer" x year selection). The warm step renders the figure of every state
+# once and writes its Plotly JSON to data/figures/<data key>/<state key>.json. The data key hashes
+# the count cube (the only input of these figures) and the code that builds, counts and draws them,
+# so a new data file or a change of that code gives a new directory and stale figures are never
+# served. Figures without explicit colors take them from the default Plotly template, which
+# Streamlit replaces by its own; the template name is part of the key, and the warm step renders
+# with the Streamlit one.
+# The dashboard reads figures from the store and only computes states that are not in it.
+#
+# To warm the store from the project root: `python modules/figstore.py`
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import plotly
+import plotly.io as pio
+
+import bootstrap
+import cancer_mask
+import cube
+import panel
+import plots
+import preprocessing
+import stats
+import variables as v
+import views
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'figures')
+
+# Modules whose code determines the stored figures (the frame, its counts and their drawing):
+_figure_modules = [views, plots, stats, bootstrap, cube, preprocessing, cancer_mask, v]
+
+
+def data_key(counts):
+    """
+    Return the key of the figures of a count cube.
+
+    The key depends on the cube counts and labels, the code of the modules that build the
+    frame, count it and draw the figures, the Plotly version and the default Plotly template.
+
+    Args:
+        counts (cube.CountCube): Count cube of the dashboard.
+
+    Returns:
+        str: Short hex key.
+    """
+    digest = hashlib.sha256()
+    digest.update(counts.counts.tobytes())
+    digest.update(repr({dim: list(labels) for dim, labels in counts.labels.items()}).encode())
+    for module in _figure_modules:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    digest.update(plotly.__version__.encode())
+    digest.update(str(pio.templates.default).encode())
+    return digest.hexdigest()[:16]
+
+
+def state_key(state):
+    """Return the key of a widget state (dict of JSON-serializable values)."""
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def block1_state(dem_feat, years=()):
+    """Return the state of the block 1 figure."""
+    return {'block': 1, 'dem_feat': dem_feat, 'years': [int(year) for year in years]}
+
+
+def block2_state(cancer_feat, dem_feat, exclude_no=False, years=()):
+    """Return the state of the block 2 figure."""
+    return {'block': 2, 'cancer_feat': cancer_feat, 'dem_feat': dem_feat, 'exclude_no': bool(exclude_no),
+            'years': [int(year) for year in years]}
+
+
+def figure_path(key, state, store_dir=None):
+    """Return the file of a figure in the store."""
+    if store_dir is None:
+        store_dir = DEFAULT_STORE_DIR
+    return os.path.join(store_dir, key, f'{state_key(state)}.json')
+
+
+def load(key, state, store_dir=None):
+    """
+    Read a figure from the store.
+
+    Args:
+        key (str): Data key (see `data_key`).
+        state (dict): Widget state (see `block1_state`, `block2_state`).
+        store_dir (str, optional): Store root directory. Defaults to data/figures.
+
+    Returns:
+        plotly.graph_objects.Figure or None: Stored figure, or None if the state is not stored.
+    """
+    try:
+        with open(figure_path(key, state, store_dir)) as f:
+            return pio.from_json(f.read(), skip_invalid=True)
+    except FileNotFoundError:
+        return None
+
+
+def save(fig, key, state, store_dir=None):
+    """Write a figure to the store (atomically, readers never see a partial file)."""
+    path = figure_path(key, state, store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(fig.to_json())
+    os.replace(tmp_path, path)
+
+
+def year_selections(counts):
+    """Return the year selections to pre-render: all years, and each year if there are several."""
+    if v.year_col not in counts.dims or len(counts.labels[v.year_col]) <= 1:
+        return [()]
+    return [()] + [(int(year),) for year in counts.labels[v.year_col]]
+
+
+def states(counts):
+    """Enumerate the widget states of blocks 1 and 2."""
+    result = []
+    for years in year_selections(counts):
+        for dem_feat in views.dem_feats:
+            result.append(block1_state(dem_feat, years))
+            for cancer_feat in [v.cancer_feat, v.cancer_feat_type]:
+                for exclude_no in ([False] if cancer_feat == v.cancer_feat else [False, True]):
+                    result.append(block2_state(cancer_feat, dem_feat, exclude_no, years))
+    return result
+
+
+def render(counts, state):
+    """Render the figure of a widget state."""
+    year_filter = {v.year_col: state['years']} if state['years'] else {}
+    if state['block'] == 1:
+        return views.block1_figure(counts, state['dem_feat'], year_filter)
+    filters = views.block2_filters(year_filter, state['exclude_no'])
+    return views.block2_figure(counts, state['cancer_feat'], state['dem_feat'], filters)
+
+
+def warm(counts, store_dir=None):
+    """
+    Render and store the figures of all states of blocks 1 and 2.
+
+    Args:
+        counts (cube.CountCube): Count cube of the dashboard (respondent counts).
+        store_dir (str, optional): Store root directory. Defaults to data/figures.
+
+    Returns:
+        str: Directory of the stored figures.
+    """
+    key = data_key(counts)
+    for state in states(counts):
+        save(render(counts, state), key, state, store_dir)
+    return os.path.dirname(figure_path(key, {}, store_dir))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-render the dashboard figures of blocks 1 and 2.')
+    parser.add_argument('--data-dir', default=None, help='Directory with MEPS .dta files (default: data/)')
+    parser.add_argument('--cache-dir', default=None, help='Cache root directory (default: data/cache)')
+    parser.add_argument('--store-dir', default=None, help='Figure store directory (default: data/figures)')
+    parser.add_argument('--template', default='streamlit', help='Plotly template (default: the dashboard one)')
+    args = parser.parse_args()
+
+    if args.template == 'streamlit':
+        from streamlit.elements.lib.streamlit_plotly_theme import configure_streamlit_plotly_theme
+
+        configure_streamlit_plotly_theme()
+    else:
+        pio.templates.default = args.template
+
+    years = panel.available_years(args.data_dir)
+    if len(years) == 0:
+        print(f"No data files found in: {os.path.normpath(args.data_dir or panel.DEFAULT_DATA_DIR)}", file=sys.stderr)
+        sys.exit(1)
+    counts = cube.CountCube.build(panel.load_panel(years, args.data_dir, args.cache_dir))
+    out = warm(counts, args.store_dir)
+    print(f'Figures written: {os.path.normpath(out)} ({len(states(counts))} states)', file=sys.stderr)
@@ -0,0 +1,175 @@
+# Opt-in timing and memory instrumentation of the dashboard stages
+#
+# Instrumentation is off unless the MEPS_INSTRUMENT environment variable is set to 1; the decorators
+# and context managers then cost one flag check per call. When it is on, each stage records its wall
+# time, the rows it processed, the change of the process resident memory and, for charts, the
+# figure payload size. Records are collected per thread (Streamlit runs each session's reruns in
+# its own thread) and written by `flush`:
+# - as JSON lines to the file named by MEPS_INSTRUMENT_LOG, or to the 'meps.instrument' logger;
+# - as cumulative metrics in Prometheus text format to the file named by MEPS_INSTRUMENT_PROM
+#   (e.g. for the node_exporter textfile collector).
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLE_VAR = 'MEPS_INSTRUMENT'
+LOG_VAR = 'MEPS_INSTRUMENT_LOG'
+PROM_VAR = 'MEPS_INSTRUMENT_PROM'
+
+logger = logging.getLogger('meps.instrument')
+
+_local = threading.local()  # Records of the current thread since the last flush
+_lock = threading.Lock()
+_totals = {}  # Cumulative metrics per stage (Prometheus file)
+
+
+def enabled():
+    """Return True if instrumentation is switched on (MEPS_INSTRUMENT=1)."""
+    return os.environ.get(ENABLE_VAR, '') == '1'
+
+
+def _rss():
+    """Return the resident memory of the process in bytes, or None if it is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def records():
+    """Return the records of the current thread since the last flush."""
+    if not hasattr(_local, 'records'):
+        _local.records = []
+    return _local.records
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Record the wall time and memory change of a block of code.
+
+    Args:
+        name (str): Stage name.
+        rows (int, optional): Number of rows processed; can also be set on the yielded record.
+
+    Yields:
+        dict: Record of the stage ('rows' and 'figure_bytes' may be set by the caller),
+            or a throwaway dict when instrumentation is off.
+    """
+    if not enabled():
+        yield {}
+        return
+
+    record = {'stage': name, 'rows': rows, 'figure_bytes': None}
+    rss = _rss()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        end_rss = _rss()
+        record['memory_delta'] = end_rss - rss if rss is not None and end_rss is not None else None
+        records().append(record)
+
+
+def timed(name=None, rows=None):
+    """
+    Decorator recording each call of a function as a stage.
+
+    Put it above caching decorators (e.g. `st.cache_data`) so that cache hits are recorded too.
+
+    Args:
+        name (str, optional): Stage name. Defaults to the function name.
+        rows (callable, optional): Function of the result returning the number of rows processed.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            with stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    record['rows'] = int(rows(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def figure_bytes(fig):
+    """Return the size of the JSON payload of a Plotly figure."""
+    return len(fig.to_json().encode())
+
+
+def _prometheus_text():
+    """Return the cumulative metrics in Prometheus text exposition format."""
+    metrics = [
+        ('meps_stage_seconds_total', 'counter', 'Total wall time of the stage in seconds.', 'seconds'),
+        ('meps_stage_calls_total', 'counter', 'Number of recorded calls of the stage.', 'calls'),
+        ('meps_stage_rows_total', 'counter', 'Rows processed by the stage.', 'rows'),
+        ('meps_stage_figure_bytes_total', 'counter', 'Figure payload bytes sent by the stage.', 'figure_bytes'),
+        ('meps_stage_memory_delta_bytes', 'gauge', 'Resident memory change of the last call of the stage.', 'memory_delta'),
+    ]
+    lines = []
+    for metric, kind, help_text, key in metrics:
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+        for name, totals in sorted(_totals.items()):
+            lines.append(f'{metric}{{stage="{name}"}} {totals[key]:g}')
+    return '\n'.join(lines) + '\n'
+
+
+def _update_totals(batch):
+    """Add records to the cumulative metrics."""
+    for record in batch:
+        totals = _totals.setdefault(record['stage'], dict.fromkeys(
+            ['seconds', 'calls', 'rows', 'figure_bytes', 'memory_delta'], 0))
+        totals['seconds'] += record['seconds']
+        totals['calls'] += 1
+        totals['rows'] += record['rows'] or 0
+        totals['figure_bytes'] += record['figure_bytes'] or 0
+        if record['memory_delta'] is not None:
+            totals['memory_delta'] = record['memory_delta']
+
+
+def flush(start=0, **context):
+    """
+    Write and clear the records of the current thread.
+
+    Args:
+        start (int): Position of the first record to write (e.g. `len(records())` when a
+            fragment started); earlier records are kept for a later flush. Defaults to 0.
+        **context: Fields added to every record (e.g. session and rerun ids).
+
+    Returns:
+        list of dict: Written records (empty when instrumentation is off).
+    """
+    batch = records()[start:]
+    del records()[start:]
+    if not enabled() or len(batch) == 0:
+        return []
+    batch = [{**context, **record} for record in batch]
+
+    log_path = os.environ.get(LOG_VAR)
+    prom_path = os.environ.get(PROM_VAR)
+    with _lock:
+        if log_path:
+            with open(log_path, 'a') as f:
+                f.writelines(json.dumps(record, default=str) + '\n' for record in batch)
+        else:
+            for record in batch:
+                logger.info(json.dumps(record, default=str))
+
+        _update_totals(batch)
+        if prom_path:
+            tmp_path = f'{prom_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(_prometheus_text())
+            os.replace(tmp_path, prom_path)  # Scrapers never read a partial file
+    return batch
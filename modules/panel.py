@@ -0,0 +1,115 @@
+# Multi-year MEPS panel loader
+#
+# Each year's file is preprocessed (and cached) in a separate process; the parent process
+# then opens the memory-mapped cache entries and concatenates them with a YEAR column. Only a
+# single-year frame stays memory-mapped: concatenating several years copies their columns into RAM.
+# `read_only` turns the frame into a shared immutable one: its column buffers can not be written,
+# so one instance can be handed to every dashboard session without copies.
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import cache
+import preprocessing
+import variables as v
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'data')
+
+
+def year_path(year, data_dir=None):
+    """Return the path of the MEPS data file of a year."""
+    if data_dir is None:
+        data_dir = DEFAULT_DATA_DIR
+    return os.path.join(data_dir, v.meps_files[year])
+
+
+def available_years(data_dir=None):
+    """Return the sorted list of years whose data file exists in `data_dir`."""
+    return [year for year in sorted(v.meps_files) if os.path.exists(year_path(year, data_dir))]
+
+
+def _build_year(year, data_dir, cache_dir):
+    """
+    Preprocess one year into the cache (worker process).
+
+    Returns:
+        str or pd.DataFrame: Cache directory, or the frame itself if the cache can not be written.
+    """
+    return cache.load_or_build(year_path(year, data_dir), cache_dir, year, return_path=True)
+
+
+def load_panel(years=None, data_dir=None, cache_dir=None, max_workers=None):
+    """
+    Load and preprocess several MEPS years into one frame with a YEAR column.
+
+    Args:
+        years (list, optional): Years to load. Defaults to all available years.
+        data_dir (str, optional): Directory with MEPS .dta files. Defaults to data/.
+        cache_dir (str, optional): Cache root directory. Defaults to data/cache.
+        max_workers (int, optional): Number of worker processes. Defaults to one per year
+            (capped by the number of CPUs); a single year is loaded in-process.
+
+    Returns:
+        pd.DataFrame: Preprocessed dataframe of all years. A single year is backed by its
+            memory-mapped cache entry (except the YEAR column); several years are concatenated
+            into new in-memory columns, so each process that loads them holds its own copy.
+
+    Raises:
+        FileNotFoundError: If a data file of the requested years does not exist.
+    """
+    if years is None:
+        years = available_years(data_dir)
+    years = sorted(years)
+    if len(years) == 0:
+        raise FileNotFoundError(f"No MEPS data files found in {data_dir or DEFAULT_DATA_DIR}")
+
+    for year in years:
+        if not os.path.exists(year_path(year, data_dir)):
+            raise FileNotFoundError(year_path(year, data_dir))
+
+    if len(years) == 1 or max_workers == 1:
+        results = [_build_year(year, data_dir, cache_dir) for year in years]
+    else:
+        if max_workers is None:
+            max_workers = min(len(years), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_build_year, years, [data_dir] * len(years), [cache_dir] * len(years)))
+
+    parts = []
+    for year, result in zip(years, results):
+        df = cache.load(result) if isinstance(result, str) else result
+        df[v.year_col] = np.int16(year)
+        parts.append(df)
+
+    if len(parts) == 1:
+        return parts[0]
+    return preprocessing.concat(parts, ignore_index=True)
+
+
+def read_only(df):
+    """
+    Return the frame with read-only column buffers, without copying them.
+
+    Numeric and bool columns are read-only views of the column arrays, and categorical
+    columns are rebuilt on read-only views of their codes. In-place assignments (e.g.
+    `df.loc[row, col] = value`) then raise ValueError instead of changing data shared
+    with other users of the frame; operations that return new frames are not affected.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+
+    Returns:
+        pd.DataFrame: Frame sharing the memory of `df`.
+    """
+    data = {}
+    for name, col in df.items():
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # `codes` is a read-only view of the categorical codes:
+            data[name] = pd.Categorical.from_codes(col.cat.codes.to_numpy(), dtype=col.dtype, validate=False)
+        else:
+            values = col.to_numpy().view()
+            values.flags.writeable = False
+            data[name] = values
+    return pd.DataFrame(data, index=df.index, copy=False)
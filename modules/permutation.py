@@ -0,0 +1,201 @@
+# Monte Carlo permutation tests of r x c contingency tables
+#
+# Exact tests of large tables (e.g. cancer type x race) are infeasible, so the null distribution
+# of the statistic is simulated: under independence, the table of permuted rows is a random table
+# with the observed margins. Tables are drawn in batches, either by shuffling the codes of one
+# column ((batch, n) matrix of permuted codes) and counting all tables of the batch with one
+# bincount over combined (table, row, column) codes, or directly from their distribution with
+# fixed margins (sequential hypergeometric draws, as R's r2dtable), at a cost that does not depend
+# on the number of rows. Statistics of a whole batch are vectorized.
+#
+# Each batch has its own seed spawned from one root seed, so results depend on the seed and the
+# batch size only, not on the execution backend (batches can run in a process pool, see battery.py).
+import numpy as np
+
+import battery
+import stats
+import variables as v
+
+DEFAULT_PERMUTATIONS = 100_000
+BATCH_SIZE = 10_000  # Tables drawn at once
+MAX_BLOCK_SIZE = 20_000_000  # Elements of the permuted code matrix drawn at once (method='shuffle')
+REL_TOL = 1e-7  # Relative tolerance of "as extreme as observed" (floating point ties)
+
+statistics = ['fisher', 'chi2']
+methods = ['hypergeometric', 'shuffle']
+
+
+def _log_factorials(n):
+    """Return log(k!) for k = 0..n."""
+    return np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, n + 1)))])
+
+
+def table_statistic(tables, statistic='fisher', log_factorials=None):
+    """
+    Compute a test statistic for a stack of tables with the same margins.
+
+    Args:
+        tables (np.ndarray): (..., n_rows, n_columns) counts.
+        statistic (str): 'fisher' - sum of log(x!) over cells, which orders tables by their
+            probability under independence given the margins (larger - less probable, as the
+            statistic of Fisher's exact test); 'chi2' - Pearson chi-square statistic.
+        log_factorials (np.ndarray, optional): Lookup table of log(k!) (see `_log_factorials`).
+
+    Returns:
+        np.ndarray: Statistic per table; larger values are more extreme.
+    """
+    if statistic == 'fisher':
+        if log_factorials is None:
+            log_factorials = _log_factorials(int(tables.max(initial=0)))
+        return log_factorials[tables].sum(axis=(-2, -1))
+    if statistic != 'chi2':
+        raise ValueError(f"Unknown statistic: {statistic}. Choose one of {statistics}")
+
+    n = tables.sum(axis=(-2, -1), keepdims=True)
+    expected = tables.sum(axis=-1, keepdims=True) * tables.sum(axis=-2, keepdims=True) / n
+    return ((tables - expected) ** 2 / expected).sum(axis=(-2, -1))
+
+
+def random_tables(row_totals, col_totals, size, rng):
+    """
+    Draw random tables with fixed margins (the tables of random permutations of the rows).
+
+    Cells are drawn column by column and row by row from hypergeometric distributions of the
+    remaining counts, for all tables of the batch at once.
+
+    Args:
+        row_totals (np.ndarray): Row margins.
+        col_totals (np.ndarray): Column margins (same total as `row_totals`).
+        size (int): Number of tables.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        np.ndarray: (size, n_rows, n_columns) counts.
+    """
+    n_rows, n_cols = len(row_totals), len(col_totals)
+    tables = np.zeros((size, n_rows, n_cols), dtype=np.int64)
+    remaining = np.tile(np.asarray(row_totals, dtype=np.int64), (size, 1))  # Row counts not yet placed
+    for j in range(n_cols - 1):
+        to_place = np.full(size, col_totals[j], dtype=np.int64)
+        others = remaining.sum(axis=1)
+        for i in range(n_rows - 1):
+            others -= remaining[:, i]
+            cell = rng.hypergeometric(remaining[:, i], others, to_place)
+            tables[:, i, j] = cell
+            to_place -= cell
+        tables[:, n_rows - 1, j] = to_place
+        remaining -= tables[:, :, j]
+    tables[:, :, n_cols - 1] = remaining
+    return tables
+
+
+def shuffled_tables(codes1, codes2, n1, n2, size, rng):
+    """
+    Count the tables of `size` random permutations of `codes2` against `codes1`.
+
+    Args:
+        codes1 (np.ndarray): Row codes per respondent.
+        codes2 (np.ndarray): Column codes per respondent.
+        n1 (int): Number of rows.
+        n2 (int): Number of columns.
+        size (int): Number of permutations.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        np.ndarray: (size, n1, n2) counts.
+    """
+    n_cells = n1 * n2
+    tables = np.empty((size, n1, n2), dtype=np.int64)
+    block = max(1, MAX_BLOCK_SIZE // max(len(codes1), 1))
+    for start in range(0, size, block):
+        stop = min(start + block, size)
+        permuted = rng.permuted(np.broadcast_to(codes2, (stop - start, len(codes2))), axis=1)
+        flat = np.arange(stop - start)[:, None] * n_cells + codes1 * n2 + permuted
+        tables[start:stop] = np.bincount(flat.ravel(), minlength=(stop - start) * n_cells).reshape(-1, n1, n2)
+    return tables
+
+
+def _count_extreme(source, size, stream):
+    """Draw one batch of null tables and count statistics at least as extreme as observed (battery task)."""
+    rng = np.random.default_rng(stream)
+    if source['method'] == 'hypergeometric':
+        tables = random_tables(source['row_totals'], source['col_totals'], size, rng)
+    else:
+        tables = shuffled_tables(source['codes1'], source['codes2'], *source['shape'], size, rng)
+    null = table_statistic(tables, source['statistic'], source['log_factorials'])
+    return int((null >= source['observed'] * (1 - REL_TOL)).sum())
+
+
+def permutation_test(df, feat1=v.cancer_feat_type, feat2=v.race_col, n_permutations=DEFAULT_PERMUTATIONS,
+                     seed=0, statistic='fisher', method='hypergeometric', filters=None, index=None,
+                     backend='serial', max_workers=None, batch_size=BATCH_SIZE):
+    """
+    Monte Carlo permutation test of independence of two categorical columns.
+
+    The p-value is (1 + number of null tables at least as extreme as observed) / (B + 1), as
+    R's `fisher.test(..., simulate.p.value=TRUE)` and `chisq.test(..., simulate.p.value=TRUE)`.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        feat1 (str): Row feature. Defaults to v.cancer_feat_type.
+        feat2 (str): Column feature. Defaults to v.race_col.
+        n_permutations (int): Number of simulated tables B. Defaults to 100 000.
+        seed (int): Root seed; the same seed and batch size give the same p-value on every backend.
+        statistic (str): 'fisher' or 'chi2' (see `table_statistic`). Defaults to 'fisher'.
+        method (str): 'hypergeometric' - draw tables with the observed margins directly,
+            'shuffle' - permute the codes of `feat2` and count the tables with bincount.
+            Both give the permutation distribution. Defaults to 'hypergeometric'.
+        filters (dict, optional): Mapping column -> list of selected values (the stratum).
+        index (bitmap.BitmapIndex, optional): Bitmap index of `df` used to evaluate the filters.
+        backend (str): Execution backend of the batches (see `battery.run_battery`). Defaults to 'serial'.
+        max_workers (int, optional): Number of workers. Defaults to the number of CPUs.
+        batch_size (int): Tables per batch (and per seed). Defaults to BATCH_SIZE.
+
+    Returns:
+        dict: 'statistic' (observed), 'p', 'se' (Monte Carlo standard error of p),
+            'n_permutations', 'n' (respondents) and 'shape' (observed rows and columns).
+    """
+    if method not in methods:
+        raise ValueError(f"Unknown method: {method}. Choose one of {methods}")
+
+    labels1, codes1 = stats.codes(df[feat1])
+    labels2, codes2 = stats.codes(df[feat2])
+    valid = (codes1 >= 0) & (codes2 >= 0)
+    mask = stats.filter_mask(df, filters, index)
+    if mask is not None:
+        valid &= mask
+    codes1, codes2 = codes1[valid].astype(np.int64), codes2[valid].astype(np.int64)
+
+    # Unobserved labels do not change the statistics:
+    rows, codes1 = np.unique(codes1, return_inverse=True)
+    cols, codes2 = np.unique(codes2, return_inverse=True)
+    observed_table = np.bincount(codes1 * len(cols) + codes2, minlength=len(rows) * len(cols)).reshape(len(rows), len(cols))
+
+    log_factorials = _log_factorials(len(codes1)) if statistic == 'fisher' else None
+    observed = table_statistic(observed_table, statistic, log_factorials)
+    source = {
+        'method': method,
+        'statistic': statistic,
+        'observed': observed,
+        'log_factorials': log_factorials,
+        'row_totals': observed_table.sum(axis=1),
+        'col_totals': observed_table.sum(axis=0),
+        'codes1': codes1,
+        'codes2': codes2,
+        'shape': observed_table.shape,
+    }
+
+    sizes = [min(batch_size, n_permutations - start) for start in range(0, n_permutations, batch_size)]
+    streams = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [{'size': size, 'stream': stream} for size, stream in zip(sizes, streams)]
+    extreme = sum(battery.run_battery(_count_extreme, source=source, tasks=tasks, backend=backend, max_workers=max_workers))
+
+    p = (1 + extreme) / (n_permutations + 1)
+    return {
+        'statistic': float(observed),
+        'p': p,
+        'se': float(np.sqrt(p * (1 - p) / n_permutations)),
+        'n_permutations': n_permutations,
+        'n': len(codes1),
+        'shape': observed_table.shape,
+    }
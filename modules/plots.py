@@ -1,51 +1,100 @@
-# Custom plots functions for Notebooks
-from pltstat import cm
-import pandas as pd
+# Custom plots functions for Notebooks, the dashboard and the batch report
+#
+# Plotly figures of the dashboard are built from precomputed counts (no Streamlit dependencies).
+# matplotlib and seaborn are imported on first use of the function that needs them, so importing
+# this module (e.g. from the dashboard, which only uses the Plotly figures) does not load the
+# scientific plotting stack.
+#
+# Building and validating a Plotly figure costs far more than its data. The dashboard figures are
+# therefore built once per skeleton key (features, category labels, styling) and cached without
+# their template; each call creates the figure from the cached skeleton with only its data arrays
+# (z, text, customdata, values, box statistics) replaced, skipping the validation of the skeleton.
+import copy
+import threading
+from collections import OrderedDict
+
 import numpy as np
-import pingouin as pg
-import seaborn as sns
-from matplotlib import pyplot as plt
-
-from scipy.stats import mannwhitneyu
-from matplotlib.patches import Rectangle
-from matplotlib.colors import ListedColormap, BoundaryNorm, LinearSegmentedColormap
-from matplotlib.ticker import FormatStrFormatter
+import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import plotly.io as pio
-pio.renderers.default = "notebook"  # or "iframe", "svg", ""notebook_connected
+from plotly.subplots import make_subplots
 
+import stats
+import variables as v
+
+notebook_renderer = "notebook"  # or "iframe", "svg", ""notebook_connected
+
+SKELETON_CACHE_SIZE = 256  # Figure skeletons kept in memory
+_skeletons = OrderedDict()
+_skeletons_lock = threading.Lock()  # The cache is shared by the threads of all dashboard sessions
+
+
+def _skeleton(key, build):
+    """
+    Return the skeleton of a figure, built once per key and default Plotly template.
+
+    Args:
+        key (tuple): Hashable description of everything in the figure that is not patched.
+        build (callable): Function returning the figure, called if the skeleton is not cached.
+
+    Returns:
+        dict: Figure dict without the layout template (applied again to each new figure).
+    """
+    key = (key, str(pio.templates.default))  # Plotly Express takes default colors from the template
+    with _skeletons_lock:
+        skeleton = _skeletons.get(key)
+        if skeleton is not None:
+            _skeletons.move_to_end(key)
+            return skeleton
+
+    # Built outside the lock (concurrent builds of the same key give equal skeletons):
+    skeleton = build().to_dict()
+    skeleton['layout'].pop('template', None)
+    with _skeletons_lock:
+        _skeletons[key] = skeleton
+        if len(_skeletons) > SKELETON_CACHE_SIZE:
+            _skeletons.popitem(last=False)
+    return skeleton
+
+
+def _patched_figure(skeleton, traces, layout=None):
+    """
+    Create a figure from a skeleton with new data.
+
+    Args:
+        skeleton (dict): Figure skeleton (see `_skeleton`).
+        traces (list of dict): Properties to replace in each trace (e.g. z, text, customdata).
+        layout (dict, optional): Layout properties to replace (e.g. title).
+
+    Returns:
+        plotly.graph_objects.Figure: New figure; the skeleton is not modified.
+    """
+    data = [
+        {**{prop: copy.deepcopy(value) for prop, value in trace.items() if prop not in patch}, **patch}
+        for trace, patch in zip(skeleton['data'], traces)
+    ]
+    layout = {**copy.deepcopy(skeleton['layout']), **(layout or {})}
+    # The skeleton was validated when it was built:
+    return go.Figure({'data': data, 'layout': layout}, _validate=False)
+
+
+def pairwise_mw(df, features, key_value, cont_feat, alpha=0.05, backend='serial', max_workers=None):
+    # Compute p-value and median difference matrices (see stats.pairwise_mannwhitney) and plot them;
+    # `backend` and `max_workers` select the execution backend of the counting (see battery.run_battery)
+    result = stats.pairwise_mannwhitney(df, features, key_value, cont_feat, backend=backend, max_workers=max_workers)
+    return plot_pairwise_mw(result, alpha=alpha)
+
+
+def plot_pairwise_mw(result, alpha=0.05):
+    """Plot p-values and significant differences of a `stats.PairwiseResult` side by side."""
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+    from matplotlib.colors import ListedColormap, BoundaryNorm
+    from matplotlib.ticker import FormatStrFormatter
+
+    p_matrix, diff_matrix = result.p_matrix, result.diff_matrix
 
-def pairwise_mw(df, features, key_value, cont_feat, alpha=0.05):
-    # Create empty matrix for p-value
-    p_matrix = pd.DataFrame(index=features, columns=features, dtype=float)
-    diff_matrix = pd.DataFrame(index=features, columns=features, dtype=float)
-    
-    # Run through all pairs of columns
-    for i in features:
-        for j in features:
-            if i == j:
-                p_matrix.loc[i, j] = np.nan
-                diff_matrix.loc[i, j] = 0
-                continue
-            
-            # Choose only cases where both features are not missing
-            subset = df[[i, j, cont_feat]].dropna()
-            
-            # Group by Yes/No → 1/0
-            group1 = subset.loc[subset[i] == key_value, cont_feat]
-            group2 = subset.loc[subset[j] == key_value, cont_feat]
-            
-            # If subset is small → skip it
-            if len(group1) < 10 or len(group2) < 10:
-                p_matrix.loc[i, j] = np.nan
-                diff_matrix.loc[i, j] = np.nan
-                continue
-
-            # Mann–Whitney U test
-            stat, p = mannwhitneyu(group1, group2, alternative='two-sided')
-            p_matrix.loc[i, j] = p
-            diff_matrix.loc[i, j] = group2.median() - group1.median()
-    
     mask = p_matrix.fillna(1)>alpha
     diff_matrix = diff_matrix.mask(mask)
     
@@ -79,6 +128,8 @@ def _add_titles_mw_pairwise_age(ax):
 
 def _add_legend_mw_pairwise_age(ax):
     """Custom legend"""
+    from matplotlib.patches import Rectangle
+
     warm_patch = Rectangle((0, 0), 1, 1, facecolor='#f4a582', edgecolor='black', label='Row < Column (older)')
     cool_patch = Rectangle((0, 0), 1, 1, facecolor='#92c5de', edgecolor='black', label='Row > Column (younger)')
     neutral_patch = Rectangle((0, 0), 1, 1, facecolor='white', edgecolor='black', linewidth=1.5, label='Not significant or N<10')
@@ -99,34 +150,233 @@ def customize_mw_pairwise_age(ax):
 
 
 def pie(df, feat, title=None, colors=None, order=None, show_fig=True, return_fig=False):
-    """Plot a pie chart for a categorical column with counts and percentages."""
+    """
+    Plot a pie chart for a categorical column with counts and percentages.
+
+    `df` is either a dataframe or precomputed counts per category (e.g. `value_counts()`
+    or `CountCube.marginal`); only the counts per observed category are put into the figure.
+    The figure is built once per set of observed categories (see `_skeleton`).
+    """
     if title is None:
         title = feat
 
     category_orders = {feat: order} if order is not None else None
 
-    fig = px.pie(
-        df,
-        names=feat,
-        color=feat,
-        title=title,
-        color_discrete_map=colors,
-        category_orders=category_orders,
-    )
+    counts = df if isinstance(df, pd.Series) else df[feat].value_counts(sort=False)
+    counts = counts[counts > 0].round()  # Weighted counts are shown as whole persons
+    data = pd.DataFrame({feat: counts.index.astype(object), 'count': counts.to_numpy()})
 
-    fig.update_traces(
-        textinfo='label+percent+value',
-        texttemplate='%{label}<br>%{percent:.1%}<br>(%{value})',
-        hovertemplate='%{label}: <b>%{value}</b> (%{percent:.1%})'
-    )
+    def build():
+        fig = px.pie(
+            data,
+            names=feat,
+            values='count',
+            color=feat,
+            title=title,
+            color_discrete_map=colors,
+            category_orders=category_orders,
+        )
+
+        fig.update_traces(
+            textinfo='label+percent+value',
+            texttemplate='%{label}<br>%{percent:.1%}<br>(%{value})',
+            hovertemplate='%{label}: <b>%{value}</b> (%{percent:.1%})'
+        )
+        return fig
+
+    key = ('pie', feat, tuple(data[feat]), tuple((colors or {}).items()),
+           tuple(order) if order is not None else None)
+    skeleton = _skeleton(key, build)
+    labels = skeleton['data'][0]['labels']  # In the order of `category_orders`
+    values = data.set_index(feat)['count'].reindex(labels).to_numpy()
+    fig = _patched_figure(skeleton, [{'values': values}],
+                          {'title': {**skeleton['layout'].get('title', {}), 'text': title}})
     if show_fig is True:
-        fig.show()
+        fig.show(renderer=notebook_renderer)
 
     if return_fig is True:
         return fig
 
 
-def plot_posthoc_heatmap(df, dv, between, alpha=0.05, multiple_comparison=True, figsize=(10, 8), **kwargs):
+def hist_age_fig(age_counts, title='Age', bin_size=2):
+    """
+    Create an age histogram from per-age counts.
+
+    Bins start at the lowest observed age, like the browser-side binning of `px.histogram`
+    with `xbins=dict(start=min, size=bin_size)`; only the bin counts are sent to the browser.
+
+    Args:
+        age_counts (pd.Series): Person counts indexed by consecutive ages (see `age_counts`
+            or `CountCube.marginal(v.age_col)`).
+        title (str): Plot title. Defaults to 'Age'.
+        bin_size (int): Bin width in years. Defaults to 2.
+
+    Returns:
+        plotly.graph_objects.Figure: Bar chart of bin counts.
+    """
+    x = age_counts.index.name or v.age_col
+    ages = age_counts.index.to_numpy()
+    values = age_counts.to_numpy()
+
+    # Bins start at the lowest observed age:
+    observed = np.flatnonzero(values)
+    first, last = (observed[0], observed[-1] + 1) if len(observed) != 0 else (0, 0)
+    ages, values = ages[first:last].astype(np.int64), values[first:last]
+    start = ages[0] if len(ages) != 0 else 0
+    bins = np.bincount((ages - start) // bin_size, weights=values).astype(np.int64)
+    starts = start + bin_size * np.arange(len(bins))
+
+    patch = {
+        'x': starts + bin_size / 2,
+        'y': bins,
+        'customdata': [f"{start}-{start + bin_size - 1}" for start in starts],
+    }
+
+    def build():
+        fig = go.Figure(go.Bar(
+            width=bin_size,
+            hovertemplate=f"{x}=%{{customdata}}<br>count=%{{y}}<extra></extra>",
+            textfont_size=20,
+            textposition="inside",
+            texttemplate="%{y:.0f}",
+            **patch,
+        ))
+        fig.update_layout(title=title, bargap=0, xaxis_title=x, yaxis_title='count')
+        return fig
+
+    return _patched_figure(_skeleton(('hist_age', x, title, bin_size), build), [patch])
+
+
+def boxplot_counts(table, category_orders, color_discrete_map):
+    """
+    Create a box plot from value counts per category.
+
+    Quartiles, medians and whiskers are computed here (see `stats.box_stats`) and sent
+    as precomputed boxes, so the figure size does not depend on the number of rows.
+
+    Args:
+        table (pd.DataFrame): Counts with categories as index and sorted continuous values as columns,
+            e.g. `CountCube.crosstab(cat_feat, v.age_col)`.
+        category_orders (list): Desired order of categories on the axis.
+        color_discrete_map (dict): Mapping from category values to colors.
+
+    Returns:
+        plotly.graph_objects.Figure: Configured box plot figure.
+    """
+    cat_feat, cont_feat = table.index.name, table.columns.name
+    box = stats.box_stats(table)
+    order = [cat for cat in category_orders if cat in box.index]
+    order += [cat for cat in box.index if cat not in order]
+
+    stat_names = ['q1', 'median', 'q3', 'lowerfence', 'upperfence']
+    patches = [{name: [box.loc[cat, name]] for name in stat_names} for cat in order]
+
+    def build():
+        fig = go.Figure()
+        for cat, patch in zip(order, patches):
+            fig.add_trace(go.Box(
+                y=[cat],
+                name=str(cat),
+                orientation="h",
+                boxpoints=False,
+                marker_color=(color_discrete_map or {}).get(cat),
+                offsetgroup=str(cat),
+                alignmentgroup='True',
+                hovertemplate=f"{cat_feat}=%{{y}}<br>{cont_feat}=%{{x}}<extra></extra>",
+                **patch,
+            ))
+
+        fig.update_layout(
+            boxmode='overlay',
+            showlegend=False,
+            xaxis_title=cont_feat,
+            yaxis_title=cat_feat,
+            yaxis=dict(categoryorder='array', categoryarray=list(category_orders)[::-1]),
+            margin=dict(t=60),
+        )
+        return fig
+
+    key = ('box', cat_feat, cont_feat, tuple(order), tuple(category_orders),
+           tuple((color_discrete_map or {}).items()))
+    return _patched_figure(_skeleton(key, build), patches)
+
+
+def _label_sort_key(labels):
+    """Sort key of heatmap labels: categorical labels in alphabetical order, as plain string labels."""
+    if isinstance(labels.dtype, pd.CategoricalDtype):
+        return labels.astype(object)
+    return labels
+
+
+def crosstab_counts_plot(ct_abs, ci=None, level=v.ci_level):
+    """
+    Create side-by-side heatmaps from a precomputed contingency table.
+
+    Both normalizations are derived from the absolute counts. Rows and columns are sorted by
+    label (alphabetically for categorical labels, not in category order).
+
+    Args:
+        ct_abs (pd.DataFrame): Absolute counts (rows - first feature, columns - second feature).
+        ci (dict, optional): Confidence intervals shown on hover: mapping 'index' (row shares)
+            and 'columns' (column shares) -> (lower, upper) DataFrames labelled like `ct_abs`.
+        level (float): Confidence level of `ci`, for the hover text. Defaults to v.ci_level.
+
+    Returns:
+        plotly.graph_objects.Figure: Figure with two heatmap subplots.
+    """
+    ct_abs = ct_abs.sort_index(key=_label_sort_key).sort_index(axis=1, key=_label_sort_key)
+    counts = ct_abs.round().to_numpy()[..., None]
+    ct_h = stats.normalize(ct_abs, 'index')
+    ct_v = stats.normalize(ct_abs, 'columns')
+
+    hovertemplate = "%{y} / %{x}<br>%{customdata[0]} patients (%{z:.2%})"
+    customdata = {'index': counts, 'columns': counts}
+    if ci is not None:
+        hovertemplate += f"<br>{level:.0%} CI: %{{customdata[1]:.1%}} - %{{customdata[2]:.1%}}"
+        for normalize, (lower, upper) in ci.items():
+            bounds = [bound.reindex(index=ct_abs.index, columns=ct_abs.columns).to_numpy() for bound in (lower, upper)]
+            customdata[normalize] = np.dstack([counts[..., 0]] + bounds)
+    hovertemplate += "<extra></extra>"
+
+    patches = [
+        {
+            'z': ct.values,
+            'text': np.round(ct.values * 100, 1).astype(str) + "%",
+            'customdata': customdata[normalize],
+        }
+        for normalize, ct in (('index', ct_h), ('columns', ct_v))
+    ]
+
+    def build():
+        fig = make_subplots(
+            rows=1, cols=2,
+            subplot_titles=("Row-normalized (horizontal)", "Column-normalized (vertical)"),
+            horizontal_spacing=0.08
+        )
+
+        for col, (patch, colorbar_title) in enumerate(zip(patches, ["Share (row)", "Share (col)"]), start=1):
+            fig.add_trace(
+                go.Heatmap(
+                    x=ct_abs.columns.astype(str),
+                    y=ct_abs.index.astype(str),
+                    texttemplate="%{text}",
+                    hovertemplate=hovertemplate,
+                    zmin=0, zmax=1,
+                    colorbar=dict(title=colorbar_title),
+                    **patch,
+                ),
+                row=1, col=col
+            )
+        fig.update_yaxes(autorange="reversed", row=1, col=1)
+        fig.update_yaxes(visible=False, row=1, col=2, autorange="reversed")
+        return fig
+
+    key = ('crosstab', tuple(ct_abs.index.astype(str)), tuple(ct_abs.columns.astype(str)), hovertemplate)
+    return _patched_figure(_skeleton(key, build), patches)
+
+
+def plot_posthoc_heatmap(df, dv, between, alpha=0.05, multiple_comparison=True, figsize=(10, 8),
+                         backend='serial', max_workers=None, show_fig=True, return_fig=False, **kwargs):
     """
     Perform pairwise post-hoc tests using Pingouin and plot a heatmap of corrected p-values.
 
@@ -144,6 +394,15 @@ def plot_posthoc_heatmap(df, dv, between, alpha=0.05, multiple_comparison=True,
         If True, use corrected p-values ('p-corr'). If False, use uncorrected p-values ('p-unc').
     figsize : tuple of two ints, optional
         Figure size in inches (width, height) for the heatmap plot. Default is (10, 8).
+    backend : str
+        Execution backend of the tests of the group pairs: 'serial', 'threads' or 'processes'
+        (see `stats.posthoc_tests`). Default is 'serial'.
+    max_workers : int, optional
+        Number of workers. Default is the number of CPUs.
+    show_fig : bool
+        If True, show the figure with `plt.show()`. Set it to False in batch jobs. Default is True.
+    return_fig : bool
+        If True, also return the matplotlib figure. Default is False.
     **kwargs : dict
         Additional arguments passed to pg.pairwise_tests.
 
@@ -151,16 +410,45 @@ def plot_posthoc_heatmap(df, dv, between, alpha=0.05, multiple_comparison=True,
     -------
     pivot_table : pd.DataFrame
         Symmetric pivot table of corrected p-values.
+    fig : matplotlib.figure.Figure
+        Heatmap figure (only if `return_fig` is True).
     """
-    p_val_col = {False: 'p-unc', True: 'p-corr'}[multiple_comparison]
-    # Run pairwise posthoc
-    posthoc = pg.pairwise_tests(data=df, dv=dv, between=between, **kwargs)
+    from matplotlib import pyplot as plt
 
-    # Create symmetric table
-    posthoc_dbl = pd.concat([posthoc, posthoc.rename(columns={'A': 'B', 'B': 'A'})], ignore_index=True)
+    # Run pairwise posthoc (see stats.posthoc_tests)
+    result = stats.posthoc_tests(df, dv, between, multiple_comparison=multiple_comparison,
+                                 backend=backend, max_workers=max_workers, **kwargs)
 
-    # Pivot table to matrix form
-    pivot_table = posthoc_dbl[['A', 'B', p_val_col]].pivot(index='A', columns='B', values=p_val_col)
+    ax = plot_posthoc_result(result, alpha=alpha, figsize=figsize)
+    if show_fig is True:
+        plt.show()
+
+    if return_fig is True:
+        return result.p_matrix, ax.figure
+    return result.p_matrix
+
+
+def plot_posthoc_result(result, alpha=0.05, figsize=(10, 8)):
+    """
+    Plot a heatmap of post-hoc p-values.
+
+    Parameters
+    ----------
+    result : stats.PairwiseResult
+        Result of `stats.posthoc_tests`.
+    alpha : float
+        Significance threshold.
+    figsize : tuple of two ints, optional
+        Figure size in inches (width, height). Default is (10, 8).
+
+    Returns
+    -------
+    ax : matplotlib.axes.Axes
+        Axes with the heatmap.
+    """
+    import seaborn as sns
+    from matplotlib import pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
 
     # Heatmap color mapping
     sign_col = "green"
@@ -172,18 +460,17 @@ def plot_posthoc_heatmap(df, dv, between, alpha=0.05, multiple_comparison=True,
         (1, insign_col),
     ]
     cmap = LinearSegmentedColormap.from_list("custom", cmap)
-    label = {False: 'Uncorrected p-value', True: 'Corrected p-value'}[multiple_comparison]
+    label = {False: 'Uncorrected p-value', True: 'Corrected p-value'}[result.corrected]
 
     plt.figure(figsize=figsize)
-    sns.heatmap(
-        pivot_table,
+    ax = sns.heatmap(
+        result.p_matrix,
         annot=True,
         fmt=".3f",
         cmap=cmap,
         linewidths=0.5,
         cbar_kws={'ticks': [0.0, alpha, 1.0], 'label': label},
     )
-    plt.title(f'Heatmap of Posthoc Corrected p-values ({dv})')
-    plt.show()
+    plt.title(f'Heatmap of Posthoc Corrected p-values ({result.dv})')
 
-    return pivot_table
+    return ax
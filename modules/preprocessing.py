@@ -0,0 +1,277 @@
+# MEPS data loading and preprocessing (no Streamlit dependencies)
+import os
+import pandas as pd
+import numpy as np
+
+from pandas.api.types import union_categoricals
+
+import cancer_mask
+import variables as v
+
+# Rows per chunk when reading Stata files. Full-size MEPS files have ~1500 columns,
+# and a chunk is decoded with all of them before column projection.
+DEFAULT_CHUNKSIZE = 20_000
+
+
+def raw_columns(year=None, design=False):
+    """
+    Return the list of raw MEPS columns required by the analysis.
+
+    Args:
+        year (int, optional): MEPS year. Column names are translated with `v.year_columns`.
+        design (bool): If True, add the survey design columns (person weight, VARSTR, VARPSU).
+
+    Returns:
+        list: Column names as they appear in the file of `year`.
+    """
+    cols = [v.cancer_feat, v.age_col, v.sex_col, v.race_col] + list(v.cancer_types)
+    renames = v.year_columns.get(year, {})
+    cols = [renames.get(col, col) for col in cols]
+    if design:
+        cols += [v.weight_columns[year or v.default_year], v.strata_col, v.psu_col]
+    return cols
+
+
+def _canonical_names(year):
+    """Return mapping from the column names of `year` to the names used in this project."""
+    names = {year_col: col for col, year_col in v.year_columns.get(year, {}).items()}
+    names[v.weight_columns[year or v.default_year]] = v.weight_col
+    return names
+
+
+def _file_columns(data_path):
+    """Return the column names of a Stata file (header only)."""
+    with pd.read_stata(data_path, iterator=True) as reader:
+        return set(reader.variable_labels())
+
+
+def has_design(data_path, year=None):
+    """Return True if the Stata file contains the survey design columns of `year` (header only)."""
+    return set(raw_columns(year, design=True)) <= _file_columns(data_path)
+
+
+def _checked_columns(data_path, year=None, design=None):
+    """
+    Return the raw columns to read from a Stata file, checked against its header.
+
+    Args:
+        data_path (str): Path to the .dta file.
+        year (int, optional): MEPS year of the file.
+        design (bool, optional): Whether to read the survey design columns.
+            Defaults to reading them if the file contains them.
+
+    Returns:
+        list: Column names as they appear in the file (see `raw_columns`).
+
+    Raises:
+        ValueError: If the file lacks a required column, e.g. one renamed in the MEPS
+            file of `year` but not translated in `v.year_columns`.
+    """
+    file_cols = _file_columns(data_path)
+    if design is None:
+        design = set(raw_columns(year, design=True)) <= file_cols
+    cols = raw_columns(year, design)
+    missing = [col for col in cols if col not in file_cols]
+    if len(missing) != 0:
+        raise ValueError(
+            f"MEPS {year or v.default_year} file {os.path.basename(data_path)} lacks the required columns "
+            f"{missing}; add their names in that year to `year_columns` in modules/variables.py"
+        )
+    return cols
+
+
+def read_raw(data_path, year=None, design=None):
+    """
+    Read the raw MEPS columns from a Stata file.
+
+    Args:
+        data_path (str): Path to the .dta file.
+        year (int, optional): MEPS year of the file, used for column name translation.
+        design (bool, optional): Whether to read the survey design columns.
+            Defaults to reading them if the file contains them.
+
+    Returns:
+        pd.DataFrame: Raw dataframe restricted to `raw_columns()`.
+
+    Raises:
+        ValueError: If the file lacks a required column (see `_checked_columns`).
+    """
+    df = pd.read_stata(data_path, columns=_checked_columns(data_path, year, design))
+    return df.rename(columns=_canonical_names(year))
+
+
+def read_chunks(data_path, chunksize=DEFAULT_CHUNKSIZE, year=None, design=None):
+    """
+    Iterate over a Stata file in chunks, keeping only `raw_columns()`.
+
+    Args:
+        data_path (str): Path to the .dta file.
+        chunksize (int): Number of rows per chunk.
+        year (int, optional): MEPS year of the file, used for column name translation.
+        design (bool, optional): Whether to read the survey design columns.
+            Defaults to reading them if the file contains them.
+
+    Yields:
+        pd.DataFrame: Raw chunk restricted to `raw_columns()`.
+
+    Raises:
+        ValueError: If the file lacks a required column (see `_checked_columns`).
+    """
+    cols = _checked_columns(data_path, year, design)
+    renames = _canonical_names(year)
+    with pd.read_stata(data_path, columns=cols, chunksize=chunksize, iterator=True) as reader:
+        for chunk in reader:
+            yield chunk.rename(columns=renames)
+
+
+def concat(parts, ignore_index=False):
+    """
+    Concatenate preprocessed frames, keeping categorical columns categorical.
+
+    Categoricals with fixed categories concatenate as is. Columns whose categories
+    differ between parts (e.g. Stata value labels) are unified first.
+
+    Args:
+        parts (list of pd.DataFrame): Preprocessed frames with the same columns.
+        ignore_index (bool): If True, the result gets a new RangeIndex.
+
+    Returns:
+        pd.DataFrame: Concatenated dataframe.
+    """
+    parts = [part for part in parts if len(part) > 0] or parts[:1]
+    for col in parts[0].select_dtypes('category').columns:
+        if len({str(part[col].dtype.categories.tolist()) for part in parts}) > 1:
+            categories = union_categoricals([part[col] for part in parts]).categories
+            for part in parts:
+                part[col] = part[col].cat.set_categories(categories)
+    return pd.concat(parts, ignore_index=ignore_index)
+
+
+def recode(col, mapping, categories):
+    """
+    Recode a categorical column into fixed categories using integer codes only.
+
+    Args:
+        col (pd.Series): Categorical column.
+        mapping (dict): Mapping from old labels to new labels. Unmapped labels are kept,
+            labels mapped to None or outside `categories` become missing.
+        categories (list): Ordered list of resulting categories.
+
+    Returns:
+        pd.Series: Categorical column with `categories` as its categories.
+    """
+    if not isinstance(col.dtype, pd.CategoricalDtype):
+        col = col.astype('category')
+
+    dtype = pd.CategoricalDtype(categories)
+    new_codes = dtype.categories.get_indexer([mapping.get(c, c) for c in col.cat.categories])
+    lookup = np.append(new_codes, -1).astype(np.int8)  # Last element - for missing values (code -1)
+    codes = lookup[col.cat.codes.to_numpy()]
+
+    return pd.Series(pd.Categorical.from_codes(codes, dtype=dtype), index=col.index, name=col.name)
+
+
+def preprocess(df):
+    """
+    Preprocess raw MEPS columns into the analysis frame used by the dashboard.
+
+    Cancer, demographic and Yes/No columns are kept as pandas categoricals whose
+    categories follow the fixed orders in `variables` (`cancer_type_order`,
+    `yes_no_order`, `age_groups`); labels are only materialized at render time.
+
+    Args:
+        df (pd.DataFrame): Raw dataframe as returned by `read_raw`.
+
+    Returns:
+        pd.DataFrame: Preprocessed dataframe.
+    """
+    # Drop inapplicable answers:
+    df = df.loc[~df[v.cancer_feat].isin(v.vals_to_drop), :].copy()
+
+    # Replace answers:
+    df[v.cancer_feat] = recode(
+        df[v.cancer_feat],
+        {v.yes_raw_ans: v.yes_ans, v.no_raw_ans: v.no_ans},
+        v.yes_no_order,
+    )
+
+    # Cancer types per patient (bit mask, number of types, Multiple and CANCERDX_type):
+    diagnosed = (df[v.cancer_feat] == v.yes_ans).to_numpy()
+    df = pd.concat([df, cancer_mask.derive(df, diagnosed)], axis=1)
+
+    # Invalid or missing values (DK, Refused) in cancer_type columns become missing values,
+    # Inapplicable when CANCERDX is No.
+    # Rename the columns to readable names:
+    for col, type_name in zip(v.cancer_types, v.cancer_type_names):
+        df[type_name] = recode(
+            df[col],
+            {
+                '-8 DK': None,
+                '-7 REFUSED': None,
+                v.no_raw_ans: v.no_ans,
+                '-1 INAPPLICABLE': v.no_ans,
+                v.yes_raw_ans: v.yes_ans,
+            },
+            v.yes_no_order,
+        )
+    df = df.drop(columns=v.cancer_types)
+
+    # Race values correction:
+    race_names = df[v.race_col].cat.categories.to_series()
+    race_names = race_names.str.replace(r' - NO OTHER RACE REPORTED$', '', regex=True)
+    race_names = race_names.str.replace(r'-NO OTH$', '', regex=True)
+    race_names = race_names.str.replace(r'-NO OTHER RACE$', '', regex=True)
+    race_names = race_names.replace(
+        {
+            "3 AMER INDIAN/ALASKA NATIVE": "3 INDIAN/\nALASKA",
+            "4 ASIAN/NATV HAWAIIAN/PACFC ISL": "4 ASIAN/\nHAWAIIAN",
+            "6 MULTIPLE RACES REPORTED": "6 MULTIPLE",
+        }
+    )
+    df[v.race_col] = df[v.race_col].cat.rename_categories(race_names.to_list())
+
+    # Survey design columns (if read): numeric weight, integer strata and PSUs:
+    if v.weight_col in df.columns:
+        df[v.weight_col] = df[v.weight_col].astype(np.float64)
+        df[v.strata_col] = df[v.strata_col].astype(np.int32)
+        df[v.psu_col] = df[v.psu_col].astype(np.int32)
+
+    # For Age choice, let's create categories (18-39, 40-64, 65-85):
+    df[v.age_col_cat] = pd.cut(
+        df[v.age_col],
+        bins=v.age_bins,
+        labels=v.age_groups,
+        include_lowest=True
+    )
+
+    return df
+
+
+def load(data_path, chunksize=DEFAULT_CHUNKSIZE, year=None):
+    """
+    Read and preprocess a MEPS Stata file chunk by chunk.
+
+    Each chunk is projected to `raw_columns()` and preprocessed before the next
+    one is read, so peak memory depends on `chunksize`, not on the file size.
+
+    Args:
+        data_path (str): Path to the .dta file.
+        chunksize (int): Number of rows per chunk.
+        year (int, optional): MEPS year of the file, used for column name translation.
+
+    Returns:
+        pd.DataFrame: Preprocessed dataframe.
+
+    Raises:
+        FileNotFoundError: If the data file does not exist.
+        pd.errors.EmptyDataError: If the loaded data is empty.
+        ValueError: If the file lacks a required column (see `_checked_columns`).
+    """
+    if not os.path.exists(data_path):
+        raise FileNotFoundError(data_path)
+
+    parts = [preprocess(chunk) for chunk in read_chunks(data_path, chunksize, year)]
+    if len(parts) == 0:
+        raise pd.errors.EmptyDataError(f"Loaded data is empty: {data_path}")
+
+    return concat(parts)
@@ -0,0 +1,279 @@
+# Headless batch report of the dashboard views and statistics
+#
+# The report loads the preprocessed panel (the same cache as the dashboard, without Streamlit),
+# builds the count cube and evaluates every dashboard view:
+# - block 1: each demographic feature;
+# - block 2: each demographic feature x cancer feature x "exclude No answer";
+# - block 3: each demographic feature x (no filter or one value of it) x (no filter or one cancer type).
+# Views are rendered by parallel workers (see battery.py; the count cube is the source object of
+# that battery). Each view writes its table as CSV and its figures as HTML, or PNG when kaleido is
+# installed. The pairwise Mann-Whitney and post-hoc tests run per year and on all selected years.
+# Per-stage timings are printed to stderr and written to timings.json.
+#
+# To run it from the project root: `python modules/report.py --out docs/report`
+import argparse
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+import battery
+import bitmap
+import cube
+import panel
+import stats
+import variables as v
+import views
+
+figure_formats = ['html', 'png', 'none']
+
+
+def _slug(*parts):
+    """Return a file name made of the non-empty parts."""
+    return '_'.join(re.sub(r'[^0-9A-Za-z]+', '-', str(part)).strip('-') for part in parts if part is not None)
+
+
+def _write_figures(figs, out_dir, name, figure_format):
+    """Write figures as `name`.html (or .png), `name`-1.html, ...; return the file names."""
+    if figure_format == 'none':
+        return []
+    files = []
+    for i, fig in enumerate(figs):
+        file_name = f'{name}-{i}.{figure_format}' if i > 0 else f'{name}.{figure_format}'
+        path = os.path.join(out_dir, file_name)
+        if figure_format == 'html':
+            fig.write_html(path, include_plotlyjs='cdn')
+        else:
+            fig.write_image(path)
+        files.append(file_name)
+    return files
+
+
+def view_tasks(counts, year_filter):
+    """
+    Build one task per dashboard view.
+
+    Args:
+        counts (cube.CountCube): Person counts.
+        year_filter (dict): Mapping v.year_col -> selected years (empty - all years).
+
+    Returns:
+        list of dict: Keyword arguments of `render_view`.
+    """
+    tasks = []
+    for dem_feat in views.dem_feats:
+        tasks.append({'block': 1, 'dem_feat': dem_feat, 'view_filters': dict(year_filter)})
+
+    for dem_feat in views.dem_feats:
+        for cancer_feat in [v.cancer_feat, v.cancer_feat_type]:
+            for exclude_no in ([False] if cancer_feat == v.cancer_feat else [False, True]):
+                tasks.append({'block': 2, 'dem_feat': dem_feat, 'cancer_feat': cancer_feat,
+                              'view_filters': views.block2_filters(year_filter, exclude_no), 'exclude_no': exclude_no})
+
+    cancer_types = list(counts.marginal(v.cancer_feat_type, year_filter, observed=True).index)
+    for dem_feat in views.dem_feats:
+        filter_feat = v.age_col_cat if dem_feat == v.age_col else dem_feat
+        dem_values = list(counts.marginal(filter_feat, year_filter, observed=True).index)
+        other_dem_feats = [feat for feat in views.dem_feats if feat != dem_feat]
+        for dem_value in [None] + dem_values:
+            for cancer_type in [None] + cancer_types:
+                view_filters = dict(year_filter)
+                view_filters[v.cancer_feat_type] = [cancer_type] if cancer_type is not None else []
+                view_filters[filter_feat] = [dem_value] if dem_value is not None else []
+                tasks.append({'block': 3, 'dem_feat': filter_feat, 'other_dem_feats': other_dem_feats,
+                              'view_filters': view_filters, 'dem_value': dem_value, 'cancer_type': cancer_type})
+    return tasks
+
+
+def render_view(counts, block, dem_feat, view_filters, out_dir, figure_format='html', cancer_feat=None,
+                exclude_no=False, other_dem_feats=None, dem_value=None, cancer_type=None):
+    """
+    Compute the table and figures of one dashboard view and write them to `out_dir`.
+
+    Args:
+        counts (cube.CountCube): Person counts.
+        block (int): Dashboard block (1, 2 or 3).
+        dem_feat (str): Demographic feature of the view (the filtered feature for block 3).
+        view_filters (dict): Mapping feature -> list of selected labels.
+        out_dir (str): Output directory.
+        figure_format (str): 'html', 'png' or 'none'. Defaults to 'html'.
+        cancer_feat (str, optional): Cancer feature of block 2.
+        exclude_no (bool): Whether No answers are excluded (block 2).
+        other_dem_feats (list, optional): Plotted demographic features of block 3.
+        dem_value (str, optional): Selected value of `dem_feat` (block 3).
+        cancer_type (str, optional): Selected cancer type (block 3).
+
+    Returns:
+        dict: Summary row of the view (name, block, features, filters, number of persons, files).
+    """
+    if block == 1:
+        name = _slug('block1', dem_feat)
+        table = counts.marginal(dem_feat, view_filters).rename('count').to_frame()
+        table['share'] = table['count'] / table['count'].sum()
+        figs = [views.block1_figure(counts, dem_feat, view_filters)]
+
+    elif block == 2:
+        name = _slug('block2', dem_feat, cancer_feat, 'exclude-no' if exclude_no else None)
+        crosstab = counts.crosstab(cancer_feat, dem_feat, view_filters)
+        if dem_feat == v.age_col:
+            table = stats.box_stats(crosstab)
+            figs = [views.block2_figure(counts, cancer_feat, dem_feat, view_filters)]
+        else:
+            ci = views.crosstab_ci(crosstab)
+            columns = {'count': crosstab}
+            for normalize, (lower, upper) in ci.items():
+                columns[f'share_{normalize}'] = stats.normalize(crosstab, normalize)
+                columns[f'lower_{normalize}'], columns[f'upper_{normalize}'] = lower, upper
+            table = pd.concat({key: values.stack() for key, values in columns.items()}, axis=1)
+            figs = [views.block2_figure(counts, cancer_feat, dem_feat, view_filters, ci=ci)]
+
+    else:
+        name = _slug('block3', dem_feat, dem_value, cancer_type)
+        table = pd.concat({
+            feat: counts.marginal(feat, view_filters).rename_axis('label')
+            for feat in [v.cancer_feat] + list(other_dem_feats)
+        }, names=['feature']).rename('count').to_frame()
+        figs = views.block3_figures(counts, view_filters, other_dem_feats) if counts.total(view_filters) > 0 else []
+
+    table.to_csv(os.path.join(out_dir, f'{name}.csv'))
+    return {
+        'view': name,
+        'block': block,
+        'dem_feat': dem_feat,
+        'cancer_feat': cancer_feat,
+        'filters': json.dumps({feat: list(map(str, values)) for feat, values in view_filters.items() if values}),
+        'n': counts.total(view_filters),
+        'files': ' '.join([f'{name}.csv'] + _write_figures(figs, out_dir, name, figure_format)),
+    }
+
+
+def _stats_task(df, test):
+    """Run one statistical test of the report on a stratum (battery compute function)."""
+    if test == 'pairwise_mw':
+        return stats.pairwise_mannwhitney(df, v.cancer_type_names, v.yes_ans, v.age_col)
+    types = df[v.cancer_feat_type].cat.remove_unused_categories()
+    return stats.posthoc_tests(df.assign(**{v.cancer_feat_type: types}), dv=v.age_col, between=v.cancer_feat_type,
+                               padjust='holm')
+
+
+def stats_tasks(years):
+    """Build the statistical test tasks: each test per year (if several) and on all selected years."""
+    strata = [('all', {v.year_col: list(years)} if years else None)]
+    if len(years) > 1:
+        strata += [(year, {v.year_col: [year]}) for year in years]
+
+    tests = ['pairwise_mw']
+    if importlib.util.find_spec('pingouin') is not None:
+        tests.append('posthoc')
+    else:
+        print('pingouin is not installed: post-hoc tests are skipped', file=sys.stderr)
+    return [{'test': test, 'filters': filters, 'stratum': stratum} for test in tests for stratum, filters in strata]
+
+
+def write_stats(results, tasks, out_dir, figure_format='html'):
+    """Write p-value (and median difference) matrices as CSV and pairwise Mann-Whitney heatmaps as PNG."""
+    for task, result in zip(tasks, results):
+        name = _slug('stats', task['test'], task['stratum'])
+        result.p_matrix.to_csv(os.path.join(out_dir, f'{name}_p.csv'))
+        if result.diff_matrix is not None:
+            result.diff_matrix.to_csv(os.path.join(out_dir, f'{name}_diff.csv'))
+        if result.table is not None:
+            result.table.to_csv(os.path.join(out_dir, f'{name}_table.csv'), index=False)
+
+        if task['test'] == 'pairwise_mw' and figure_format != 'none':
+            import plots
+            from matplotlib import pyplot as plt
+
+            ax = plots.plot_pairwise_mw(result)
+            ax[0].figure.savefig(os.path.join(out_dir, f'{name}.png'), bbox_inches='tight')
+            plt.close(ax[0].figure)
+
+
+def run(out_dir, years=None, backend='processes', max_workers=None, figure_format='html',
+        data_dir=None, cache_dir=None):
+    """
+    Generate the report.
+
+    Args:
+        out_dir (str): Output directory (created if needed).
+        years (list, optional): Years to report. Defaults to all available years.
+        backend (str): Execution backend of the views and tests (see `battery.run_battery`).
+        max_workers (int, optional): Number of workers. Defaults to the number of CPUs.
+        figure_format (str): 'html', 'png' (requires kaleido) or 'none'. Defaults to 'html'.
+        data_dir (str, optional): Directory with MEPS .dta files. Defaults to data/.
+        cache_dir (str, optional): Cache root directory. Defaults to data/cache.
+
+    Returns:
+        dict: Mapping stage -> duration in seconds.
+
+    Raises:
+        FileNotFoundError: If no data file of the requested years is found.
+    """
+    if years is None:
+        years = panel.available_years(data_dir)
+    if len(years) == 0:
+        raise FileNotFoundError(f"No data files found in: {os.path.normpath(data_dir or panel.DEFAULT_DATA_DIR)}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    timings = {}
+
+    def stage(name, start):
+        timings[name] = time.perf_counter() - start
+        print(f'{name:8s} {timings[name]:8.2f} s', file=sys.stderr)
+
+    start = time.perf_counter()
+    df = panel.load_panel(years, data_dir, cache_dir)
+    stage('load', start)
+
+    start = time.perf_counter()
+    counts = cube.CountCube.build(df)
+    index = bitmap.BitmapIndex.build(df)
+    year_filter = {v.year_col: list(years)} if v.year_col in counts.dims else {}
+    stage('cube', start)
+
+    start = time.perf_counter()
+    tasks = [{**task, 'out_dir': out_dir, 'figure_format': figure_format} for task in view_tasks(counts, year_filter)]
+    summary = battery.run_battery(render_view, source=counts, tasks=tasks, backend=backend, max_workers=max_workers)
+    pd.DataFrame(summary).to_csv(os.path.join(out_dir, 'views.csv'), index=False)
+    stage('views', start)
+
+    start = time.perf_counter()
+    tasks = stats_tasks(list(years) if year_filter else [])
+    results = battery.run_battery(
+        _stats_task, df, [{'test': task['test'], 'filters': task['filters']} for task in tasks],
+        backend, max_workers, index=index,
+    )
+    write_stats(results, tasks, out_dir, figure_format)
+    stage('stats', start)
+
+    timings['total'] = sum(timings.values())
+    with open(os.path.join(out_dir, 'timings.json'), 'w') as f:
+        json.dump({'years': list(map(int, years)), 'views': len(summary), 'backend': backend,
+                   'seconds': timings}, f, indent=2)
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the tables and figures of all dashboard views.')
+    parser.add_argument('--out', default=os.path.join('docs', 'report'), help='Output directory (default: docs/report)')
+    parser.add_argument('--years', type=int, nargs='*', default=None, help='Years to report (default: all available)')
+    parser.add_argument('--backend', choices=battery.backends, default='processes', help='Execution backend')
+    parser.add_argument('--workers', type=int, default=None, help='Number of workers (default: number of CPUs)')
+    parser.add_argument('--figures', choices=figure_formats, default='html', help='Figure format (png requires kaleido)')
+    parser.add_argument('--data-dir', default=None, help='Directory with MEPS .dta files (default: data/)')
+    parser.add_argument('--cache-dir', default=None, help='Cache root directory (default: data/cache)')
+    args = parser.parse_args()
+
+    if args.figures == 'png' and importlib.util.find_spec('kaleido') is None:
+        parser.error('--figures png requires the kaleido package')
+
+    try:
+        timings = run(args.out, args.years, args.backend, args.workers, args.figures, args.data_dir, args.cache_dir)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(f'Report written: {os.path.normpath(args.out)} ({timings["total"]:.1f} s)', file=sys.stderr)
@@ -0,0 +1,464 @@
+# Statistics helpers shared by the dashboard and the notebooks
+#
+# Pure compute layer: nothing here imports matplotlib, seaborn or plotly, results are returned
+# as data (DataFrames and `PairwiseResult` objects) and rendered by modules/plots.py.
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+import variables as v
+
+CONTINGENCY_CACHE_SIZE = 128
+_contingency_cache = OrderedDict()
+_contingency_lock = threading.Lock()  # The cache is shared by the threads of all dashboard sessions
+
+
+@dataclass
+class PairwiseResult:
+    """
+    Result of a pairwise test battery.
+
+    Attributes:
+        p_matrix (pd.DataFrame): Symmetric matrix of p-values (NaN on the diagonal and for skipped pairs).
+        diff_matrix (pd.DataFrame, optional): Effect matrix, e.g. median differences (column - row).
+        test (str): Name of the test.
+        dv (str): Dependent (continuous) variable.
+        p_value (str): 'p-unc' for uncorrected or 'p-corr' for corrected p-values.
+        table (pd.DataFrame, optional): Long-format table with one row per pair, as returned by the test.
+        params (dict): Parameters of the battery.
+    """
+    p_matrix: pd.DataFrame
+    diff_matrix: pd.DataFrame = None
+    test: str = ''
+    dv: str = ''
+    p_value: str = 'p-unc'
+    table: pd.DataFrame = None
+    params: dict = field(default_factory=dict)
+
+    @property
+    def corrected(self):
+        """Whether p-values are corrected for multiple comparisons."""
+        return self.p_value == 'p-corr'
+
+
+def codes(col, dense=False):
+    """
+    Return the labels of a column and the label code of each row.
+
+    Args:
+        col (pd.Series): Column.
+        dense (bool): If True, an integer (non-categorical) column gets every integer from its
+            minimum to its maximum as labels (e.g. consecutive ages), observed or not.
+            Otherwise its observed values are the labels, sorted. Categorical columns always
+            get their categories. Defaults to False.
+
+    Returns:
+        tuple: (pd.Index of labels, np.ndarray of codes); missing values get code -1.
+    """
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        return pd.CategoricalIndex(col.cat.categories, dtype=col.dtype, name=col.name), col.cat.codes.to_numpy()
+    if dense:
+        values = col.to_numpy()
+        labels = pd.Index(np.arange(values.min(), values.max() + 1), name=col.name)
+        return labels, (values - values.min()).astype(np.int64)
+    col_codes, labels = pd.factorize(col, sort=True)
+    return pd.Index(labels, name=col.name), col_codes
+
+
+def filter_mask(df, filters, index=None):
+    """
+    Return a bool mask of rows matching the filters.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        filters (dict): Mapping column -> list of selected values. Empty lists mean no filter.
+        index (bitmap.BitmapIndex, optional): Bitmap index of `df`. Used instead of scanning
+            the columns when it covers all filtered columns.
+
+    Returns:
+        np.ndarray or None: Bool mask, or None if no filter is set.
+    """
+    if index is not None and index.covers(filters):
+        return index.mask(filters)
+
+    mask = None
+    for col, values in (filters or {}).items():
+        if values is None or len(values) == 0:
+            continue
+        labels, col_codes = codes(df[col])
+        positions = labels.get_indexer(list(values))
+        col_mask = np.isin(col_codes, positions[positions >= 0])  # Unknown labels (-1) match no row
+        mask = col_mask if mask is None else mask & col_mask
+    return mask
+
+
+def _filters_key(filters):
+    """Return a hashable, order-independent key of the filters."""
+    return tuple(sorted(
+        (col, tuple(sorted(map(str, values))))
+        for col, values in (filters or {}).items()
+        if values is not None and len(values) != 0
+    ))
+
+
+def _contingency(df, feat1, feat2, filters):
+    """Compute the contingency table with one bincount over the combined codes."""
+    labels1, codes1 = codes(df[feat1])
+    labels2, codes2 = codes(df[feat2])
+
+    valid = (codes1 >= 0) & (codes2 >= 0)
+    mask = filter_mask(df, filters)
+    if mask is not None:
+        valid &= mask
+
+    n2 = len(labels2)
+    flat = codes1[valid].astype(np.int64) * n2 + codes2[valid]
+    table = np.bincount(flat, minlength=len(labels1) * n2).reshape(len(labels1), n2)
+
+    rows, cols = table.sum(axis=1) > 0, table.sum(axis=0) > 0
+    return pd.DataFrame(table[rows][:, cols], index=labels1[rows], columns=labels2[cols])
+
+
+def contingency(df, feat1, feat2, filters=None):
+    """
+    Return the contingency table of two columns, like `pd.crosstab(df[feat1], df[feat2])`.
+
+    Results are cached per (dataframe, filters, feat1, feat2) in a bounded LRU cache.
+    The dataframe is identified by object identity, so it must not be mutated in place.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        feat1 (str): Row feature.
+        feat2 (str): Column feature.
+        filters (dict, optional): Mapping column -> list of selected values, applied before counting.
+
+    Returns:
+        pd.DataFrame: Absolute counts of observed value pairs, rows and columns in label order.
+    """
+    key = (id(df), _filters_key(filters), feat1, feat2)
+    with _contingency_lock:
+        cached = _contingency_cache.get(key)
+        if cached is not None and cached[0]() is df:
+            _contingency_cache.move_to_end(key)
+            return cached[1].copy()
+
+    table = _contingency(df, feat1, feat2, filters)  # Counted outside the lock
+    with _contingency_lock:
+        _contingency_cache[key] = (weakref.ref(df), table)
+        if len(_contingency_cache) > CONTINGENCY_CACHE_SIZE:
+            _contingency_cache.popitem(last=False)
+    return table.copy()
+
+
+def normalize(table, axis):
+    """
+    Normalize a contingency table like `pd.crosstab(..., normalize=...)`.
+
+    Args:
+        table (pd.DataFrame): Absolute counts.
+        axis (str): 'index' - row shares, 'columns' - column shares, 'all' - shares of the total.
+
+    Returns:
+        pd.DataFrame: Normalized table.
+    """
+    if axis == 'index':
+        return table.div(table.sum(axis=1), axis=0)
+    if axis == 'columns':
+        return table.div(table.sum(axis=0), axis=1)
+    if axis == 'all':
+        return table / table.to_numpy().sum()
+    raise ValueError(f"Unknown normalization: {axis}")
+
+
+def age_counts(df, x=v.age_col):
+    """
+    Count persons per year of age with one bincount.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        x (str): Column name for age data. Defaults to v.age_col.
+
+    Returns:
+        pd.Series: Counts indexed by every age from the minimum to the maximum.
+    """
+    ages = df[x].dropna().to_numpy().astype(np.int64)
+    if len(ages) == 0:
+        return pd.Series([], index=pd.Index([], name=x), name='count', dtype=np.int64)
+    start = ages.min()
+    return pd.Series(
+        np.bincount(ages - start),
+        index=pd.Index(np.arange(start, ages.max() + 1), name=x),
+        name='count',
+    )
+
+
+def _histogram_task(df, features, key_value, cont_feat, values, start, stop, chunksize=100_000):
+    """Count the histograms of `_value_histograms` over the rows start:stop (battery task)."""
+    from scipy import sparse
+
+    df = df.iloc[start:stop]
+    cont = df[cont_feat].to_numpy(dtype=float)
+    valid_cont = ~np.isnan(cont)
+    value_codes = np.searchsorted(values, cont[valid_cont])
+
+    key = np.column_stack([(df[feat] == key_value).to_numpy() for feat in features])[valid_cont]
+    valid = np.column_stack([df[feat].notna().to_numpy() for feat in features])[valid_cont]
+
+    n_feats = len(features)
+    hist = np.zeros((len(values), n_feats * n_feats))
+    for start in range(0, len(value_codes), chunksize):
+        stop = start + chunksize
+        pairs = (key[start:stop, :, None] & valid[start:stop, None, :]).reshape(-1, n_feats * n_feats)
+        onehot = sparse.csr_matrix(
+            (np.ones(len(pairs)), (value_codes[start:stop], np.arange(len(pairs)))),
+            shape=(len(values), len(pairs)),
+        )
+        hist += onehot @ pairs.astype(float)
+
+    return hist.reshape(len(values), n_feats, n_feats)
+
+
+def _value_histograms(df, features, key_value, cont_feat, backend='serial', max_workers=None):
+    """
+    Count values of `cont_feat` for every ordered pair of features.
+
+    With a parallel backend, the rows are split into one range per worker and the
+    histograms of the ranges (exact counts) are added up.
+
+    Returns:
+        tuple: (values, hist) where `values` are the sorted unique values of `cont_feat`
+            and hist[k, i, j] is the number of rows with value k, feature i equal to
+            `key_value` and feature j not missing.
+    """
+    import battery
+
+    cont = df[cont_feat].to_numpy(dtype=float)
+    values = np.unique(cont[~np.isnan(cont)])
+
+    n_parts = 1 if backend == 'serial' else (max_workers or os.cpu_count() or 1)
+    bounds = np.linspace(0, len(df), n_parts + 1).astype(int)
+    tasks = [
+        {'features': features, 'key_value': key_value, 'cont_feat': cont_feat, 'values': values,
+         'start': start, 'stop': stop}
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    hists = battery.run_battery(_histogram_task, df, tasks, backend, max_workers)
+    return values, sum(hists[1:], hists[0])
+
+
+def _hist_medians(values, hist):
+    """Return the median of each row of a histogram matrix (n_groups x n_values)."""
+    n = hist.sum(axis=1)
+    cum = hist.cumsum(axis=1)
+    lower = (cum > ((n - 1) // 2)[:, None]).argmax(axis=1)
+    upper = (cum > (n // 2)[:, None]).argmax(axis=1)
+    return (values[lower] + values[upper]) / 2
+
+
+def _hist_quantiles(values, hist, q):
+    """
+    Return the q-quantile of each row of a histogram matrix (n_groups x n_values).
+
+    Quantiles are interpolated between order statistics at position n * q - 0.5, the 'linear'
+    quartile method of plotly.js box plots (numpy's 'hazen' method).
+    """
+    n = hist.sum(axis=1)
+    cum = hist.cumsum(axis=1)
+    pos = np.clip(n * q - 0.5, 0, np.maximum(n - 1, 0))
+    lower, upper = np.floor(pos), np.ceil(pos)
+    value_lower = values[(cum > lower[:, None]).argmax(axis=1)]
+    value_upper = values[(cum > upper[:, None]).argmax(axis=1)]
+    return value_lower + (pos - lower) * (value_upper - value_lower)
+
+
+def box_stats(table):
+    """
+    Compute box plot statistics per group from value counts.
+
+    Quartiles and fences follow plotly.js box plots: linear quartiles, and whiskers at the
+    most extreme values within 1.5 IQR of the box.
+
+    Args:
+        table (pd.DataFrame): Counts with groups as index and sorted numeric values as columns,
+            e.g. `contingency(df, cat_feat, cont_feat)` or `CountCube.crosstab(cat_feat, v.age_col)`.
+
+    Returns:
+        pd.DataFrame: Columns 'q1', 'median', 'q3', 'lowerfence', 'upperfence', 'n' per group
+            with at least one value.
+    """
+    table = table.loc[table.sum(axis=1) > 0]
+    values = table.columns.to_numpy(dtype=float)
+    hist = table.to_numpy()
+
+    q1 = _hist_quantiles(values, hist, 0.25)
+    median = _hist_quantiles(values, hist, 0.5)
+    q3 = _hist_quantiles(values, hist, 0.75)
+
+    # Most extreme observed values inside the fences:
+    observed = hist > 0
+    inside_low = observed & (values >= (2.5 * q1 - 1.5 * q3)[:, None])
+    inside_high = observed & (values <= (2.5 * q3 - 1.5 * q1)[:, None])
+    lowerfence = np.minimum(q1, values[inside_low.argmax(axis=1)])
+    upperfence = np.maximum(q3, values[len(values) - 1 - inside_high[:, ::-1].argmax(axis=1)])
+
+    return pd.DataFrame(
+        {'q1': q1, 'median': median, 'q3': q3, 'lowerfence': lowerfence, 'upperfence': upperfence,
+         'n': hist.sum(axis=1)},
+        index=table.index,
+    )
+
+
+def pairwise_mannwhitney(df, features, key_value, cont_feat, min_size=10, backend='serial', max_workers=None):
+    """
+    Two-sided Mann–Whitney U tests of `cont_feat` between all pairs of features.
+
+    For a pair (i, j), rows where i, j or `cont_feat` are missing are dropped; the
+    groups are rows with i == `key_value` and rows with j == `key_value`. The values of
+    `cont_feat` are ranked once, U statistics and p-values (normal approximation with
+    tie and continuity corrections, as `scipy.stats.mannwhitneyu` uses for samples
+    larger than 8) are computed for the upper triangle at once and mirrored.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        features (list): Feature columns (e.g. cancer type Yes/No columns).
+        key_value: Value that marks group membership (e.g. v.yes_ans).
+        cont_feat (str): Continuous feature to compare.
+        min_size (int): Pairs with a group smaller than this get NaN. Defaults to 10.
+        backend (str): Execution backend of the value counting (see `battery.run_battery`).
+            Results do not depend on it. Defaults to 'serial'.
+        max_workers (int, optional): Number of workers. Defaults to the number of CPUs.
+
+    Returns:
+        PairwiseResult: p_matrix and diff_matrix indexed by features. diff_matrix[i, j] is
+            median(group j) - median(group i); the diagonal is NaN for p-values and 0 for differences.
+    """
+    from scipy.stats import norm
+
+    features = list(features)
+    values, hist = _value_histograms(df, features, key_value, cont_feat, backend, max_workers)
+
+    rows, cols = np.triu_indices(len(features), k=1)
+    hx = hist[:, rows, cols].T  # Group i of each pair (i, j)
+    hy = hist[:, cols, rows].T  # Group j of each pair (i, j)
+    n1, n2 = hx.sum(axis=1), hy.sum(axis=1)
+
+    # U statistic of group i: pairs with x > y plus half of the ties
+    below = hy.cumsum(axis=1) - hy
+    u1 = (hx * (below + 0.5 * hy)).sum(axis=1)
+    u = np.maximum(u1, n1 * n2 - u1)
+
+    n = n1 + n2
+    ties = hx + hy
+    tie_term = (ties ** 3 - ties).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (u - n1 * n2 / 2 - 0.5) / s
+    p = np.clip(2 * norm.sf(z), 0, 1)
+
+    with np.errstate(invalid='ignore'):
+        diff = _hist_medians(values, hy) - _hist_medians(values, hx)
+
+    small = (n1 < min_size) | (n2 < min_size)
+    p[small] = np.nan
+    diff[small] = np.nan
+
+    p_matrix = np.full((len(features), len(features)), np.nan)
+    diff_matrix = np.zeros((len(features), len(features)))
+    p_matrix[rows, cols] = p_matrix[cols, rows] = p
+    diff_matrix[rows, cols] = diff
+    diff_matrix[cols, rows] = -diff
+
+    return PairwiseResult(
+        p_matrix=pd.DataFrame(p_matrix, index=features, columns=features),
+        diff_matrix=pd.DataFrame(diff_matrix, index=features, columns=features),
+        test='mannwhitneyu',
+        dv=cont_feat,
+        params={'key_value': key_value, 'min_size': min_size, 'alternative': 'two-sided'},
+    )
+
+
+def _posthoc_pair_task(df, dv, between, pair, options):
+    """Run the uncorrected Pingouin test of one pair of groups (battery task)."""
+    import pingouin as pg
+
+    df = df[df[between].isin(pair)]
+    return pg.pairwise_tests(data=df, dv=dv, between=between, **{**options, 'padjust': 'none'})
+
+
+def _parallel_pairwise_tests(df, dv, between, backend, max_workers, **kwargs):
+    """
+    Run `pg.pairwise_tests` of a between-groups factor with one battery task per pair of groups.
+
+    Each pair only depends on the rows of its two groups; p-values are corrected once for the
+    whole family, as `pg.pairwise_tests` does, so the table is the same as the serial one.
+    """
+    import battery
+    from pingouin import multicomp
+
+    groups = list(df.groupby(between, sort=True, observed=True)[dv].groups)  # Pingouin's pair order
+    pairs = [(a, b) for i, a in enumerate(groups) for b in groups[i + 1:]]
+    if len(pairs) <= 1:
+        import pingouin as pg
+
+        return pg.pairwise_tests(data=df, dv=dv, between=between, **kwargs)
+
+    tasks = [{'dv': dv, 'between': between, 'pair': pair, 'options': kwargs} for pair in pairs]
+    results = battery.run_battery(_posthoc_pair_task, df, tasks, backend, max_workers)
+    posthoc = pd.concat(results, ignore_index=True).drop(columns=['p-corr', 'p-adjust'], errors='ignore')
+
+    padjust = kwargs.get('padjust', 'none')
+    if padjust.lower() != 'none':
+        _, p_corr = multicomp(posthoc['p-unc'].to_numpy(), alpha=kwargs.get('alpha', 0.05), method=padjust)
+        position = posthoc.columns.get_loc('p-unc') + 1  # Column order of Pingouin
+        posthoc.insert(position, 'p-corr', p_corr)
+        posthoc.insert(position + 1, 'p-adjust', padjust)
+    return posthoc
+
+
+def posthoc_tests(df, dv, between, multiple_comparison=True, backend='serial', max_workers=None, **kwargs):
+    """
+    Run pairwise post-hoc tests with Pingouin.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        dv (str): Dependent variable column.
+        between (str): Between-groups factor column.
+        multiple_comparison (bool): If True, use corrected p-values ('p-corr'),
+            otherwise uncorrected ones ('p-unc').
+        backend (str): Execution backend of the tests of the group pairs (see
+            `battery.run_battery`). Results do not depend on it. Designs with a
+            within-subject factor always run serially. Defaults to 'serial'.
+        max_workers (int, optional): Number of workers. Defaults to the number of CPUs.
+        **kwargs: Additional arguments passed to pg.pairwise_tests.
+
+    Returns:
+        PairwiseResult: Symmetric p-value matrix indexed by group labels and the Pingouin table.
+    """
+    # Pingouin is imported on use only: it is heavy and pulls in matplotlib
+    import pingouin as pg
+
+    p_val_col = {False: 'p-unc', True: 'p-corr'}[multiple_comparison]
+    if backend == 'serial' or not isinstance(between, str) or kwargs.get('within') is not None:
+        posthoc = pg.pairwise_tests(data=df, dv=dv, between=between, **kwargs)
+    else:
+        posthoc = _parallel_pairwise_tests(df, dv, between, backend, max_workers, **kwargs)
+
+    # Create symmetric table
+    posthoc_dbl = pd.concat([posthoc, posthoc.rename(columns={'A': 'B', 'B': 'A'})], ignore_index=True)
+
+    # Pivot table to matrix form
+    p_matrix = posthoc_dbl[['A', 'B', p_val_col]].pivot(index='A', columns='B', values=p_val_col)
+
+    return PairwiseResult(
+        p_matrix=p_matrix,
+        test='pairwise_tests',
+        dv=dv,
+        p_value=p_val_col,
+        table=posthoc,
+        params={'between': between, **kwargs},
+    )
@@ -0,0 +1,149 @@
+# Survey-weighted estimates with Taylor-linearized standard errors
+#
+# MEPS is a stratified cluster sample: each person has a weight (PERWT), a variance stratum (VARSTR)
+# and a PSU (VARPSU) within the stratum. Estimates for all cells of a table are computed together.
+# Weights are summed per (PSU, cell) with one bincount over combined codes. The variance of every cell
+# then follows from the PSU totals z_hj with the with-replacement Taylor linearization formula
+#     var = sum_h n_h / (n_h - 1) * sum_j (z_hj - mean_j(z_hj))^2,
+# where n_h is the number of PSUs of stratum h. Strata with a single PSU contribute no variance.
+#
+# Subpopulations (filters) are estimated as domains: rows outside the domain get zero weight but
+# keep their PSU, so the design is not altered by filtering.
+import numpy as np
+import pandas as pd
+
+import stats
+import variables as v
+
+design_cols = [v.weight_col, v.strata_col, v.psu_col]
+
+
+def has_design(df):
+    """Return True if the frame has survey design columns with a weight for every row."""
+    return all(col in df.columns for col in design_cols) and bool(df[v.weight_col].notna().all())
+
+
+def _design(df):
+    """
+    Return the design of a frame as arrays.
+
+    Strata are (YEAR, VARSTR) pairs when several years are pooled.
+
+    Returns:
+        tuple: (weights, psu code per row, stratum code per PSU, number of strata).
+    """
+    if v.year_col in df.columns:
+        strata_keys = pd.MultiIndex.from_arrays([df[v.year_col].to_numpy(), df[v.strata_col].to_numpy()])
+    else:
+        strata_keys = df[v.strata_col].to_numpy()
+    strata_codes = pd.factorize(strata_keys, sort=True)[0]
+
+    psu_values = pd.factorize(df[v.psu_col].to_numpy(), sort=True)[0]
+    n_psu_values = psu_values.max() + 1
+    psu_codes, psu_keys = pd.factorize(strata_codes.astype(np.int64) * n_psu_values + psu_values, sort=True)
+    psu_strata = (psu_keys // n_psu_values).astype(np.int64)
+
+    weights = df[v.weight_col].to_numpy(dtype=np.float64)
+    return weights, psu_codes, psu_strata, strata_codes.max() + 1
+
+
+def _cell_codes(df, cols):
+    """Return (labels, codes) of the combined cells of `cols`; rows with a missing value get -1."""
+    labels, codes = [], None
+    for col in cols:
+        col_labels, col_codes = stats.codes(df[col])
+        labels.append(col_labels)
+        col_codes = col_codes.astype(np.int64)
+        codes = col_codes if codes is None else np.where((codes < 0) | (col_codes < 0), -1, codes * len(col_labels) + col_codes)
+    if len(labels) == 1:
+        return labels[0], codes
+    return pd.MultiIndex.from_product(labels), codes
+
+
+def _psu_totals(codes, n_cells, weights, psu, n_psu):
+    """Return the weighted totals per (PSU, cell) as an (n_psu, n_cells) matrix."""
+    valid = codes >= 0
+    flat = psu[valid] * n_cells + codes[valid]
+    return np.bincount(flat, weights=weights[valid], minlength=n_psu * n_cells).reshape(n_psu, n_cells)
+
+
+def _variance(z, psu_strata, n_strata):
+    """Return the Taylor-linearized variance of each column of the PSU totals `z`."""
+    n_h = np.bincount(psu_strata, minlength=n_strata)
+    sums = np.zeros((n_strata, z.shape[1]))
+    np.add.at(sums, psu_strata, z)
+    dev = z - (sums / np.maximum(n_h, 1)[:, None])[psu_strata]
+    factor = np.where(n_h > 1, n_h / np.maximum(n_h - 1, 1), 0.0)
+    return (factor[psu_strata][:, None] * dev ** 2).sum(axis=0)
+
+
+def _domain_weights(df, weights, filters, index):
+    """Return the weights with zeros outside the filtered domain."""
+    mask = stats.filter_mask(df, filters, index)
+    return weights if mask is None else np.where(mask, weights, 0.0)
+
+
+def totals(df, cols, filters=None, index=None):
+    """
+    Estimate population totals of all cells of one or more categorical columns.
+
+    Args:
+        df (pd.DataFrame): Preprocessed dataframe with the survey design columns.
+        cols (str or list): Column(s) defining the cells.
+        filters (dict, optional): Mapping column -> list of selected values (the estimation domain).
+        index (bitmap.BitmapIndex, optional): Bitmap index of `df` used to evaluate the filters.
+
+    Returns:
+        pd.DataFrame: Columns 'total' (weighted total), 'se' (standard error) and 'n'
+            (number of respondents) indexed by the cell labels.
+    """
+    cols = [cols] if isinstance(cols, str) else list(cols)
+    weights, psu, psu_strata, n_strata = _design(df)
+    domain = _domain_weights(df, weights, filters, index)
+    labels, codes = _cell_codes(df, cols)
+
+    z = _psu_totals(codes, len(labels), domain, psu, len(psu_strata))
+    n = np.bincount(codes[(codes >= 0) & (domain > 0)], minlength=len(labels))
+
+    return pd.DataFrame(
+        {'total': z.sum(axis=0), 'se': np.sqrt(_variance(z, psu_strata, n_strata)), 'n': n},
+        index=labels,
+    )
+
+
+def proportions(df, feat, by=None, filters=None, index=None):
+    """
+    Estimate the population shares of the labels of `feat`, overall or within groups of `by`.
+
+    Shares are ratio estimators p = Y / X (Y - total of a cell, X - total of its group). Their
+    standard errors use the linearized PSU totals (Y_hj - p * X_hj) / X.
+
+    Args:
+        df (pd.DataFrame): Preprocessed dataframe with the survey design columns.
+        feat (str): Categorical column whose shares are estimated.
+        by (str, optional): Grouping column; shares sum to 1 within each group
+            (like `stats.normalize(table, 'index')` with `by` as rows).
+        filters (dict, optional): Mapping column -> list of selected values (the estimation domain).
+        index (bitmap.BitmapIndex, optional): Bitmap index of `df` used to evaluate the filters.
+
+    Returns:
+        pd.DataFrame: Columns 'proportion' and 'se' indexed by the `feat` labels, or by
+            (`by`, `feat`) labels. Use `.unstack()` for a table.
+    """
+    weights, psu, psu_strata, n_strata = _design(df)
+    domain = _domain_weights(df, weights, filters, index)
+    cols = [feat] if by is None else [by, feat]
+    labels, codes = _cell_codes(df, cols)
+
+    n_feat = len(stats.codes(df[feat])[0])
+    z = _psu_totals(codes, len(labels), domain, psu, len(psu_strata))
+    z_cells = z.reshape(len(psu_strata), -1, n_feat)  # (PSU, group, feat label)
+    z_groups = z_cells.sum(axis=2, keepdims=True)
+
+    cell_totals, group_totals = z_cells.sum(axis=0), z_groups.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = cell_totals / group_totals
+        linearized = (z_cells - p * z_groups) / group_totals
+    se = np.sqrt(_variance(linearized.reshape(len(psu_strata), -1), psu_strata, n_strata))
+
+    return pd.DataFrame({'proportion': p.ravel(), 'se': se}, index=labels)
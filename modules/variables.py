@@ -4,6 +4,7 @@ cancer_types = ['CABLADDR', 'CABREAST', 'CACERVIX', 'CACOLON', 'CALUNG', 'CALYMP
 cancer_bool_types = [f'{col}_bool' for col in cancer_types]
 non_sex_dependent_cancer_types = ['CABLADDR', 'CACOLON', 'CALUNG', 'CALYMPH', 'CAMELANO', 'CAOTHER', 'CASKINNM', 'CASKINDK']
 cancer_feat_type = 'CANCERDX_type'
+cancer_mask_col = 'CANCERDX_mask'
 
 cancer_type_names = ['Bladder', 'Breast', 'Cervical', 'Colon', 'Lung', 'Lymphoma', 'Skin\nMelanoma', 'Other', 'Prostate', 'Skin\nNon-melanoma', 'Skin\nUnknown type', 'Uterine']
 non_sex_dependent_cancer_type_names = ['Bladder', 'Colon', 'Lung', 'Lymphoma', 'Skin\nMelanoma', 'Other', 'Skin\nNon-melanoma', 'Skin\nUnknown type']
@@ -13,11 +14,39 @@ no_ans = '2. No'
 yes_ans = '1. Yes'
 mult_ans = '0. Multiple'
 dk_refused_ans = '1. DK / Refused'
+yes_no_order = [yes_ans, no_ans]
 vals_to_drop = ['-1 INAPPLICABLE', '-15 CANNOT BE COMPUTED', '-8 DK', '-7 REFUSED']
 
 no_raw_ans = '2 NO'
 yes_raw_ans = '1 YES'
 
+# MEPS Full Year Consolidated data files:
+meps_files = {
+    2016: 'h192.dta',
+    2017: 'h201.dta',
+    2018: 'h209.dta',
+    2019: 'h216.dta',
+    2020: 'h224.dta',
+    2021: 'h233.dta',
+    2022: 'h243.dta',
+}
+default_year = 2019
+year_col = 'YEAR'
+
+# Column names that differ from the 2019 (HC-216) names used in this project:
+# {year: {column: column name in that year's file}}
+# No renames of the cancer, age, sex and race columns are known in the files above (the person
+# weight is named per year, see `weight_columns`); a file lacking a required column raises a
+# ValueError naming the year and the columns (see `preprocessing.read_raw`), to be added here.
+year_columns = {year: {} for year in meps_files}
+
+# Survey design columns: person weight, variance strata and PSUs (optional, used for population estimates).
+# The person weight is named after the year in MEPS files (PERWT19F in 2019) and renamed to `weight_col`.
+weight_col = 'PERWT'
+strata_col = 'VARSTR'
+psu_col = 'VARPSU'
+weight_columns = {year: f'PERWT{year % 100}F' for year in meps_files}
+
 age_col = 'AGELAST'
 age_col_cat = age_col + "_CAT"
 sex_col = 'SEX'
@@ -32,6 +61,7 @@ age_bins = [17, 39, 64, 86]
 age_groups = ["1. Young adults (18-39)", "2. Middle-aged (40-64)", "3. Older adults (65-85)"]
 
 dash_plot_height = 400
+ci_level = 0.95  # Confidence level of the intervals shown in the dashboard
 
 cancer_colors = {no_ans: "lightgreen", yes_ans: "lightcoral"}
 cancer_type_colors = {
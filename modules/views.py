@@ -0,0 +1,171 @@
+# Figures of the dashboard views, built from a count cube
+#
+# Each function returns the Plotly figure(s) of one dashboard block for one filter state. The
+# dashboard (app/utils.py) caches them per selection; the batch report (report.py) builds all of them
+# in one run. Nothing here depends on Streamlit.
+import bootstrap
+import plots
+import variables as v
+
+dem_feats = [v.age_col, v.sex_col, v.race_col]
+dem_titles = dict(zip(dem_feats, [v.dash_age_feat, v.dash_sex_feat, v.dash_race_feat]))
+
+
+def cancer_style(cancer_feat):
+    """Return (category orders, color map) of a cancer feature (v.cancer_feat or v.cancer_feat_type)."""
+    if cancer_feat == v.cancer_feat:
+        return v.yes_no_order, v.cancer_colors
+    return v.cancer_type_order, v.cancer_type_colors
+
+
+def pie_fig(counts, feat, title=None, height=v.dash_plot_height, **kwargs):
+    """
+    Create a pie chart of the counts per category.
+
+    Args:
+        counts (pd.Series): Counts per category (e.g. `CountCube.marginal(feat, filters)`).
+        feat (str): Categorical feature.
+        title (str, optional): Plot title. Uses `feat` if None.
+        height (int): Plot height in pixels. Defaults to v.dash_plot_height.
+        **kwargs: Additional arguments passed to plots.pie().
+
+    Returns:
+        plotly.graph_objects.Figure: Pie chart figure.
+    """
+    if title is None:
+        title = feat
+    fig = plots.pie(counts, feat, show_fig=False, return_fig=True, title=title, **kwargs)
+    fig.update_layout(height=height, showlegend=False)
+    return fig
+
+
+def age_fig(counts, title='Age', height=v.dash_plot_height):
+    """Create the age histogram from the person counts per age."""
+    fig = plots.hist_age_fig(counts, title=title)
+    fig.update_layout(height=height)
+    return fig
+
+
+def block1_figure(cube, dem_feat, filters=None):
+    """
+    Create the demographic distribution of block 1.
+
+    Args:
+        cube (cube.CountCube): Person counts (or population estimates).
+        dem_feat (str): v.age_col, v.sex_col or v.race_col.
+        filters (dict, optional): Mapping feature -> list of selected labels (e.g. years).
+
+    Returns:
+        plotly.graph_objects.Figure: Age histogram or pie chart.
+    """
+    if dem_feat == v.age_col:
+        return age_fig(cube.marginal(v.age_col, filters))
+    return pie_fig(cube.marginal(dem_feat, filters), dem_feat, title=dem_titles[dem_feat])
+
+
+def crosstab_ci(table, level=v.ci_level):
+    """
+    Bootstrap intervals of the row and column shares of a table of person counts.
+
+    Returns:
+        dict: Mapping 'index'/'columns' -> (lower, upper) DataFrames (see `plots.crosstab_counts_plot`).
+    """
+    return {normalize: bootstrap.table_intervals(table, normalize, level)[1:] for normalize in ('index', 'columns')}
+
+
+def block2_filters(year_filter, exclude_no=False):
+    """
+    Return the filters of block 2.
+
+    Args:
+        year_filter (dict): Mapping v.year_col -> selected years (empty - all years).
+        exclude_no (bool): If True, persons without cancer are excluded. Defaults to False.
+
+    Returns:
+        dict: Mapping feature -> list of selected labels.
+    """
+    filters = dict(year_filter)
+    if exclude_no:
+        filters[v.cancer_feat_type] = [t for t in v.cancer_type_order if t != v.no_ans]
+    return filters
+
+
+def block2_figure(cube, cancer_feat, dem_feat, filters=None, ci=None):
+    """
+    Create the cancer dependency figure of block 2.
+
+    Args:
+        cube (cube.CountCube): Person counts (or population estimates).
+        cancer_feat (str): v.cancer_feat or v.cancer_feat_type.
+        dem_feat (str): v.age_col (box plot), v.sex_col or v.race_col (crosstab heatmaps).
+        filters (dict, optional): Mapping feature -> list of selected labels.
+        ci (dict, optional): Share intervals of the heatmaps (see `crosstab_ci`). Defaults to
+            bootstrap intervals of `cube` counts.
+
+    Returns:
+        plotly.graph_objects.Figure: Box plot or figure with two heatmap subplots.
+    """
+    table = cube.crosstab(cancer_feat, dem_feat, filters)
+    if dem_feat == v.age_col:
+        return plots.boxplot_counts(table, *cancer_style(cancer_feat))
+    if ci is None:
+        ci = crosstab_ci(table)
+    return plots.crosstab_counts_plot(table, ci=ci)
+
+
+def cancer_pie_fig(cube, filters=None, ci=None):
+    """
+    Create the cancer type pie of block 3, with diagnosis counts and shares in the title.
+
+    Args:
+        cube (cube.CountCube): Person counts (or population estimates).
+        filters (dict, optional): Mapping feature -> list of selected labels.
+        ci (tuple, optional): (lower, upper) Series of the diagnosis shares indexed by
+            v.yes_no_order. Defaults to bootstrap intervals of `cube` counts.
+
+    Returns:
+        plotly.graph_objects.Figure: Pie chart of cancer types (without No answers).
+    """
+    yes_no_counts = cube.marginal(v.cancer_feat, filters)
+    if ci is None:
+        ci = bootstrap.table_intervals(yes_no_counts, 'all', v.ci_level)[1:]
+    lower, upper = ci
+    yes_no_prop = yes_no_counts / yes_no_counts.sum()
+    yes_no_prop = (yes_no_prop * 100).round(1)
+    lower, upper = (lower * 100).round(1), (upper * 100).round(1)
+    title = 'Cancer types<br>'
+    title += f'No: {yes_no_counts.loc[v.no_ans]:.0f} ({yes_no_prop.loc[v.no_ans]} %'
+    title += f' [{lower.loc[v.no_ans]}-{upper.loc[v.no_ans]}]) /<br>'
+    title += f'Yes: {yes_no_counts.loc[v.yes_ans]:.0f} ({yes_no_prop.loc[v.yes_ans]} %'
+    title += f' [{lower.loc[v.yes_ans]}-{upper.loc[v.yes_ans]}])'
+
+    type_counts = cube.marginal(v.cancer_feat_type, filters)
+    fig = plots.pie(type_counts[type_counts.index != v.no_ans], v.cancer_feat_type, title,
+                    v.cancer_type_colors, v.cancer_type_order, show_fig=False, return_fig=True)
+    fig.update_layout(height=v.dash_plot_height, showlegend=False)
+    return fig
+
+
+def block3_figures(cube, filters, other_dem_feats, ci=None):
+    """
+    Create the filtered demographic distributions of block 3.
+
+    Args:
+        cube (cube.CountCube): Person counts (or population estimates).
+        filters (dict): Mapping feature -> list of selected labels.
+        other_dem_feats (list): Demographic features to plot (v.age_col is plotted as a histogram).
+        ci (tuple, optional): Intervals of the diagnosis shares (see `cancer_pie_fig`).
+
+    Returns:
+        list: Figures, the cancer type pie first if no cancer type is selected.
+    """
+    figs = []
+    if len(filters.get(v.cancer_feat_type) or []) == 0:
+        figs.append(cancer_pie_fig(cube, filters, ci))
+
+    for feat in other_dem_feats:
+        if feat == v.age_col:
+            figs.append(age_fig(cube.marginal(v.age_col, filters), title=v.dash_age_feat))
+        else:
+            figs.append(pie_fig(cube.marginal(feat, filters), feat))
+    return figs
@@ -0,0 +1,71 @@
+# Batched chi-square tests and p-value corrections against scipy and statsmodels
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import chi2_contingency
+from scipy.stats.contingency import association
+
+import association as a
+import variables as v
+
+FEATURES = ['A', 'B', 'C']
+BY = [v.sex_col, v.race_col]
+
+
+@pytest.fixture(scope='module')
+def frame():
+    rng = np.random.default_rng(0)
+    n = 2_000
+    sex = rng.choice(['1 MALE', '2 FEMALE'], n)
+    race = rng.choice(['1 WHITE', '2 BLACK', '3 ASIAN', '4 OTHER'], n, p=[0.6, 0.25, 0.1, 0.05])
+    data = {v.sex_col: pd.Categorical(sex), v.race_col: pd.Categorical(race)}
+    for feat, p_yes in zip(FEATURES, [0.05, 0.2, 0.01]):
+        p = p_yes * np.where(sex == '2 FEMALE', 1.5, 1.0)  # Some associations are real
+        answers = np.where(rng.random(n) < p, v.yes_ans, v.no_ans).astype(object)
+        answers[rng.random(n) < 0.02] = None
+        data[feat] = pd.Categorical(answers, categories=[v.yes_ans, v.no_ans])
+    return pd.DataFrame(data)
+
+
+def test_chi2_tests_equal_scipy():
+    rng = np.random.default_rng(1)
+    tables = rng.integers(0, 30, (20, 3, 4))
+    tables[0, 1] = 0  # Empty row, dropped like an unobserved label
+    tables[1, :, 2:] = 0  # Two empty columns
+    two_by_two = rng.integers(1, 30, (20, 2, 2))  # Yates' correction
+
+    for stack in (tables, two_by_two):
+        result = a.chi2_tests(stack)
+        for i, table in enumerate(stack):
+            table = table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+            statistic, p, dof, _ = chi2_contingency(table)
+            assert result['chi2'][i] == pytest.approx(statistic, rel=1e-10)
+            assert result['p'][i] == pytest.approx(p, rel=1e-10)
+            assert result['dof'][i] == dof
+            assert result['cramers_v'][i] == pytest.approx(association(table, method='cramer'), rel=1e-10)
+
+
+def test_association_tests_equal_scipy_per_table(frame):
+    tests, posthoc = a.association_tests(frame, FEATURES, BY, correction='none')
+
+    for row in tests.itertuples():
+        statistic, p, dof, _ = chi2_contingency(pd.crosstab(frame[row.feature], frame[row.by]))
+        assert (row.chi2, row.p, row.dof) == (pytest.approx(statistic), pytest.approx(p), dof)
+    for row in posthoc.itertuples():
+        in_level = (frame[row.by] == row.level).to_numpy()
+        table = pd.crosstab(frame[row.feature], in_level)
+        assert row.p == pytest.approx(chi2_contingency(table)[1])
+
+
+@pytest.mark.parametrize('method, reference', [('holm', 'holm'), ('bh', 'fdr_bh'), ('sidak', 'sidak'),
+                                               ('bonferroni', 'bonferroni')])
+def test_adjust_pvalues_equal_statsmodels(method, reference):
+    multipletests = pytest.importorskip('statsmodels.stats.multitest').multipletests
+    rng = np.random.default_rng(2)
+    p = np.concatenate([rng.uniform(0, 0.05, 10), rng.uniform(0, 1, 30), [0.01, 0.01, np.nan]])
+
+    result = a.adjust_pvalues(p, method)
+
+    valid = ~np.isnan(p)
+    np.testing.assert_allclose(result[valid], multipletests(p[valid], method=reference)[1], rtol=1e-12)
+    assert np.isnan(result[~valid]).all()
@@ -0,0 +1,61 @@
+# Packed bitmap filters against column scans
+import numpy as np
+import pandas as pd
+import pytest
+
+import bitmap
+import stats
+
+N_ROWS = 1_003  # Not a multiple of 8: the last packed byte is partial
+
+FILTERS = [
+    {},
+    {'color': []},
+    {'color': ['red']},
+    {'color': ['red', 'blue'], 'size': ['S']},
+    {'size': ['M', 'unknown']},  # Labels absent from the frame match no row
+    {'color': ['green'], 'size': ['L'], 'shape': ['round', 'square']},
+    {'color': ['unknown']},
+]
+
+
+@pytest.fixture(scope='module')
+def frame():
+    rng = np.random.default_rng(0)
+    color = rng.choice(['red', 'green', 'blue'], N_ROWS).astype(object)
+    color[rng.random(N_ROWS) < 0.1] = None
+    size = pd.Categorical(rng.choice(['S', 'M', 'L'], N_ROWS), categories=['S', 'M', 'L', 'XL'], ordered=True)
+    return pd.DataFrame({
+        'color': pd.Categorical(color),
+        'size': size,
+        'shape': rng.choice(['round', 'square'], N_ROWS),  # Object column
+    })
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_bitmap_mask_equals_filter_mask(frame, filters):
+    index = bitmap.BitmapIndex.build(frame, cols=['color', 'size', 'shape'])
+    expected = np.ones(N_ROWS, dtype=bool)
+    for col, values in filters.items():
+        if len(values) > 0:
+            expected &= frame[col].isin(values).to_numpy()
+
+    scanned = stats.filter_mask(frame, filters)
+    indexed = index.mask(filters)
+    if scanned is None:
+        assert indexed is None and expected.all()
+    else:
+        np.testing.assert_array_equal(indexed, scanned)
+        np.testing.assert_array_equal(indexed, expected)
+        np.testing.assert_array_equal(stats.filter_mask(frame, filters, index), expected)
+    assert index.count(filters) == expected.sum()
+
+
+def test_uncovered_filters_fall_back_to_scans(frame):
+    index = bitmap.BitmapIndex.build(frame, cols=['color'])
+    filters = {'color': ['red'], 'size': ['S']}
+    assert not index.covers(filters)
+    with pytest.raises(KeyError):
+        index.mask(filters)
+    expected = (frame['color'] == 'red').to_numpy() & (frame['size'] == 'S').to_numpy()
+    np.testing.assert_array_equal(stats.filter_mask(frame, filters, index), expected)
@@ -0,0 +1,81 @@
+# Bootstrap and replicate-weight intervals: coverage, seeds and agreement of the two paths
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import bootstrap
+import variables as v
+
+SEXES = ['1 MALE', '2 FEMALE']
+ANSWERS = [v.yes_ans, v.no_ans]
+
+
+@pytest.fixture(scope='module')
+def frame():
+    rng = np.random.default_rng(0)
+    n = 3_000
+    return pd.DataFrame({
+        v.sex_col: pd.Categorical(rng.choice(SEXES, n), categories=SEXES),
+        v.cancer_feat: pd.Categorical(rng.choice(ANSWERS, n, p=[0.1, 0.9]), categories=ANSWERS),
+        v.weight_col: rng.gamma(2.0, 5_000.0, n),
+    })
+
+
+def test_intervals_cover_the_true_share():
+    rng = np.random.default_rng(1)
+    p, n, trials = 0.3, 400, 300
+    covered = 0
+    for seed in range(trials):
+        yes = rng.binomial(n, p)
+        table = pd.Series([yes, n - yes], index=ANSWERS)
+        _, lower, upper = bootstrap.table_intervals(table, 'all', level=0.95, seed=seed)
+        covered += lower[v.yes_ans] <= p <= upper[v.yes_ans]
+    assert 0.9 <= covered / trials <= 0.99
+
+
+def test_same_seed_gives_same_intervals(frame):
+    table = pd.crosstab(frame[v.sex_col], frame[v.cancer_feat])
+    first = bootstrap.table_intervals(table, 'index', seed=7)
+    for again, other in zip(first, bootstrap.table_intervals(table, 'index', seed=7)):
+        pd.testing.assert_frame_equal(again, other)
+    assert not first[1].equals(bootstrap.table_intervals(table, 'index', seed=8)[1])
+
+    rows = [bootstrap.crosstab_intervals(frame, v.sex_col, v.cancer_feat, seed=7) for _ in range(2)]
+    for again, other in zip(*rows):
+        pd.testing.assert_frame_equal(again, other)
+
+
+def test_row_resampling_matches_count_resampling(frame):
+    # Multinomial draws of the row path use the same stream as the count path
+    table = pd.crosstab(frame[v.sex_col], frame[v.cancer_feat])
+    expected = bootstrap.table_intervals(table, 'columns', seed=3)
+    result = bootstrap.crosstab_intervals(frame, v.sex_col, v.cancer_feat, normalize='columns', seed=3,
+                                          method='multinomial')
+    for values, expected_values in zip(result, expected):
+        pd.testing.assert_frame_equal(values, expected_values, check_names=False)
+
+    # Row resampling draws other replicates of the same distribution
+    _, lower, upper = bootstrap.crosstab_intervals(frame, v.sex_col, v.cancer_feat, normalize='columns', seed=3)
+    np.testing.assert_allclose(lower, expected[1], atol=0.02)
+    np.testing.assert_allclose(upper, expected[2], atol=0.02)
+
+
+def test_replicate_weights_give_replicate_standard_errors(frame):
+    rng = np.random.default_rng(2)
+    weights = frame[v.weight_col].to_numpy()
+    rep_weights = weights[:, None] * rng.uniform(0.5, 1.5, (len(frame), 8))
+    share, lower, upper = bootstrap.crosstab_intervals(frame, v.sex_col, v.cancer_feat, normalize='index',
+                                                       rep_weights=rep_weights)
+
+    def shares(w):
+        table = pd.crosstab(frame[v.sex_col], frame[v.cancer_feat], values=w, aggfunc='sum')
+        return table.div(table.sum(axis=1), axis=0)
+
+    expected = shares(weights)
+    se = np.sqrt(sum((shares(rep_weights[:, r]) - expected) ** 2 for r in range(8)) / 8)
+    z = NormalDist().inv_cdf(0.975)
+    pd.testing.assert_frame_equal(share, expected, check_names=False)
+    pd.testing.assert_frame_equal(lower, (expected - z * se).clip(0, 1), check_names=False)
+    pd.testing.assert_frame_equal(upper, (expected + z * se).clip(0, 1), check_names=False)
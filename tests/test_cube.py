@@ -0,0 +1,72 @@
+# Count cube queries against pandas on the bundled MEPS file
+import numpy as np
+import pandas as pd
+import pytest
+
+import cube
+import panel
+import variables as v
+
+FILTERS = [
+    {},
+    {v.cancer_feat_type: ['1. Breast', v.no_ans]},
+    {v.age_col_cat: [v.age_groups[0]], v.sex_col: ['2 FEMALE']},  # Derived dimension filter
+    {v.race_col: ['2 BLACK'], v.cancer_feat: [v.yes_ans]},
+    {v.year_col: [v.default_year], v.sex_col: []},  # Empty list - no filter on SEX
+]
+MARGINAL_DIMS = [v.cancer_feat, v.cancer_feat_type, v.sex_col, v.race_col, v.age_col_cat, v.age_col]
+CROSSTABS = [(v.cancer_feat, v.sex_col), (v.cancer_feat_type, v.race_col), (v.cancer_feat, v.age_col_cat),
+             (v.age_col_cat, v.cancer_feat_type)]
+
+
+@pytest.fixture(scope='module')
+def frame(tmp_path_factory):
+    if v.default_year not in panel.available_years():
+        pytest.skip('Bundled MEPS file not found')
+    return panel.load_panel([v.default_year], cache_dir=str(tmp_path_factory.mktemp('cache')))
+
+
+@pytest.fixture(scope='module')
+def counts(frame):
+    return cube.CountCube.build(frame)
+
+
+def _subset(df, filters):
+    mask = np.ones(len(df), dtype=bool)
+    for dim, values in filters.items():
+        if len(values) > 0:
+            mask &= df[dim].isin(values).to_numpy()
+    return df[mask]
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_total_equals_len(frame, counts, filters):
+    assert counts.total(filters) == len(_subset(frame, filters))
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('dim', MARGINAL_DIMS)
+def test_marginal_equals_value_counts(frame, counts, dim, filters):
+    result = counts.marginal(dim, filters, observed=True)
+    expected = _subset(frame, filters)[dim].value_counts(sort=False)
+    expected = expected[expected > 0]
+    pd.testing.assert_series_equal(result, expected.reindex(result.index), check_names=False,
+                                   check_dtype=False, check_index_type=False)
+    assert result.sum() == expected.sum()
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('dims', CROSSTABS)
+def test_crosstab_equals_pandas(frame, counts, dims, filters):
+    sub = _subset(frame, filters)
+    expected = pd.crosstab(sub[dims[0]], sub[dims[1]])
+    pd.testing.assert_frame_equal(counts.crosstab(*dims, filters), expected, check_names=False,
+                                  check_dtype=False, check_index_type=False, check_column_type=False)
+
+
+def test_unknown_derived_label_selects_nothing():
+    # Ages outside v.age_bins have no age group (derived code -1)
+    ages = pd.DataFrame({v.age_col: np.arange(v.age_bins[0] - 5, v.age_bins[-1] + 5)})
+    counts = cube.CountCube.build(ages)
+    assert counts.total({v.age_col_cat: ['unknown']}) == 0
+    assert counts.total({v.age_col_cat: [v.age_groups[0]]}) == v.age_bins[1] - v.age_bins[0] + 1
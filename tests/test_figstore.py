@@ -0,0 +1,39 @@
+# Pre-rendered figures against live renders on the bundled MEPS file
+import json
+
+import plotly.io as pio
+import pytest
+
+import cube
+import figstore
+import panel
+import variables as v
+
+
+@pytest.fixture(scope='module')
+def counts(tmp_path_factory):
+    if v.default_year not in panel.available_years():
+        pytest.skip('Bundled MEPS file not found')
+    return cube.CountCube.build(panel.load_panel([v.default_year], cache_dir=str(tmp_path_factory.mktemp('cache'))))
+
+
+def test_stored_figures_equal_live_renders(counts, tmp_path):
+    store_dir = str(tmp_path)
+    figstore.warm(counts, store_dir)
+    key = figstore.data_key(counts)
+
+    for state in figstore.states(counts):
+        stored = figstore.load(key, state, store_dir)
+        assert stored is not None, state
+        assert json.loads(stored.to_json()) == json.loads(figstore.render(counts, state).to_json()), state
+    assert figstore.load(key, figstore.block1_state(v.sex_col, [1990]), store_dir) is None
+
+
+def test_key_changes_with_counts_and_template(counts, monkeypatch):
+    key = figstore.data_key(counts)
+    changed = counts.counts.copy()
+    changed.flat[0] += 1
+    assert figstore.data_key(cube.CountCube(changed, counts.labels)) != key
+
+    monkeypatch.setattr(pio.templates, 'default', 'plotly_white')
+    assert figstore.data_key(counts) != key
@@ -0,0 +1,48 @@
+# Monte Carlo permutation tests: backend independence and agreement with exact tests
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import fisher_exact
+
+import battery
+import permutation
+
+GROUPS = ['a', 'b', 'c']
+LEVELS = ['x', 'y', 'z', 'w']
+
+
+@pytest.fixture(scope='module')
+def frame():
+    """Weakly associated columns, so p-values are neither tiny nor close to 1."""
+    rng = np.random.default_rng(0)
+    n = 300
+    group = rng.choice(GROUPS, n)
+    level = np.where(rng.random(n) < 0.1, 'x', rng.choice(LEVELS, n))
+    level = np.where((group == 'a') & (rng.random(n) < 0.05), 'x', level)
+    return pd.DataFrame({'group': pd.Categorical(group), 'level': pd.Categorical(level)})
+
+
+@pytest.mark.parametrize('method', permutation.methods)
+@pytest.mark.parametrize('statistic', permutation.statistics)
+def test_same_seed_gives_same_p_on_every_backend(frame, statistic, method):
+    results = [
+        permutation.permutation_test(frame, 'group', 'level', n_permutations=4_000, seed=11, statistic=statistic,
+                                     method=method, backend=backend, max_workers=3, batch_size=500)
+        for backend in battery.backends
+    ]
+    assert 0.01 < results[0]['p'] < 0.99
+    assert all(result == results[0] for result in results[1:])
+
+    other_seed = permutation.permutation_test(frame, 'group', 'level', n_permutations=4_000, seed=12,
+                                              statistic=statistic, method=method, batch_size=500)
+    assert other_seed['p'] != results[0]['p']
+
+
+@pytest.mark.parametrize('method', permutation.methods)
+def test_two_by_two_p_approaches_fisher_exact(frame, method):
+    sub = frame[frame['group'].isin(['a', 'b']) & frame['level'].isin(['x', 'y'])]
+    sub = sub.apply(lambda col: col.cat.remove_unused_categories())
+    result = permutation.permutation_test(sub, 'group', 'level', n_permutations=20_000, seed=0, method=method)
+
+    exact = fisher_exact(pd.crosstab(sub['group'], sub['level']).to_numpy())[1]
+    assert abs(result['p'] - exact) < 4 * result['se'] + 1e-3
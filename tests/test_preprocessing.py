@@ -0,0 +1,103 @@
+# Chunked loading of a synthetic MEPS file (generated locally, no download needed)
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+import preprocessing
+import variables as v
+
+N_ROWS = 5_000
+CHUNKSIZE = 700  # Several chunks, the last one partial
+
+cancer_answers = ['-15 CANNOT BE COMPUTED', '-8 DK', '-7 REFUSED', '-1 INAPPLICABLE', v.yes_raw_ans, v.no_raw_ans]
+type_answers = ['-8 DK', '-7 REFUSED', '-1 INAPPLICABLE', v.yes_raw_ans, v.no_raw_ans]
+sex_answers = ['1 MALE', '2 FEMALE']
+race_answers = [
+    '1 WHITE - NO OTHER RACE REPORTED',
+    '2 BLACK - NO OTHER RACE REPORTED',
+    '3 AMER INDIAN/ALASKA NATIVE-NO OTHER RACE',
+    '4 ASIAN/NATV HAWAIIAN/PACFC ISL-NO OTH',
+    '6 MULTIPLE RACES REPORTED',
+]
+
+
+def _categorical(rng, categories, p=None):
+    return pd.Categorical(rng.choice(categories, size=N_ROWS, p=p), categories=categories, ordered=True)
+
+
+@pytest.fixture(scope='module')
+def dta_path(tmp_path_factory):
+    """Write a synthetic MEPS-like .dta file with the required columns and unused ones."""
+    rng = np.random.default_rng(0)
+    data = {
+        'DUPERSID': [f'{i:08d}' for i in range(N_ROWS)],  # Unused columns
+        'REGION': rng.integers(1, 5, N_ROWS).astype(np.int8),
+        'TOTEXP': rng.gamma(2.0, 1000.0, N_ROWS),
+        v.cancer_feat: _categorical(rng, cancer_answers, [0.01, 0.01, 0.01, 0.2, 0.2, 0.57]),
+        v.age_col: rng.integers(18, 86, N_ROWS).astype(np.int8),
+        v.sex_col: _categorical(rng, sex_answers),
+        v.race_col: _categorical(rng, race_answers),
+    }
+    for col in v.cancer_types:
+        data[col] = _categorical(rng, type_answers, [0.01, 0.01, 0.3, 0.08, 0.6])
+    path = tmp_path_factory.mktemp('meps') / 'synthetic.dta'
+    pd.DataFrame(data).to_stata(path, write_index=False)
+    return str(path)
+
+
+def test_chunked_load_equals_full_preprocess(dta_path):
+    expected = preprocessing.preprocess(preprocessing.read_raw(dta_path))
+    result = preprocessing.load(dta_path, chunksize=CHUNKSIZE)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_only_required_columns_are_read(dta_path, monkeypatch):
+    requested = []
+    read_stata = pd.read_stata
+
+    def spy(*args, **kwargs):
+        requested.append(kwargs.get('columns'))
+        return read_stata(*args, **kwargs)
+
+    monkeypatch.setattr(preprocessing.pd, 'read_stata', spy)
+    chunks = list(preprocessing.read_chunks(dta_path, chunksize=CHUNKSIZE))
+
+    assert len(chunks) == -(-N_ROWS // CHUNKSIZE)
+    assert [columns for columns in requested if columns is not None] == [preprocessing.raw_columns()]
+    for chunk in chunks:
+        assert list(chunk.columns) == preprocessing.raw_columns()
+
+
+def test_missing_year_column_names_year_and_column(dta_path, tmp_path):
+    path = tmp_path / 'renamed.dta'
+    preprocessing.read_raw(dta_path).rename(columns={v.race_col: 'RACEV2X'}).to_stata(path, write_index=False)
+
+    with pytest.raises(ValueError, match=rf"2020.*\['{v.race_col}'\]"):
+        preprocessing.load(str(path), year=2020)
+
+
+def test_year_columns_translate_renamed_columns(dta_path, tmp_path, monkeypatch):
+    path = tmp_path / 'renamed.dta'
+    preprocessing.read_raw(dta_path).rename(columns={v.race_col: 'RACEV2X'}).to_stata(path, write_index=False)
+    monkeypatch.setitem(v.year_columns, 2020, {v.race_col: 'RACEV2X'})
+
+    result = preprocessing.load(str(path), chunksize=CHUNKSIZE, year=2020)
+    pd.testing.assert_frame_equal(result, preprocessing.load(dta_path))
+
+
+def test_load_or_build_prunes_outdated_entries(dta_path, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    for name in ['synthetic-0000000000000000', 'synthetic-1111111111111111', 'other-0000000000000000']:
+        (cache_dir / name).mkdir(parents=True)
+
+    path = cache.load_or_build(dta_path, str(cache_dir), return_path=True)
+
+    assert sorted(p.name for p in cache_dir.iterdir()) == sorted(['other-0000000000000000', path.split('/')[-1]])
+    cached, expected = cache.load(path), preprocessing.load(dta_path)
+    assert cached.dtypes.equals(expected.dtypes)  # Same categories, so equal codes mean equal values
+    for name, col in expected.items():
+        values = col.cat.codes if isinstance(col.dtype, pd.CategoricalDtype) else col
+        cached_values = cached[name].cat.codes if isinstance(col.dtype, pd.CategoricalDtype) else cached[name]
+        np.testing.assert_array_equal(np.asarray(cached_values), np.asarray(values))
+    assert cache.load_or_build(dta_path, str(cache_dir), return_path=True) == path
@@ -0,0 +1,87 @@
+# Statistical engines of modules/stats.py against direct reference computations
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import mannwhitneyu
+
+import battery
+import stats
+import variables as v
+
+N_ROWS = 600
+FEATURES = ['A', 'B', 'C', 'Rare']
+
+
+@pytest.fixture(scope='module')
+def mw_frame():
+    """Yes/No features with missing answers, and integer ages (many ties) with missing values."""
+    rng = np.random.default_rng(0)
+    data = {}
+    for feat, p_yes in zip(FEATURES, [0.3, 0.5, 0.2, 0.01]):
+        answers = np.where(rng.random(N_ROWS) < p_yes, v.yes_ans, v.no_ans).astype(object)
+        answers[rng.random(N_ROWS) < 0.1] = None
+        data[feat] = pd.Categorical(answers, categories=[v.yes_ans, v.no_ans])
+    ages = rng.integers(18, 60, N_ROWS).astype(float) + 10 * (data['B'] == v.yes_ans)
+    ages[rng.random(N_ROWS) < 0.05] = np.nan
+    data[v.age_col] = ages
+    return pd.DataFrame(data)
+
+
+def _reference_mannwhitney(df, min_size):
+    """One scipy test per pair, on the rows where both features and the age are known."""
+    p = pd.DataFrame(np.nan, index=FEATURES, columns=FEATURES)
+    diff = pd.DataFrame(0.0, index=FEATURES, columns=FEATURES)
+    for feat1, feat2 in itertools.combinations(FEATURES, 2):
+        sub = df.dropna(subset=[feat1, feat2, v.age_col])
+        x = sub.loc[sub[feat1] == v.yes_ans, v.age_col]
+        y = sub.loc[sub[feat2] == v.yes_ans, v.age_col]
+        if len(x) < min_size or len(y) < min_size:
+            diff.loc[feat1, feat2] = diff.loc[feat2, feat1] = np.nan
+            continue
+        result = mannwhitneyu(x, y, alternative='two-sided', method='asymptotic')
+        p.loc[feat1, feat2] = p.loc[feat2, feat1] = result.pvalue
+        diff.loc[feat1, feat2] = y.median() - x.median()
+        diff.loc[feat2, feat1] = x.median() - y.median()
+    return p, diff
+
+
+@pytest.mark.parametrize('backend', battery.backends)
+def test_pairwise_mannwhitney_equals_scipy_per_pair(mw_frame, backend):
+    expected_p, expected_diff = _reference_mannwhitney(mw_frame, min_size=10)
+    assert expected_p['Rare'].isna().all()  # The min_size cutoff is exercised
+
+    result = stats.pairwise_mannwhitney(mw_frame, FEATURES, v.yes_ans, v.age_col, min_size=10,
+                                        backend=backend, max_workers=3)
+
+    pd.testing.assert_frame_equal(result.p_matrix, expected_p, rtol=1e-9)
+    pd.testing.assert_frame_equal(result.diff_matrix, expected_diff)
+
+
+def test_box_stats_equal_hazen_quartiles_and_clipped_whiskers():
+    rng = np.random.default_rng(1)
+    groups = {
+        'wide': rng.integers(20, 80, 300),
+        'outliers': np.concatenate([rng.integers(40, 50, 100), [5, 6, 95]]),  # Beyond 1.5 IQR
+        'single': np.array([33]),
+        'pair': np.array([30, 41]),
+    }
+    df = pd.DataFrame({
+        'group': np.repeat(list(groups), [len(values) for values in groups.values()]),
+        v.age_col: np.concatenate(list(groups.values())),
+    })
+
+    result = stats.box_stats(stats.contingency(df, 'group', v.age_col))
+
+    for group, values in groups.items():
+        q1, median, q3 = np.percentile(values, [25, 50, 75], method='hazen')
+        iqr = q3 - q1
+        expected = {
+            'q1': q1, 'median': median, 'q3': q3,
+            'lowerfence': min(q1, values[values >= q1 - 1.5 * iqr].min()),
+            'upperfence': max(q3, values[values <= q3 + 1.5 * iqr].max()),
+            'n': len(values),
+        }
+        assert result.loc[group].to_dict() == pytest.approx(expected), group
+    assert result.loc['outliers', 'lowerfence'] > 6 and result.loc['outliers', 'upperfence'] < 95
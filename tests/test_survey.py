@@ -0,0 +1,89 @@
+# Survey totals and proportions against a naive per-stratum, per-PSU computation
+import numpy as np
+import pandas as pd
+import pytest
+
+import survey
+import variables as v
+
+N_ROWS = 2_000
+SEXES = ['1 MALE', '2 FEMALE']
+RACES = ['1 WHITE', '2 BLACK', '3 ASIAN']
+
+
+@pytest.fixture(scope='module')
+def design_frame():
+    """Five strata with 2-4 PSUs each and one stratum with a single PSU; a few missing answers."""
+    rng = np.random.default_rng(0)
+    n_psus = {1: 2, 2: 3, 3: 4, 4: 2, 5: 3, 6: 1}
+    strata = rng.choice(list(n_psus), size=N_ROWS)
+    psus = np.array([rng.integers(1, n_psus[h] + 1) for h in strata])
+    sex = rng.choice(SEXES, size=N_ROWS).astype(object)
+    sex[rng.random(N_ROWS) < 0.03] = None
+    return pd.DataFrame({
+        v.weight_col: rng.gamma(2.0, 5_000.0, N_ROWS),
+        v.strata_col: strata,
+        v.psu_col: psus,
+        v.sex_col: pd.Categorical(sex, categories=SEXES),
+        v.race_col: pd.Categorical(rng.choice(RACES, size=N_ROWS, p=[0.6, 0.3, 0.1]), categories=RACES),
+    })
+
+
+def _naive_variance(df, values):
+    """Sum over strata of n_h / (n_h - 1) * sum over PSUs of squared deviations of the PSU totals."""
+    variance = 0.0
+    for _, stratum in df.assign(value=values).groupby(v.strata_col):
+        z = stratum.groupby(v.psu_col)['value'].sum().to_numpy()
+        if len(z) > 1:
+            variance += len(z) / (len(z) - 1) * ((z - z.mean()) ** 2).sum()
+    return variance
+
+
+def _domain(df, filters):
+    mask = np.ones(len(df), dtype=bool)
+    for col, values in (filters or {}).items():
+        mask &= df[col].isin(values).to_numpy()
+    return mask
+
+
+@pytest.mark.parametrize('filters', [None, {v.race_col: ['2 BLACK', '3 ASIAN']}])
+def test_totals_equal_naive_computation(design_frame, filters):
+    df = design_frame
+    domain = _domain(df, filters)
+    result = survey.totals(df, v.sex_col, filters=filters)
+
+    for sex in SEXES:
+        values = np.where(domain & (df[v.sex_col] == sex).to_numpy(), df[v.weight_col], 0.0)
+        assert result.loc[sex, 'total'] == pytest.approx(values.sum(), rel=1e-12)
+        assert result.loc[sex, 'se'] == pytest.approx(np.sqrt(_naive_variance(df, values)), rel=1e-9)
+        assert result.loc[sex, 'n'] == (values > 0).sum()
+
+
+@pytest.mark.parametrize('filters', [None, {v.sex_col: ['2 FEMALE']}])
+def test_proportions_equal_naive_linearization(design_frame, filters):
+    df = design_frame
+    domain = _domain(df, filters)
+    result = survey.proportions(df, v.sex_col, by=v.race_col, filters=filters)
+
+    known = df[v.sex_col].notna().to_numpy()
+    for race in RACES:
+        group = np.where(domain & known & (df[v.race_col] == race).to_numpy(), df[v.weight_col], 0.0)
+        for sex in SEXES:
+            cell = (df[v.sex_col] == sex).to_numpy() * group
+            p = cell.sum() / group.sum()
+            linearized = (cell - p * group) / group.sum()
+            assert result.loc[(race, sex), 'proportion'] == pytest.approx(p, rel=1e-12)
+            assert result.loc[(race, sex), 'se'] == pytest.approx(np.sqrt(_naive_variance(df, linearized)),
+                                                                  rel=1e-9, abs=1e-15)
+
+
+def test_single_psu_stratum_adds_no_variance(design_frame):
+    df = design_frame
+    single = (df[v.strata_col] == 6).to_numpy()
+    assert single.any()
+
+    # Scaling the weights of the single-PSU stratum changes the totals but not their standard errors
+    reweighted = df.assign(**{v.weight_col: np.where(single, df[v.weight_col] * 3, df[v.weight_col])})
+    before, after = survey.totals(df, v.race_col), survey.totals(reweighted, v.race_col)
+    assert (after['total'] > before['total']).all()
+    np.testing.assert_allclose(after['se'], before['se'], rtol=1e-12)